@@ -1,3 +1,9 @@
 from . import globals
-from . import drawing, comms
-from .emulate import init, Emulator
+from . import comms
+
+try:
+    from . import drawing
+    from .emulate import init, Emulator
+except ImportError:
+    # There's no window without pygame and OpenGL, but hardware.new_machine(..., headless=True) still works
+    pass
@@ -1,4 +1,5 @@
 #include <stdint.h>
+#include <pthread.h>
 #include "hw_manager.h"
 #include "common.h"
 
@@ -30,28 +31,50 @@
 #define NUMREGS              (27)
 #define NUM_EFFECTIVE_REGS   (16)
 
+//The layout of the words from get_all_regs: the registers the current mode sees, the psr and mode on their
+//own, the address of the next instruction, and then every register including all the banked ones
+#define ALL_REGS_EFFECTIVE   (0)
+#define ALL_REGS_CPSR        (ALL_REGS_EFFECTIVE + NUM_EFFECTIVE_REGS)
+#define ALL_REGS_MODE        (ALL_REGS_CPSR + 1)
+#define ALL_REGS_PC          (ALL_REGS_MODE + 1)
+#define ALL_REGS_ACTUAL      (ALL_REGS_PC + 1)
+#define ALL_REGS_SIZE        (ALL_REGS_ACTUAL + NUMREGS)
+
 #define PAGE_SIZE_BITS       (12)
 #define PAGE_SIZE            (1 << PAGE_SIZE_BITS)
 #define PAGE_MASK            (PAGE_SIZE - 1)
 #define NUM_PAGE_TABLES      (1 << (26 - PAGE_SIZE_BITS))
+//Mapped pages are also kept as a list of runs with gaps between them, so there can't be more than this
+#define MAX_MAPPED_REGIONS   (NUM_PAGE_TABLES / 2)
 #define WORDS_PER_PAGE       (1 << (PAGE_SIZE_BITS - 2))
 #define MAX_MEMORY           (1 << 26)
 #define HW_DEVICES_MAX       (64)
+#define MAX_EVENTS           (64)
+//Has to be a power of two
+#define INTERRUPT_QUEUE_SIZE (32)
+//How fast the machine runs by default, for turning the virtual clock in to time
+#define CYCLES_PER_MS        (0x400)
+#define NO_EVENT             UINT64_MAX
 #define MAX_SYMBOLS_SIZE     (0x10000)
 
 #define PAGEOF(addr)         ((addr) >> PAGE_SIZE_BITS)
 #define INPAGE(addr)         ((addr) & PAGE_MASK)
 #define WORDINPAGE(addr)     (INPAGE(addr) >> 2)
-#define DEREF(cpu, addr)     (cpu->page_tables[PAGEOF(addr)]->memory[WORDINPAGE(addr)])
+#define DEREF(cpu, addr)     (*(NULL != (cpu)->physical_ram ? &(cpu)->physical_ram[(addr) >> 2] :       \
+                                &(cpu)->page_tables[PAGEOF(addr)]->memory[WORDINPAGE(addr)]))
 #define SETPC(cpu, newpc)    ((cpu)->regs.actual[PC] = (((cpu)->regs.actual[PC] & 0xfc000003) | ((newpc) & 0x03fffffc)))
 #define GETPC(cpu)              ((cpu)->regs.actual[PC] & 0x03fffffc)
 #define GETREG(cpu, rn)         (*(cpu)->regs.effective[(rn)])
 #define GETUSERREG(cpu, rn)     ((cpu)->regs.actual[(rn)])
 #define SETMODE(cpu, newmode)   ((cpu)->regs.actual[PC] = (((cpu)->regs.actual[PC] & 0xfffffffc) | (newmode)))
 #define GETMODE(cpu)            ((cpu)->regs.actual[PC]  &0x3)
-#define GETPSR(cpu)             ((cpu)->regs.actual[PC] & 0xfc000000)
-#define SETPSR(cpu, newpsr)     ((cpu)->regs.actual[PC] = (((cpu)->regs.actual[PC] & 0x03ffffff) | (newpsr)))
-#define GETMODEPSR(cpu)         ((cpu)->regs.actual[PC] & 0xfc000003)
+#define GETPSR(cpu)             (MATERIALISE_FLAGS(cpu), (cpu)->regs.actual[PC] & 0xfc000000)
+#define SETPSR(cpu, newpsr)     ((cpu)->lazy.op = LAZY_NONE,                                    \
+                                 (cpu)->regs.actual[PC] = (((cpu)->regs.actual[PC] & 0x03ffffff) | (newpsr)))
+#define GETMODEPSR(cpu)         (MATERIALISE_FLAGS(cpu), (cpu)->regs.actual[PC] & 0xfc000003)
+//The condition flags in regs.actual[PC] can be out of date while cpu->lazy has something pending. Anything
+//that reads them directly rather than through GETPSR or GETMODEPSR has to do this first
+#define MATERIALISE_FLAGS(cpu)  ((cpu)->lazy.op != LAZY_NONE ? materialise_flags(cpu) : (void)0)
 #define SETFLAG(cpu, flag)      ((cpu)->regs.actual[PC] |= FLAG_##flag)
 #define SETPIN(cpu, pin)        ((cpu)->pins |= PIN_##pin)
 #define CLEARPIN(cpu, pin)      ((cpu)->pins &= (~(PIN_##pin)))
@@ -59,6 +82,27 @@
 #define CLEARCPUFLAG(cpu, flag) ((cpu)->flags &= (~FLAG_##flag))
 #define HASCPUFLAG(cpu, flag)   ((cpu)->flags &  FLAG_##flag)
 
+//Any write to a page that might hold code has to throw away the decoded copy of the word it changes. Every
+//instruction in a block has a decoded entry, so if we clear one the page's blocks are stale too
+#define INVALIDATE_DECODED(page, addr) do {                             \
+        if( NULL != (page)->decoded &&                                  \
+            NULL != (page)->decoded[WORDINPAGE(addr)].handler ) {       \
+            (page)->decoded[WORDINPAGE(addr)].handler = NULL;           \
+            (page)->blocks_stale = 1;                                   \
+        }                                                               \
+    } while(0)
+
+//Pages of memory that belong to a device have a word saying which of their DIRTY_LINE_SIZE byte lines have
+//been written since the device last looked, so it can catch up with all of them at once instead of being
+//called for every store. Every store to such a page has to go through here, like INVALIDATE_DECODED
+#define DIRTY_LINE_BITS      (6)
+#define DIRTY_LINE_SIZE      (1 << DIRTY_LINE_BITS)
+#define MARK_DIRTY(page, addr) do {                                     \
+        if( NULL != (page)->dirty ) {                                   \
+            *(page)->dirty |= 1ULL << (INPAGE(addr) >> DIRTY_LINE_BITS); \
+        }                                                               \
+    } while(0)
+
 
 // We use a bitmask for breakpoints. There are 2**26 bytes of addressable memory, 2**24 aligned words which
 // could have a breakpoint, and since we can store 8 of those per byte of memory, we need 2**21 or 2 megabytes
@@ -66,18 +110,37 @@
 // hang around in cache so that we don't slow down too much. We use mmap to allocate it so that underlying
 // memory is only used in pages that are touched
 #define BP_BITMASK_SIZE (UINT32_C(1) << (26 - 5))
-#define HAS_BREAKPOINT(cpu, pc) (cpu->breakpoint_bitmask[ (pc) >> (2+6) ] >> ( ((pc) >> 2) & 0x3f )) & 1
+#define HAS_BREAKPOINT(cpu, pc) ((cpu->breakpoint_bitmask[ (pc) >> (2+6) ] >> ( ((pc) >> 2) & 0x3f )) & 1)
 #define SET_BREAKPOINT(cpu, pc) (cpu->breakpoint_bitmask[ (pc) >> (2+6) ] |= (UINT64_C(1) << ( ((pc) >> 2) & 0x3f )))
 #define CLEAR_BREAKPOINT(cpu, pc) (cpu->breakpoint_bitmask[ (pc) >> (2+6) ] &= ~(UINT64_C(1) << ( ((pc) >> 2) & 0x3f )))
 
-#define HAS_WATCHPOINT(cpu, type, a) (cpu->watchpoint_bitmask[type##_WATCHPOINT][ (a) >> (2+6) ] >> ( ((a) >> 2) & 0x3f )) & 1
+#define HAS_WATCHPOINT(cpu, type, a) ((cpu->watchpoint_bitmask[type##_WATCHPOINT][ (a) >> (2+6) ] >> ( ((a) >> 2) & 0x3f )) & 1)
 
 #define SET_WATCHPOINT(cpu, type, a) (cpu->watchpoint_bitmask[type##_WATCHPOINT][ (a) >> (2+6) ] |= (UINT64_C(1) << ( ((a) >> 2) & 0x3f )))
 
 #define CLEAR_WATCHPOINT(cpu, type, a) (cpu->watchpoint_bitmask[type##_WATCHPOINT][ (a) >> (2+6) ] &= ~(UINT64_C(1) << ( ((a) >> 2) & 0x3f )))
 
-#define HAS_READ_WATCHPOINT(cpu, a) HAS_WATCHPOINT(cpu, READ, a)
-#define HAS_WRITE_WATCHPOINT(cpu, a) HAS_WATCHPOINT(cpu, WRITE, a)
+// RAM pages all live in one mapping of the whole address space, physical_ram, with a page's memory pointing
+// into it at its own address. That lets loads and stores to plain RAM skip the page_info altogether, so we
+// keep a bit per page for where that's safe: ram_readable for pages that any mode can read, and
+// ram_writable for pages that any mode can write and that have nothing decoded in them that a write would
+// need to throw away. Device pages and unmapped pages are never in either, and if the mapping couldn't be
+// made fault() falls back to a mapping per page and leaves both empty
+#define RAM_BITMASK_SIZE (NUM_PAGE_TABLES / 64)
+#define PAGE_BIT(bm, addr)           (((bm)[PAGEOF(addr) >> 6] >> (PAGEOF(addr) & 0x3f)) & 1)
+#define SET_PAGE_BIT(bm, page_num)   ((bm)[(page_num) >> 6] |= (UINT64_C(1) << ((page_num) & 0x3f)))
+#define CLEAR_PAGE_BIT(bm, page_num) ((bm)[(page_num) >> 6] &= ~(UINT64_C(1) << ((page_num) & 0x3f)))
+#define RAM_READABLE(cpu, addr)      PAGE_BIT((cpu)->ram_readable, addr)
+#define RAM_WRITABLE(cpu, addr)      PAGE_BIT((cpu)->ram_writable, addr)
+
+// Almost nobody has a debugger attached, so we count how many of each kind are set and only look in the
+// bitmasks when there are some. FLAG_DEBUG is set in cpu->flags whenever any are, and the interpreter runs a
+// loop without any of these checks while it's clear
+#define BREAKPOINT_AT(cpu, pc) ((cpu)->num_breakpoints && HAS_BREAKPOINT(cpu, pc))
+#define WATCHPOINTS_SET(cpu, type) ((cpu)->num_watchpoints[type##_WATCHPOINT])
+
+#define HAS_READ_WATCHPOINT(cpu, a) (WATCHPOINTS_SET(cpu, READ) && HAS_WATCHPOINT(cpu, READ, a))
+#define HAS_WRITE_WATCHPOINT(cpu, a) (WATCHPOINTS_SET(cpu, WRITE) && HAS_WATCHPOINT(cpu, WRITE, a))
 #define SET_READ_WATCHPOINT(cpu, a) SET_WATCHPOINT(cpu, READ, a)
 #define SET_WRITE_WATCHPOINT(cpu, a) SET_WATCHPOINT(cpu, WRITE, a)
 #define CLEAR_READ_WATCHPOINT(cpu, a) CLEAR_WATCHPOINT(cpu, READ, a)
@@ -126,6 +189,23 @@
 
 #define CONDITION_BITS(x) ((x) >> 28)
 
+#define ALU_TYPE_IMM   0x02000000
+#define MUL_TYPE_MLA   0x00200000
+#define ALU_SETS_FLAGS 0x00100000
+
+#define SDT_REGISTER   ALU_TYPE_IMM
+#define SDT_PREINDEX   0x01000000
+#define SDT_OFFSET_ADD 0x00800000
+#define SDT_LOAD_BYTE  0x00400000
+#define SDT_WRITE_BACK 0x00200000
+#define SDT_LDR        0x00100000
+
+#define MDT_LDM        SDT_LDR
+#define MDT_WRITE_BACK SDT_WRITE_BACK
+#define MDT_HAT        SDT_LOAD_BYTE
+#define MDT_OFFSET_ADD SDT_OFFSET_ADD
+#define MDT_PREINDEX   SDT_PREINDEX
+
 #define MODE_USR 0
 #define MODE_FIQ 1
 #define MODE_IRQ 2
@@ -134,6 +214,9 @@
 #define FLAG_INIT 1
 #define FLAG_WAIT 2
 #define FLAG_WATCHPOINT 4
+#define FLAG_DEBUG 8
+//Set while run_armv2 has been asked to run forever, as the engines only see it a slice at a time
+#define FLAG_FOREVER 16
 #define CPU_INITIALISED(cpu) ( (((cpu)->flags) & FLAG_INIT) )
 #define WAITING(cpu) ( (((cpu)->flags) & FLAG_WAIT) )
 
@@ -167,9 +250,104 @@ struct regs {
 
 typedef uint32_t (*access_callback_t)(void *extra, uint32_t addr, uint32_t value);
 typedef uint32_t (*operation_callback_t)(void *extra, uint32_t arg0, uint32_t arg1);
+//Called from run_armv2 once the cpu has run for as long as was asked of schedule_event. Returning non-zero
+//schedules it again that many cycles later
+typedef uint64_t (*event_callback_t)(void *extra, uint64_t cycles);
+
+struct armv2;
+struct decoded_instruction;
+typedef enum armv2_exception (*instruction_handler_t)(struct armv2 *cpu, const struct decoded_instruction *op);
+
+// An instruction word that has already been through the decoder. The register fields are named after where
+// they sit in a data processing instruction (rn is bits 16-19, rd 12-15, rs 8-11 and rm 0-3) whatever the
+// instruction class, so the multiply handler for example finds its destination in rn. imm holds whatever
+// constant the handler would otherwise have to work out each time: the rotated immediate for an ALU
+// instruction, the offset for an immediate LDR/STR, the byte offset for a branch and the number of registers
+// for an LDM/STM
+struct decoded_instruction {
+    instruction_handler_t handler;
+    uint32_t              instruction;
+    uint32_t              imm;
+    uint8_t               opcode;
+    uint8_t               rn;
+    uint8_t               rd;
+    uint8_t               rs;
+    uint8_t               rm;
+};
+
+// A straight line run of instructions from one page, ending at anything that might write the PC. The run
+// loop in block mode executes a whole block before it looks at the interrupt pins again. chain remembers
+// blocks in the same page that we've gone on to after this one, which saves looking them up next time;
+// they're only ever in the same page so that throwing away a page's blocks can't leave anything pointing
+// at them
+#define MAX_BLOCK_LENGTH (32)
+#define BLOCK_CHAINS     (2)
+
+typedef void (*jit_function_t)(struct armv2 *cpu);
+
+struct block {
+    struct page_info          *page;
+    uint32_t                   start;
+    uint32_t                   length;
+    struct block              *chain[BLOCK_CHAINS];
+    //In EXEC_JIT mode a block that has run jit_threshold times gets the leading instructions that the
+    //code generator understands compiled into jit, which does the work of the first jit_length ops
+    uint32_t                   executions;
+    uint32_t                   jit_length;
+    jit_function_t             jit;
+    //Set for a loop back to start that does nothing but read memory and work in registers. If one trip round
+    //it changes nothing, it's waiting for a device or an interrupt and run_armv2 returns ARMV2STATUS_IDLE
+    uint32_t                   idle_candidate;
+    struct decoded_instruction ops[];
+};
+
+// Most instructions that set the flags have them overwritten by another before anything looks at them, so
+// alu_instruction and multiply_instruction just record what they did here and the flags are worked out
+// from it when they're needed. For LAZY_ARITHMETIC the result was op1 + op2 + carry_in, which is enough
+// to get all four. For LAZY_LOGICAL only N and Z are pending, C and V in the PSR are already right
+enum lazy_flags_op {
+    LAZY_NONE       = 0,
+    LAZY_ARITHMETIC = 1,
+    LAZY_LOGICAL    = 2,
+};
+
+struct lazy_flags {
+    enum lazy_flags_op op;
+    uint32_t           result;
+    uint32_t           op1;
+    uint32_t           op2;
+    uint32_t           carry_in;
+};
+
+enum exec_mode {
+    EXEC_INTERPRETER = 0,
+    EXEC_BLOCKS      = 1,
+    EXEC_JIT         = 2,
+    EXEC_MAX,
+};
+
+//The generated code goes in one buffer per cpu which we only ever append to. When it fills up we throw
+//away every block and start again
+#define JIT_BUFFER_SIZE   (1 << 20)
+#define JIT_THRESHOLD     (64)
+
+struct jit_buffer {
+    uint8_t  *code;
+    uint32_t  used;
+    uint32_t  full;
+};
 
 struct page_info {
     uint32_t          *memory;
+    //Lazily allocated the first time we execute from the page, with an entry per word. A NULL handler means
+    //the entry needs decoding, so writing to a word only needs to clear that
+    struct decoded_instruction *decoded;
+    //The blocks starting in this page, indexed by word and also allocated lazily. Writing over any of them
+    //only sets blocks_stale, and the run loop throws them all away the next time it looks in the page
+    struct block     **blocks;
+    uint32_t           blocks_stale;
+    //Only set for pages of a device's own memory, see MARK_DIRTY
+    uint64_t          *dirty;
     struct hardware_device *mapped_device;
     access_callback_t  read_callback;
     access_callback_t  write_callback;
@@ -178,7 +356,7 @@ struct page_info {
     uint32_t           flags;
 };
 
-struct armv2_t;
+struct armv2;
 
 struct region {
     uint32_t start;
@@ -193,9 +371,53 @@ struct hardware_device {
     access_callback_t read_byte_callback;
     access_callback_t write_byte_callback;
     operation_callback_t operation_callback;
-    struct armv2_t *cpu;
+    struct armv2 *cpu;
     struct region mapped;
     void *extra;
+    //A device can have memory of its own. Each page of the mapping with its bit set in ram_pages is then the
+    //matching page of memory, accessed like RAM with no callbacks, and stores to it mark the matching word of
+    //dirty. The pages without their bit set still go through the callbacks
+    uint32_t *memory;
+    uint64_t *dirty;
+    uint64_t  ram_pages;
+};
+
+//Interrupts wait here until the cpu takes them. Any thread can add one with interrupt(), but only the cpu's
+//own run takes them off. Each entry's sequence says whether it's free for the poster at that position
+//(sequence == position), or filled in for the cpu to take (sequence == position + 1)
+struct interrupt_entry {
+    uint32_t sequence;
+    uint32_t id;
+    uint32_t code;
+};
+
+struct interrupt_queue {
+    uint32_t               head;
+    uint32_t               tail;
+    struct interrupt_entry entries[INTERRUPT_QUEUE_SIZE];
+};
+
+//Everything about a cpu that the guest can change, from snapshot_armv2. The RAM is in a file, see snapshot.c
+struct armv2_snapshot {
+    int          ram_fd;
+    uint32_t     num_pages;
+    //The PERM_ flags of each page of RAM that was mapped, 0 for the ones that weren't
+    uint32_t     page_flags[NUM_PAGE_TABLES];
+    uint32_t     regs[NUMREGS];
+    uint32_t     pc;
+    uint32_t     flags;
+    uint32_t     pins;
+    hw_manager_t hardware_manager;
+    uint64_t     cycles;
+    //What was waiting in the interrupt queue, from the front
+    uint32_t     num_interrupts;
+    struct interrupt_entry interrupts[INTERRUPT_QUEUE_SIZE];
+};
+
+struct armv2_event {
+    uint64_t         deadline;
+    event_callback_t callback;
+    void            *extra;
 };
 
 struct hardware_mapping {
@@ -218,15 +440,24 @@ enum watchpoint_type {
 
 struct armv2 {
     struct regs               regs; //storage for all the registers
-    //uint32_t                 *physical_ram; //TODO: mmap here first and assign later
+    uint32_t                 *physical_ram;
     uint32_t                  physical_ram_size;
     uint32_t                  free_ram;
     uint32_t                  num_hardware_devices;
     struct page_info         *page_tables[NUM_PAGE_TABLES];
+    //The runs of pages in page_tables, sorted by address, and a count of how many times they've changed so
+    //anyone keeping a copy knows when it's out of date
+    struct region             mapped_regions[MAX_MAPPED_REGIONS];
+    uint32_t                  num_mapped_regions;
+    uint32_t                  map_generation;
+    uint64_t                  ram_readable[RAM_BITMASK_SIZE];
+    uint64_t                  ram_writable[RAM_BITMASK_SIZE];
     struct exception_handler  exception_handlers[EXCEPT_MAX];
     struct hardware_device   *hardware_devices[HW_DEVICES_MAX];
     uint64_t                  *breakpoint_bitmask;
     uint64_t                  *watchpoint_bitmask[MAX_WATCHPOINT];
+    uint32_t                  num_breakpoints;
+    uint32_t                  num_watchpoints[MAX_WATCHPOINT];
     hw_manager_t              hardware_manager;
     struct hardware_mapping  *hw_mappings;
     struct region             boot_rom;
@@ -236,14 +467,56 @@ struct armv2 {
     uint32_t                  flags;
     //simulating hardware pins:
     uint32_t                  pins;
+    struct lazy_flags         lazy;
+    enum exec_mode            exec_mode;
+    struct jit_buffer         jit;
+    //How many times a block runs before we compile it
+    uint32_t                  jit_threshold;
+    //Instructions we were asked to run but didn't because we were waiting for an interrupt or stuck in an
+    //idle loop
+    uint64_t                  skipped_cycles;
+    //The virtual clock, in instructions run plus the ones skipped while waiting for something to happen.
+    //Devices schedule events against it, kept as a min-heap on deadline with the soonest in next_event
+    uint64_t                  cycles;
+    uint64_t                  next_event;
+    struct armv2_event        events[MAX_EVENTS];
+    uint32_t                  num_events;
+    struct interrupt_queue    interrupts;
+};
+
+//One cpu's share of a pool run: how many instructions to run it for going in, and what it stopped with and
+//how many were left coming out, the same as run_armv2
+struct pool_job {
+    struct armv2      *cpu;
+    int32_t            instructions;
+    enum armv2_status  status;
+};
+
+//A fixed set of threads for running lots of cpus at once. Each pool_run hands the jobs out to whichever
+//thread is free next, and a cpu only ever has one thread in it at a time
+struct armv2_pool {
+    pthread_t        *threads;
+    uint32_t          num_threads;
+    pthread_mutex_t   lock;
+    pthread_cond_t    work;
+    pthread_cond_t    done;
+    struct pool_job  *jobs;
+    uint32_t          num_jobs;
+    uint32_t          next_job;
+    uint32_t          jobs_left;
+    int               quit;
 };
 
-typedef enum armv2_exception (*instruction_handler_t)(struct armv2 *cpu, uint32_t instruction);
 enum armv2_status init(struct armv2 *cpu, uint32_t memsize);
 enum armv2_status load_rom(struct armv2 *cpu, const char *filename);
 enum armv2_status cleanup_armv2(struct armv2 *cpu);
 enum armv2_status run_armv2(struct armv2 *cpu, int32_t *instructions);
 enum armv2_status fault(struct armv2 *cpu, uint32_t addr);
+enum armv2_status release_page(struct armv2 *cpu, uint32_t addr);
+enum armv2_status read_block(struct armv2 *cpu, uint32_t addr, uint32_t len, uint8_t *buf);
+enum armv2_status write_block(struct armv2 *cpu, uint32_t addr, uint32_t len, const uint8_t *buf);
+enum armv2_status get_all_regs(struct armv2 *cpu, uint32_t *regs);
+enum armv2_status set_all_regs(struct armv2 *cpu, const uint32_t *regs);
 enum armv2_status add_hardware(struct armv2 *cpu, struct hardware_device *device);
 enum armv2_status map_memory(struct armv2 *cpu, uint32_t device_num, uint32_t start, uint32_t end);
 enum armv2_status add_mapping(struct hardware_mapping **head, struct hardware_mapping *item);
@@ -254,18 +527,39 @@ enum armv2_status set_watchpoint(struct armv2 *cpu, enum watchpoint_type type, u
 enum armv2_status unset_watchpoint(struct armv2 *cpu, enum watchpoint_type type, uint32_t addr);
 enum armv2_status reset_breakpoints(struct armv2 *cpu);
 enum armv2_status reset_watchpoints(struct armv2 *cpu);
+enum armv2_status set_exec_mode(struct armv2 *cpu, enum exec_mode mode);
+enum armv2_status pool_init(struct armv2_pool *pool, uint32_t num_threads);
+enum armv2_status pool_run(struct armv2_pool *pool, struct pool_job *jobs, uint32_t num_jobs);
+enum armv2_status pool_cleanup(struct armv2_pool *pool);
+enum armv2_status snapshot_armv2(struct armv2 *cpu, struct armv2_snapshot *snapshot);
+enum armv2_status restore_armv2(struct armv2 *cpu, const struct armv2_snapshot *snapshot);
+enum armv2_status schedule_event(struct armv2 *cpu, uint64_t delay, event_callback_t callback, void *extra);
+enum armv2_status cancel_events(struct armv2 *cpu, event_callback_t callback, void *extra);
+void run_events(struct armv2 *cpu);
+enum armv2_status clone_armv2(struct armv2 *clone, struct armv2 *cpu, const struct armv2_snapshot *snapshot);
+enum armv2_status snapshot_cleanup(struct armv2_snapshot *snapshot);
+void materialise_flags(struct armv2 *cpu);
+void bank_registers(struct armv2 *cpu);
+void region_index_add(struct armv2 *cpu, uint32_t page_num);
+void region_index_remove(struct armv2 *cpu, uint32_t page_num);
+void decode_instruction(struct decoded_instruction *op, uint32_t instruction);
+struct decoded_instruction *decoded_page(struct armv2 *cpu, struct page_info *page, uint32_t addr);
+void flush_blocks(struct page_info *page);
+void flush_all_blocks(struct armv2 *cpu);
+void jit_compile(struct armv2 *cpu, struct block *block);
+void jit_cleanup(struct armv2 *cpu);
 
 //instruction handlers
-enum armv2_exception alu_instruction                           (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception multiply_instruction                      (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception swap_instruction                          (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception single_data_transfer_instruction          (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception branch_instruction                        (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception multi_data_transfer_instruction           (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception software_interrupt_instruction            (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception coprocessor_data_transfer_instruction     (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception coprocessor_register_transfer_instruction (struct armv2 *cpu, uint32_t instruction);
-enum armv2_exception coprocessor_data_operation_instruction    (struct armv2 *cpu, uint32_t instruction);
+enum armv2_exception alu_instruction                           (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception multiply_instruction                      (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception swap_instruction                          (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception single_data_transfer_instruction          (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception branch_instruction                        (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception multi_data_transfer_instruction           (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception software_interrupt_instruction            (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception coprocessor_data_transfer_instruction     (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception coprocessor_register_transfer_instruction (struct armv2 *cpu, const struct decoded_instruction *op);
+enum armv2_exception coprocessor_data_operation_instruction    (struct armv2 *cpu, const struct decoded_instruction *op);
 
 #define COPROCESSOR_HW_MANAGER (1)
 #define COPROCESSOR_MMU        (2)
@@ -1,14 +1,26 @@
 # cython: language_level=3
 cimport carmv2
-from libc.stdint cimport uint32_t, int64_t, int32_t
-from libc.stdlib cimport malloc, free
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, int64_t, int32_t
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy, memset
+from libc.time cimport time
+from cpython.buffer cimport PyBuffer_FillInfo
+import array
+import atexit
+import collections
 import itertools
+import os
+import random
+import struct
+import sys
 import threading
 
 NUMREGS            = carmv2.NUMREGS
 NUM_EFFECTIVE_REGS = carmv2.NUM_EFFECTIVE_REGS
 MAX_26BIT          = 1<<26
 SWI_BREAKPOINT     = carmv2.SWI_BREAKPOINT
+DIRTY_LINE_SIZE    = carmv2.DIRTY_LINE_SIZE
+CYCLES_PER_MS      = carmv2.CYCLES_PER_MS
 
 class CpuExceptions:
     RESET                 = carmv2.EXCEPT_RST
@@ -29,16 +41,31 @@ class Status:
     IO_ERROR           = carmv2.ARMV2STATUS_IO_ERROR
     BREAKPOINT         = carmv2.ARMV2STATUS_BREAKPOINT
     WAIT_FOR_INTERRUPT = carmv2.ARMV2STATUS_WAIT_FOR_INTERRUPT
+    IDLE               = carmv2.ARMV2STATUS_IDLE
 
 class WatchpointType:
     WRITE  = carmv2.WRITE_WATCHPOINT
     READ   = carmv2.READ_WATCHPOINT
     ACCESS = carmv2.ACCESS_WATCHPOINT
 
+class ExecMode:
+    INTERPRETER = carmv2.EXEC_INTERPRETER
+    BLOCKS      = carmv2.EXEC_BLOCKS
+    JIT         = carmv2.EXEC_JIT
+
 class Pins:
     INTERRUPT      = carmv2.PIN_I
     FAST_INTERRUPT = carmv2.PIN_F
 
+class AllRegs:
+    #Where things are in the array from Armv2.get_all_regs
+    EFFECTIVE = carmv2.ALL_REGS_EFFECTIVE
+    CPSR      = carmv2.ALL_REGS_CPSR
+    MODE      = carmv2.ALL_REGS_MODE
+    PC        = carmv2.ALL_REGS_PC
+    ACTUAL    = carmv2.ALL_REGS_ACTUAL
+    SIZE      = carmv2.ALL_REGS_SIZE
+
 def PAGEOF(addr):
     return addr>>carmv2.PAGE_SIZE_BITS
 
@@ -79,15 +106,17 @@ class Registers(object):
 
     def __getitem__(self,index):
         if isinstance(index,slice):
-            indices = index.indices(NUM_EFFECTIVE_REGS)
-            return [self.cpu.getregs(i) for i in xrange(*indices)]
+            regs = self.cpu.get_all_regs()
+            return list(regs[AllRegs.EFFECTIVE:AllRegs.EFFECTIVE + NUM_EFFECTIVE_REGS][index])
         return self.cpu.getregs(index)
 
     def __setitem__(self,index,value):
         if isinstance(index,slice):
             indices = index.indices(NUM_EFFECTIVE_REGS)
+            regs = self.cpu.get_all_regs()
             for i in xrange(*indices):
-                self.cpu.setregs(i,value[i])
+                regs[AllRegs.EFFECTIVE + i] = value[i]
+            self.cpu.set_all_regs(regs)
             return
         return self.cpu.setregs(index,value)
 
@@ -105,6 +134,8 @@ class ByteMemory(object):
     def __getitem__(self,index):
         if isinstance(index,slice):
             indices = index.indices(MAX_26BIT)
+            if indices[2] == 1:
+                return self.cpu.read_block(indices[0], max(indices[1] - indices[0], 0))
             indices = xrange(*indices)
             return bytearray(self.getter(index) for index in indices)
         else:
@@ -113,17 +144,17 @@ class ByteMemory(object):
 
 
     def __setitem__(self,index,values):
-        debug_log(f'Write_entry v={values} to i={index}')
         if isinstance(index,slice):
             indices = index.indices(MAX_26BIT)
+            if indices[2] == 1 and len(values) == max(indices[1] - indices[0], 0):
+                self.cpu.write_block(indices[0], values)
+                return
             indices = xrange(*indices)
         else:
             indices = (index,)
             values  = (values,)
         #try:
-        debug_log(f'Write v={values} to i={indices}')
         for i,v in itertools.zip_longest(indices,values):
-            debug_log(f'Write v={v} to i={i}')
             self.setter(i,v)
         #except TypeError:
         #    raise ValueError('Wrong values sequence length')
@@ -152,6 +183,9 @@ class WordMemory(object):
         if isinstance(index,slice):
             indices = index.indices(MAX_26BIT)
             indices = xrange(*indices)
+            if indices.step == 4 and (indices.start & 3) == 0 and len(values) == len(indices):
+                self.cpu.write_block(indices.start, struct.pack(f'<{len(values)}I', *values))
+                return
         else:
             indices = (index,)
             values  = (values,)
@@ -182,9 +216,14 @@ cdef class Device:
         self.cdevice.read_byte_callback = <carmv2.access_callback_t>self.read_byte;
         self.cdevice.write_byte_callback = <carmv2.access_callback_t>self.write_byte;
         self.cdevice.operation_callback = <carmv2.operation_callback_t>self.operation;
-        self.cdevice.cpu = <carmv2.armv2*>args[0].cpu
+        self.cdevice.extra = <void*>self
+        #Set when it's added to a cpu
+        self.cdevice.cpu = NULL
         self.cdevice.mapped.start = 0
         self.cdevice.mapped.end = 0
+        self.cdevice.memory = NULL
+        self.cdevice.dirty = NULL
+        self.cdevice.ram_pages = 0
         if self.cdevice == NULL:
             raise MemoryError()
 
@@ -219,10 +258,34 @@ cdef class Device:
             if self.operation_callback:
                 return self.operation_callback(int(arg0), int(arg1))
 
+    def schedule(self, delay):
+        #Have event called once the cpu we've been added to has run delay more cycles, see events.c
+        if self.cdevice.cpu == NULL:
+            raise ValueError('The device has not been added to a cpu')
+        result = carmv2.schedule_event(self.cdevice.cpu, delay, device_event, <void*>self)
+        if result == carmv2.ARMV2STATUS_MEMORY_ERROR:
+            raise MemoryError()
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+
+    def cancel_events(self):
+        if self.cdevice.cpu != NULL:
+            carmv2.cancel_events(self.cdevice.cpu, device_event, <void*>self)
+
+    def event(self, cycles):
+        #Called from the cpu's run when something this device scheduled is due. Return how many cycles until
+        #it should be called again, or 0 for never
+        return 0
+
     def __dealloc__(self):
         if self.cdevice != NULL:
             free(self.cdevice)
 
+    def copy_from(self, Device other):
+        #Take on other's state, for Armv2.clone. Only native devices have any state of their own here, so
+        #a Python device that wants its clones to start where it is has to override this
+        pass
+
     def __init__(self,cpu):
         self.cpu = cpu
 
@@ -232,6 +295,231 @@ cdef class Device:
     cdef carmv2.hardware_device *GetDevice(self):
         return self.cdevice
 
+cdef uint64_t device_event(void *extra, uint64_t cycles) nogil:
+    with gil:
+        return (<Device>extra).event(cycles) or 0
+
+cdef class NativeDevice(Device):
+    #A device whose memory accesses are handled by C functions working on C state, so that the cpu can use it
+    #without taking the GIL, and from any thread. A subclass points cdevice's callbacks at its own nogil
+    #functions and cdevice.extra at its state in __cinit__. The rest of the device, e.g. pressing a key or
+    #drawing the screen, can still be Python working on the same state with the GIL held
+    pass
+
+cdef uint32_t read_bytewise(carmv2.access_callback_t read_byte, void *extra, uint32_t addr) nogil:
+    cdef uint32_t out = 0
+    cdef uint32_t i
+    for i in range(4):
+        out |= (read_byte(extra, addr + i, 0) & 0xff) << (i * 8)
+    return out
+
+cdef uint32_t ignore_write(void *extra, uint32_t addr, uint32_t value) nogil:
+    return 0
+
+#Keyboard
+cdef enum:
+    KEYBOARD_RINGBUFFER_START = 0x20
+    KEYBOARD_RINGBUFFER_SIZE  = 128
+    KEYBOARD_RINGBUFFER_POS   = KEYBOARD_RINGBUFFER_START + KEYBOARD_RINGBUFFER_SIZE
+
+cdef struct keyboard_state:
+    uint8_t key_state[KEYBOARD_RINGBUFFER_START]
+    uint8_t ring_buffer[KEYBOARD_RINGBUFFER_SIZE]
+    uint8_t pos
+
+cdef uint32_t keyboard_read_byte(void *extra, uint32_t addr, uint32_t value) nogil:
+    cdef keyboard_state *state = <keyboard_state*>extra
+    if addr < KEYBOARD_RINGBUFFER_START:
+        return state.key_state[addr]
+    elif addr < KEYBOARD_RINGBUFFER_POS:
+        return state.ring_buffer[addr - KEYBOARD_RINGBUFFER_START]
+    elif addr == KEYBOARD_RINGBUFFER_POS:
+        return state.pos
+    return 0
+
+cdef uint32_t keyboard_read(void *extra, uint32_t addr, uint32_t value) nogil:
+    return read_bytewise(keyboard_read_byte, extra, addr)
+
+cdef class KeyboardDevice(NativeDevice):
+    #The memory of the keyboard in hardware.Keyboard. Keys are ascii codes, so they're all below 256
+    cdef keyboard_state state
+
+    def __cinit__(self, *args, **kwargs):
+        memset(&self.state, 0, sizeof(self.state))
+        self.cdevice.extra = &self.state
+        self.cdevice.read_callback = keyboard_read
+        self.cdevice.read_byte_callback = keyboard_read_byte
+        self.cdevice.write_callback = ignore_write
+        self.cdevice.write_byte_callback = ignore_write
+
+    def press(self, uint8_t key):
+        self.state.key_state[key >> 3] |= 1 << (key & 7)
+        self.state.ring_buffer[self.state.pos] = key
+        self.state.pos = (self.state.pos + 1) % KEYBOARD_RINGBUFFER_SIZE
+
+    def release(self, uint8_t key):
+        self.state.key_state[key >> 3] &= ~(1 << (key & 7))
+
+    def copy_from(self, Device other):
+        cdef KeyboardDevice keyboard = <KeyboardDevice?>other
+        memcpy(&self.state, &keyboard.state, sizeof(self.state))
+
+#Display
+cdef enum:
+    DISPLAY_WIDTH              = 40
+    DISPLAY_HEIGHT             = 30
+    DISPLAY_CELLS              = DISPLAY_WIDTH * DISPLAY_HEIGHT
+    DISPLAY_CELL_SIZE          = 8
+    DISPLAY_ROW_BYTES          = DISPLAY_WIDTH
+    DISPLAY_PIXEL_ROWS         = DISPLAY_HEIGHT * DISPLAY_CELL_SIZE
+    DISPLAY_LETTER_START       = DISPLAY_CELLS
+    DISPLAY_LETTER_END         = DISPLAY_CELLS * 2
+    DISPLAY_FONT_START         = DISPLAY_LETTER_END
+    DISPLAY_FONT_END           = DISPLAY_FONT_START + 0x100 * 8
+    DISPLAY_FIXED_FONT_END     = DISPLAY_FONT_START + 0x80 * 8
+    DISPLAY_FRAME_BUFFER_START = DISPLAY_FONT_END
+    DISPLAY_FRAME_BUFFER_END   = DISPLAY_FRAME_BUFFER_START + DISPLAY_ROW_BYTES * DISPLAY_PIXEL_ROWS
+    DISPLAY_RNG                = DISPLAY_FRAME_BUFFER_END
+    DISPLAY_TIME               = DISPLAY_RNG + 4
+    DISPLAY_PAGES              = 4
+    DISPLAY_MEMORY_SIZE        = DISPLAY_PAGES * carmv2.PAGE_SIZE
+    #Every page is plain memory except the first, as the fixed half of the font is in it, and the last, as
+    #that's where the RNG is
+    DISPLAY_RAM_PAGES          = ((1 << (DISPLAY_RNG >> carmv2.PAGE_SIZE_BITS)) - 1) & ~1
+
+cdef struct display_state:
+    #Exactly what the cpu sees, so the frame buffer is from the top down
+    uint32_t memory[DISPLAY_MEMORY_SIZE >> 2]
+    uint64_t dirty[DISPLAY_PAGES]
+    uint64_t rng
+    #When the cpu's clock started, in seconds since 1970
+    uint32_t epoch
+    carmv2.hardware_device *device
+
+cdef void display_mark_dirty(display_state *state, uint32_t addr) nogil:
+    state.dirty[addr >> carmv2.PAGE_SIZE_BITS] |= (<uint64_t>1) << ((addr & (carmv2.PAGE_SIZE - 1)) >> carmv2.DIRTY_LINE_BITS)
+
+cdef uint32_t display_random(display_state *state) nogil:
+    #xorshift64*, there's nothing riding on it
+    state.rng ^= state.rng >> 12
+    state.rng ^= state.rng << 25
+    state.rng ^= state.rng >> 27
+    return <uint32_t>((state.rng * <uint64_t>0x2545f4914f6cdd1d) >> 32)
+
+#The callbacks are only used for the pages that aren't plain memory, so they just have to look after the
+#registers and the fixed half of the font, and otherwise do what the core does for the rest
+cdef inline bint display_writable(uint32_t addr) nogil:
+    #Writes to the fixed half of the font are ignored without error
+    return addr < DISPLAY_FRAME_BUFFER_END and not (DISPLAY_FONT_START <= addr < DISPLAY_FIXED_FONT_END)
+
+cdef uint32_t display_read_byte(void *extra, uint32_t addr, uint32_t value) nogil:
+    cdef display_state *state = <display_state*>extra
+    if addr < DISPLAY_FRAME_BUFFER_END:
+        return (state.memory[addr >> 2] >> ((addr & 3) << 3)) & 0xff
+    return 0
+
+cdef uint32_t display_read(void *extra, uint32_t addr, uint32_t value) nogil:
+    cdef display_state *state = <display_state*>extra
+    #The display has a secret RNG, did you know that?
+    if addr == DISPLAY_RNG:
+        return display_random(state)
+    if addr == DISPLAY_TIME:
+        #The cpu's idea of the time, so that a run does the same thing however long it takes
+        if state.device.cpu == NULL:
+            return state.epoch
+        return state.epoch + <uint32_t>(state.device.cpu.cycles // (carmv2.CYCLES_PER_MS * 1000))
+    if addr < DISPLAY_FRAME_BUFFER_END:
+        return state.memory[addr >> 2]
+    return 0
+
+cdef uint32_t display_write_byte(void *extra, uint32_t addr, uint32_t value) nogil:
+    cdef display_state *state = <display_state*>extra
+    cdef uint32_t shift = (addr & 3) << 3
+    if display_writable(addr):
+        state.memory[addr >> 2] = (state.memory[addr >> 2] & ~(0xffu << shift)) | ((value & 0xff) << shift)
+        display_mark_dirty(state, addr)
+    return 0
+
+cdef uint32_t display_write(void *extra, uint32_t addr, uint32_t value) nogil:
+    cdef display_state *state = <display_state*>extra
+    if addr == DISPLAY_RNG:
+        state.rng = value if value else 1
+    elif display_writable(addr):
+        state.memory[addr >> 2] = value
+        display_mark_dirty(state, addr)
+    return 0
+
+cdef class DisplayDevice(NativeDevice):
+    #The memory of the display in hardware.Display. The cpu reads and writes it like RAM, and all that
+    #happens is that the lines it writes to are marked dirty. Nothing is drawn from it until the Python side
+    #takes the dirty lines and catches up with them, which it does through the buffer protocol, e.g.
+    #numpy.frombuffer(device, numpy.uint8). Like the cpu's own memory, it should only be touched while the
+    #cpu isn't running
+    cdef display_state state
+
+    def __cinit__(self, *args, **kwargs):
+        memset(&self.state, 0, sizeof(self.state))
+        self.state.device = self.cdevice
+        self.cdevice.extra = &self.state
+        self.cdevice.read_callback = display_read
+        self.cdevice.read_byte_callback = display_read_byte
+        self.cdevice.write_callback = display_write
+        self.cdevice.write_byte_callback = display_write_byte
+        self.cdevice.memory = self.state.memory
+        self.cdevice.dirty = self.state.dirty
+        self.cdevice.ram_pages = DISPLAY_RAM_PAGES
+
+    def __init__(self, cpu, epoch=None, seed=None):
+        #The time port counts from epoch and the rng starts from seed. They default to now and something
+        #random, so give both for a run that does the same thing every time
+        super().__init__(cpu)
+        self.state.epoch = <uint32_t>(time(NULL) if epoch is None else epoch)
+        self.state.rng = (random.getrandbits(64) if seed is None else seed) | 1
+
+    def copy_from(self, Device other):
+        #Everything is dirty afterwards, as nothing has been drawn from our copy yet
+        cdef DisplayDevice display = <DisplayDevice?>other
+        memcpy(self.state.memory, display.state.memory, sizeof(self.state.memory))
+        memset(self.state.dirty, 0xff, sizeof(self.state.dirty))
+        self.state.rng = display.state.rng
+        self.state.epoch = display.state.epoch
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, <void*>self.state.memory, DISPLAY_FRAME_BUFFER_END, 0, flags)
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    def take_dirty(self):
+        #A bytes with a bit for each line of carmv2.DIRTY_LINE_SIZE bytes that has been written to since the
+        #last call, from the lowest bit of the first byte up
+        cdef uint32_t i
+        cdef uint64_t word
+        out = bytearray(DISPLAY_PAGES * 8)
+        for i in range(DISPLAY_PAGES):
+            word = self.state.dirty[i]
+            self.state.dirty[i] = 0
+            out[i * 8:(i + 1) * 8] = word.to_bytes(8, 'little')
+        return bytes(out)
+
+cdef class MemoryRegion:
+    #A read only view of a run of RAM pages that sit next to each other in host memory, for use through the
+    #buffer protocol, e.g. memoryview(region). Writes have to go through the cpu so that any code decoded
+    #from them is thrown away. The view is only good until the memory map changes
+    cdef object owner
+    cdef unsigned char *data
+    cdef readonly uint32_t start
+    cdef readonly uint32_t end
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self.data, self.end - self.start, 1, flags)
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    def __len__(self):
+        return self.end - self.start
+
 cdef class Armv2:
     cdef carmv2.armv2 *cpu
     cdef public regs
@@ -239,6 +527,8 @@ cdef class Armv2:
     cdef public memw
     cdef public memsize
     cdef public hardware
+    cdef object map_cache
+    cdef uint32_t map_cache_generation
 
     def __cinit__(self, *args, **kwargs):
         self.cpu = <carmv2.armv2*>malloc(sizeof(carmv2.armv2))
@@ -254,15 +544,85 @@ cdef class Armv2:
     def getregs(self,index):
         if index >= NUM_EFFECTIVE_REGS:
             raise IndexError()
+        carmv2.MATERIALISE_FLAGS(self.cpu)
         return int(self.cpu.regs.effective[index][0])
 
     def setregs(self,index,value):
         if index >= NUM_EFFECTIVE_REGS:
             raise IndexError()
+        carmv2.MATERIALISE_FLAGS(self.cpu)
         self.cpu.regs.effective[index][0] = value
         if index == carmv2.PC:
             self.cpu.pc = int((0xfffffffc + (value&0x3ffffffc))&0xffffffff)
 
+    def snapshot(self):
+        cdef Snapshot snapshot = Snapshot()
+        cdef carmv2.armv2_status result
+        with nogil:
+            result = carmv2.snapshot_armv2(self.cpu, snapshot.snapshot)
+        if result == carmv2.ARMV2STATUS_MEMORY_ERROR:
+            raise MemoryError()
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+        return snapshot
+
+    def restore(self, Snapshot snapshot):
+        #Put the cpu and RAM back how they were in the snapshot. The RAM is shared with the snapshot until the
+        #guest writes to it, so this is cheap however much there is
+        cdef carmv2.armv2_status result
+        with nogil:
+            result = carmv2.restore_armv2(self.cpu, snapshot.snapshot)
+        if result == carmv2.ARMV2STATUS_ALREADY_MAPPED:
+            raise AccessError()
+        if result == carmv2.ARMV2STATUS_MEMORY_ERROR:
+            raise MemoryError()
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+
+    def clone(self, count, make_devices = None):
+        #Make count new Armv2s that each carry on from where this one is now, e.g. to run lots of tests from
+        #just after boot. They share the RAM none of them has written to, so they're cheap to make. Our
+        #devices can't be shared, so make_devices(clone) has to give a new device for each of ours, in the
+        #same order. They're added to the clone, then get copy_from ours, so they can schedule events, and
+        #are mapped at the same addresses
+        cdef Armv2 clone
+        cdef Device device
+        cdef carmv2.armv2_status result
+        cdef Snapshot snapshot = self.snapshot()
+        clones = []
+        for i in range(count):
+            clone = Armv2(self.memsize)
+            devices = make_devices(clone) if make_devices else []
+            if len(devices) != len(self.hardware):
+                raise ValueError('make_devices must give one device for each device of ours')
+            for device, original in zip(devices, self.hardware):
+                clone.add_hardware(device)
+                device.copy_from(original)
+            with nogil:
+                result = carmv2.clone_armv2(clone.cpu, self.cpu, snapshot.snapshot)
+            if result == carmv2.ARMV2STATUS_ALREADY_MAPPED:
+                raise AccessError()
+            if result == carmv2.ARMV2STATUS_MEMORY_ERROR:
+                raise MemoryError()
+            if result != carmv2.ARMV2STATUS_OK:
+                raise ValueError()
+            clones.append(clone)
+        return clones
+
+    def get_all_regs(self):
+        #Every register at once in an array('I'), laid out as in AllRegs
+        out = array.array('I', bytes(4 * carmv2.ALL_REGS_SIZE))
+        cdef uint32_t[::1] regs = out
+        carmv2.get_all_regs(self.cpu, &regs[0])
+        return out
+
+    def set_all_regs(self, const uint32_t[::1] regs):
+        #Set them all from an array('I') or numpy uint32 array laid out like get_all_regs gives. Only the
+        #EFFECTIVE and ACTUAL parts are used, see set_all_regs in init.c
+        if regs.shape[0] < carmv2.ALL_REGS_SIZE:
+            raise ValueError()
+        carmv2.set_all_regs(self.cpu, &regs[0])
+
     def getbyte(self,addr):
         cdef uint32_t word = self.getword(addr & 0xfffffffc)
         cdef uint32_t b = (addr&3)<<3
@@ -326,7 +686,42 @@ cdef class Armv2:
 
         if NULL != page.memory:
             page.memory[WORDINPAGE(addr)] = int(value)
+            carmv2.INVALIDATE_DECODED(page, addr)
+            carmv2.MARK_DIRTY(page, addr)
+
+
+    def read_block(self, addr, length):
+        #Return a bytearray of length bytes of memory from addr. Unmapped memory reads as zeroes
+        cdef carmv2.armv2_status result
+        cdef uint32_t start, size
+        data = bytearray(length)
+        cdef uint8_t[::1] buf = data
+        if length == 0:
+            return data
+        if addr < 0 or addr + length > MAX_26BIT:
+            raise IndexError()
+        start, size = addr, length
+        with nogil:
+            result = carmv2.read_block(self.cpu, start, size, &buf[0])
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+        return data
 
+    def write_block(self, addr, data):
+        #Write a bytes-like object to memory at addr. RAM that hasn't been touched yet is faulted in, and it
+        #raises AccessError without writing anything if it doesn't all land on pages that are there or can be
+        cdef carmv2.armv2_status result
+        cdef const uint8_t[::1] buf = memoryview(data).cast('B')
+        cdef uint32_t length = len(buf)
+        if length == 0:
+            return
+        if addr < 0 or addr + length > MAX_26BIT:
+            raise IndexError()
+        result = carmv2.write_block(self.cpu, addr, length, &buf[0])
+        if result == carmv2.ARMV2STATUS_INVALID_PAGE:
+            raise AccessError()
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
 
     @property
     def pc(self):
@@ -338,10 +733,31 @@ cdef class Armv2:
     def pins(self):
         return self.cpu.pins
 
+    @property
+    def cycles(self):
+        #The virtual clock: every instruction run and every one skipped while waiting, see events.c
+        return self.cpu.cycles
+
+    @property
+    def skipped_cycles(self):
+        #How many of the instructions we've been asked to step weren't run because the cpu was waiting for an
+        #interrupt or spinning in a loop that wasn't going to get anywhere
+        return self.cpu.skipped_cycles
+
     @property
     def mode(self):
         return self.regs.pc&3
 
+    @property
+    def exec_mode(self):
+        return self.cpu.exec_mode
+
+    @exec_mode.setter
+    def exec_mode(self, mode):
+        result = carmv2.set_exec_mode(self.cpu, <carmv2.exec_mode>mode)
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+
     def __init__(self, size, filename = None):
         cdef carmv2.armv2_status result
         cdef uint32_t mem = size
@@ -374,35 +790,98 @@ cdef class Armv2:
     def add_hardware(self,Device device,name = None):
         #FIXME: Does this do reference counting properly? We need it to increment, and we need a corresponding
         #decrement somewhere else in the code
-        device.cdevice.extra = <void*>device
         result = carmv2.add_hardware(self.cpu,device.cdevice)
         if result != carmv2.ARMV2STATUS_OK:
             raise ValueError()
+        device.cdevice.cpu = self.cpu
         self.hardware.append(device)
 
     def interrupt(self, hw_id, code):
+        #Queue an interrupt, which is safe from any thread even while the cpu is running. Returns False if the
+        #queue was full and it was dropped
         result = carmv2.interrupt(self.cpu, <uint32_t>hw_id, <uint32_t>code)
+        if result == carmv2.ARMV2STATUS_MEMORY_ERROR:
+            return False
         if result != carmv2.ARMV2STATUS_OK:
             raise ValueError()
+        return True
 
     def memory_map(self):
-        #Return a list of currently mapped memory regions
-        map = []
-        current = None
+        #Return a list of (start, end) for each run of mapped memory. The core keeps the runs up to date as
+        #pages come and go, so we only make a new list when its map_generation has moved on, and otherwise
+        #hand back the same one. Don't change it
+        cdef uint32_t i
+        if self.map_cache is None or self.map_cache_generation != self.cpu.map_generation:
+            self.map_cache = [(self.cpu.mapped_regions[i].start, self.cpu.mapped_regions[i].end)
+                              for i in range(self.cpu.num_mapped_regions)]
+            self.map_cache_generation = self.cpu.map_generation
+        return self.map_cache
+
+    @property
+    def map_generation(self):
+        #Moves on whenever the memory map changes
+        return self.cpu.map_generation
+
+    cdef bint is_ram(self, carmv2.page_info *page):
+        return NULL != page and NULL != page.memory and NULL == page.read_callback
+
+    def memory_regions(self):
+        #Return a MemoryRegion for each run of mapped RAM. Device pages are left out, they have to be read
+        #through getword. The guest's bytes are in host order within each word, so this only works on a
+        #little endian host
+        regions = []
+        cdef MemoryRegion region = None
         cdef carmv2.page_info *page = NULL
-        for addr in xrange(0, MAX_26BIT, 1 << 12):
-            page = self.cpu.page_tables[PAGEOF(addr)]
-            if NULL != page:
-                if current is None:
-                    current = addr
+        cdef carmv2.page_info *last = NULL
+        cdef uint32_t i
+
+        if sys.byteorder != 'little':
+            return regions
+
+        for i in range(carmv2.NUM_PAGE_TABLES):
+            page = self.cpu.page_tables[i]
+            if not self.is_ram(page):
+                region = None
+                continue
+            if region is not None and page.memory == last.memory + carmv2.WORDS_PER_PAGE:
+                region.end += carmv2.PAGE_SIZE
             else:
-                if current is not None:
-                    map.append( (current, addr) )
-                    current = None
-
-        if current is not None:
-            map.append( (current, MAX_26BIT) )
-        return map
+                region = MemoryRegion.__new__(MemoryRegion)
+                region.owner = self
+                region.data = <unsigned char*>page.memory
+                region.start = i << carmv2.PAGE_SIZE_BITS
+                region.end = region.start + carmv2.PAGE_SIZE
+                regions.append(region)
+            last = page
+
+        return regions
+
+    def memory_view(self, start, end):
+        #A memoryview of the guest bytes from start up to end, or None if they aren't all in one run of RAM
+        cdef MemoryRegion region
+        cdef carmv2.page_info *page = NULL
+        cdef carmv2.page_info *first = NULL
+        cdef uint32_t first_page, last_page, offset, i
+
+        if sys.byteorder != 'little' or start < 0 or end > MAX_26BIT or start >= end:
+            return None
+        first_page = start >> carmv2.PAGE_SIZE_BITS
+        offset = start & carmv2.PAGE_MASK
+        last_page = (end - 1) >> carmv2.PAGE_SIZE_BITS
+        first = self.cpu.page_tables[first_page]
+        if not self.is_ram(first):
+            return None
+        for i in range(first_page + 1, last_page + 1):
+            page = self.cpu.page_tables[i]
+            if not self.is_ram(page) or page.memory != first.memory + (i - first_page) * carmv2.WORDS_PER_PAGE:
+                return None
+
+        region = MemoryRegion.__new__(MemoryRegion)
+        region.owner = self
+        region.data = (<unsigned char*>first.memory) + offset
+        region.start = start
+        region.end = end
+        return memoryview(region)
 
     def loaded_libraries(self):
         # Return a list of the loaded "libraries", by which me means the boot rom and any tapes that were
@@ -412,7 +891,8 @@ cdef class Armv2:
         for i in xrange(16):
             start = self.getword(pos)
             end = self.getword(pos + 4)
-            debug_log(f'Tape region {start:08x} {end:08x}')
+            if log_enabled(LOG_DEBUG):
+                debug_log('Tape region %08x %08x', start, end)
             if start == end:
                 break
             map.append( (start, end) )
@@ -449,15 +929,177 @@ cdef class Armv2:
         if result != carmv2.ARMV2STATUS_OK:
             raise ValueError()
 
-debugf = None
-log_lock = threading.Lock()
-def debug_log(message):
-    global debugf
-    message = str(threading.get_ident()) + ' ' + message
-    with log_lock:
-        if debugf == None:
-            debugf = open('/tmp/pyarmv2_p2.log','wb')
-        if not message.endswith('\n'):
-            message += '\n'
-        debugf.write(message.encode('ascii'))
-        debugf.flush()
+cdef class Snapshot:
+    #The cpu and RAM of an Armv2 from Armv2.snapshot, which can be given to restore as many times as you like.
+    #Devices keep their own state, so that isn't in here
+    cdef carmv2.armv2_snapshot *snapshot
+
+    def __cinit__(self, *args, **kwargs):
+        self.snapshot = <carmv2.armv2_snapshot*>malloc(sizeof(carmv2.armv2_snapshot))
+        if self.snapshot == NULL:
+            raise MemoryError()
+        self.snapshot.ram_fd = -1
+
+    def __dealloc__(self):
+        if self.snapshot != NULL:
+            carmv2.snapshot_cleanup(self.snapshot)
+            free(self.snapshot)
+            self.snapshot = NULL
+
+cdef class MachinePool:
+    #Steps a set of Armv2 instances together on a fixed number of native threads, for running lots of
+    #headless machines without a Python thread each. A machine in the pool mustn't be stepped by anything
+    #else at the same time, and its devices get their callbacks on the pool's threads
+    cdef carmv2.armv2_pool *pool
+    cdef carmv2.pool_job *jobs
+    cdef uint32_t num_jobs
+    cdef public machines
+
+    def __cinit__(self, *args, **kwargs):
+        self.pool = <carmv2.armv2_pool*>malloc(sizeof(carmv2.armv2_pool))
+        self.jobs = NULL
+        self.num_jobs = 0
+        if self.pool == NULL:
+            raise MemoryError()
+
+    def __dealloc__(self):
+        if self.pool != NULL:
+            carmv2.pool_cleanup(self.pool)
+            free(self.pool)
+            self.pool = NULL
+        free(self.jobs)
+        self.jobs = NULL
+
+    def __init__(self, threads = None):
+        if threads is None:
+            threads = os.cpu_count() or 1
+        result = carmv2.pool_init(self.pool, <uint32_t>threads)
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+        self.machines = []
+
+    def add(self, Armv2 machine):
+        cdef carmv2.pool_job *jobs = <carmv2.pool_job*>realloc(self.jobs,
+                                                               sizeof(carmv2.pool_job) * (self.num_jobs + 1))
+        if jobs == NULL:
+            raise MemoryError()
+        self.jobs = jobs
+        self.jobs[self.num_jobs].cpu = machine.cpu
+        self.num_jobs += 1
+        self.machines.append(machine)
+        return machine
+
+    def step(self, number = None):
+        #Run every machine for number instructions and wait for them all. Returns a (status, instructions
+        #left) pair for each machine in the order they were added, just like Armv2.step
+        cdef carmv2.armv2_status result
+        cdef int32_t instructions = -1 if number == None else number
+        cdef uint32_t i
+        for i in range(self.num_jobs):
+            self.jobs[i].instructions = instructions
+        with nogil:
+            result = carmv2.pool_run(self.pool, self.jobs, self.num_jobs)
+        if result != carmv2.ARMV2STATUS_OK:
+            raise ValueError()
+
+        return [(self.jobs[i].status, int(self.jobs[i].instructions)) for i in range(self.num_jobs)]
+
+class LogLevel:
+    DEBUG   = 10
+    INFO    = 20
+    WARNING = 30
+    ERROR   = 40
+    OFF     = 100
+
+LOG_FILENAME    = os.environ.get('PYARMV2_LOG', '/tmp/pyarmv2_p2.log')
+LOG_BUFFER_SIZE = 4096
+#How full the buffer gets before the writer is woken, rather than waiting for its next look
+LOG_WAKEUP_SIZE = LOG_BUFFER_SIZE // 2
+
+#The log is for debugging the emulator, so it's off unless PYARMV2_LOG_LEVEL names a level or someone calls
+#set_log_level. Messages go in a ring buffer and a background thread writes them out, so logging never touches
+#the file from the thread running the cpu. If the writer falls behind the oldest messages are dropped, and
+#it says how many in the log. Messages are %-formatted by the writer too, so pass the arguments rather than
+#formatting them first. A message at a level that's off shouldn't cost anything, so callers check first:
+#log_enabled here and debug_enabled from python, as building the call's arguments is most of the cost
+cdef int log_level = getattr(LogLevel, os.environ.get('PYARMV2_LOG_LEVEL', 'OFF').upper(), LogLevel.OFF)
+cdef int LOG_DEBUG = LogLevel.DEBUG
+debug_enabled = log_level <= LOG_DEBUG
+log_buffer = collections.deque(maxlen=LOG_BUFFER_SIZE)
+#Held to add to the buffer or take from it, so that it's never held while the file is written
+log_buffer_lock = threading.Lock()
+log_dropped = 0
+log_wakeup = threading.Event()
+log_file_lock = threading.Lock()
+log_file = None
+log_writer = None
+
+cdef inline bint log_enabled(int level):
+    return level >= log_level
+
+def set_log_level(level):
+    global log_level, debug_enabled
+    log_level = level
+    debug_enabled = log_enabled(LOG_DEBUG)
+    if log_level < LogLevel.OFF:
+        start_log_writer()
+
+cdef append_log(int level, message, tuple args):
+    global log_dropped
+    if log_writer is None:
+        start_log_writer()
+    with log_buffer_lock:
+        size = len(log_buffer)
+        if size >= LOG_BUFFER_SIZE:
+            #The append pushes the oldest one out
+            log_dropped += 1
+        log_buffer.append((threading.get_ident(), level, message, args))
+    if size == LOG_WAKEUP_SIZE:
+        log_wakeup.set()
+
+def log(level, message, *args):
+    if log_enabled(level):
+        append_log(level, message, args)
+
+def debug_log(message, *args):
+    if log_enabled(LOG_DEBUG):
+        append_log(LOG_DEBUG, message, args)
+
+def flush_log():
+    #Write out everything logged so far
+    global log_file, log_dropped
+    with log_file_lock:
+        with log_buffer_lock:
+            dropped, log_dropped = log_dropped, 0
+            messages = list(log_buffer)
+            log_buffer.clear()
+        if not messages and not dropped:
+            return
+        if log_file is None:
+            log_file = open(LOG_FILENAME, 'wb')
+        if dropped:
+            #They were the oldest, so they'd have come before anything still in the buffer
+            log_file.write(f'{threading.get_ident()} {dropped} messages dropped\n'.encode('ascii'))
+        for ident, level, message, args in messages:
+            if args:
+                try:
+                    message = message % args
+                except (TypeError, ValueError):
+                    message = f'{message} {args!r}'
+            log_file.write(f'{ident} {message.rstrip()}\n'.encode('ascii', 'replace'))
+        log_file.flush()
+
+def log_writer_main():
+    while True:
+        log_wakeup.wait(0.25)
+        log_wakeup.clear()
+        flush_log()
+
+def start_log_writer():
+    global log_writer
+    with log_file_lock:
+        if log_writer is not None:
+            return
+        log_writer = threading.Thread(target=log_writer_main, name='armv2 log writer', daemon=True)
+        log_writer.start()
+    atexit.register(flush_log)
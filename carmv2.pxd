@@ -1,4 +1,4 @@
-from libc.stdint cimport uint32_t, int64_t, int32_t
+from libc.stdint cimport uint8_t, uint32_t, int64_t, int32_t, uint64_t
 
 cdef extern from "armv2.h":
     cdef enum armv2_status:
@@ -14,6 +14,11 @@ cdef extern from "armv2.h":
         READ_WATCHPOINT
         ACCESS_WATCHPOINT
 
+    cdef enum exec_mode:
+        EXEC_INTERPRETER
+        EXEC_BLOCKS
+        EXEC_JIT
+
     enum: NUMREGS
     enum: NUM_EFFECTIVE_REGS
     enum: FP
@@ -43,6 +48,16 @@ cdef extern from "armv2.h":
     enum: PAGE_MASK
     enum: NUM_PAGE_TABLES
     enum: WORDS_PER_PAGE
+    enum: MAX_MAPPED_REGIONS
+    enum: ALL_REGS_EFFECTIVE
+    enum: ALL_REGS_CPSR
+    enum: ALL_REGS_MODE
+    enum: ALL_REGS_PC
+    enum: ALL_REGS_ACTUAL
+    enum: ALL_REGS_SIZE
+    enum: DIRTY_LINE_BITS
+    enum: DIRTY_LINE_SIZE
+    enum: CYCLES_PER_MS
     enum: MAX_MEMORY
     enum: SWI_BREAKPOINT
     enum: PIN_I
@@ -74,14 +89,18 @@ cdef extern from "armv2.h":
         ARMV2STATUS_VALUE_ERROR,
         ARMV2STATUS_IO_ERROR,
         ARMV2STATUS_BREAKPOINT,
-        ARMV2STATUS_WAIT_FOR_INTERRUPT
+        ARMV2STATUS_ALREADY_MAPPED,
+        ARMV2STATUS_INVALID_PAGE,
+        ARMV2STATUS_WAIT_FOR_INTERRUPT,
+        ARMV2STATUS_IDLE
 
     struct regs:
         uint32_t actual[NUMREGS]
         uint32_t *effective[NUM_EFFECTIVE_REGS]
 
-    ctypedef uint32_t (*access_callback_t)(void *, uint32_t, uint32_t)
-    ctypedef uint32_t (*operation_callback_t)(void *, uint32_t, uint32_t)
+    ctypedef uint32_t (*access_callback_t)(void *, uint32_t, uint32_t) nogil
+    ctypedef uint32_t (*operation_callback_t)(void *, uint32_t, uint32_t) nogil
+    ctypedef uint64_t (*event_callback_t)(void *, uint64_t) nogil
 
     struct region:
         uint32_t start
@@ -98,9 +117,13 @@ cdef extern from "armv2.h":
         armv2 *cpu
         region mapped
         void *extra
+        uint32_t *memory
+        uint64_t *dirty
+        uint64_t ram_pages
 
     struct page_info:
         uint32_t *memory
+        uint64_t *dirty
         hardware_device *mapped_device
         access_callback_t read_callback
         access_callback_t write_callback
@@ -108,16 +131,37 @@ cdef extern from "armv2.h":
         access_callback_t write_byte_callback
         uint32_t flags
 
+    struct armv2_snapshot:
+        int ram_fd
+
     struct armv2:
         regs regs
         #uint32_t *physical_ram
         uint32_t physical_ram_size
         page_info *page_tables[NUM_PAGE_TABLES]
+        region mapped_regions[MAX_MAPPED_REGIONS]
+        uint32_t num_mapped_regions
+        uint32_t map_generation
         exception_handler exception_handlers[EXCEPT_MAX]
         region boot_rom
         uint32_t pc
         uint32_t flags
         uint32_t pins
+        exec_mode exec_mode
+        uint64_t skipped_cycles
+        uint64_t cycles
+        uint64_t next_event
+
+    struct pool_job:
+        armv2 *cpu
+        int32_t instructions
+        armv2_status status
+
+    struct armv2_pool:
+        uint32_t num_threads
+
+    void INVALIDATE_DECODED(page_info *page, uint32_t addr) nogil
+    void MARK_DIRTY(page_info *page, uint32_t addr) nogil
 
     armv2_status init(armv2 *cpu, uint32_t memsize) nogil
     armv2_status load_rom(armv2 *cpu, const char *filename) nogil
@@ -131,3 +175,18 @@ cdef extern from "armv2.h":
     armv2_status unset_watchpoint(armv2 *cpu, watchpoint_type type, uint32_t addr) nogil
     armv2_status reset_breakpoints(armv2 *cpu) nogil
     armv2_status reset_watchpoints(armv2 *cpu) nogil
+    armv2_status set_exec_mode(armv2 *cpu, exec_mode mode) nogil
+    armv2_status read_block(armv2 *cpu, uint32_t addr, uint32_t len, uint8_t *buf) nogil
+    armv2_status write_block(armv2 *cpu, uint32_t addr, uint32_t len, const uint8_t *buf) nogil
+    armv2_status get_all_regs(armv2 *cpu, uint32_t *regs) nogil
+    armv2_status set_all_regs(armv2 *cpu, const uint32_t *regs) nogil
+    armv2_status pool_init(armv2_pool *pool, uint32_t num_threads) nogil
+    armv2_status pool_run(armv2_pool *pool, pool_job *jobs, uint32_t num_jobs) nogil
+    armv2_status pool_cleanup(armv2_pool *pool) nogil
+    armv2_status snapshot_armv2(armv2 *cpu, armv2_snapshot *snapshot) nogil
+    armv2_status restore_armv2(armv2 *cpu, const armv2_snapshot *snapshot) nogil
+    armv2_status schedule_event(armv2 *cpu, uint64_t delay, event_callback_t callback, void *extra) nogil
+    armv2_status cancel_events(armv2 *cpu, event_callback_t callback, void *extra) nogil
+    armv2_status clone_armv2(armv2 *clone, armv2 *cpu, const armv2_snapshot *snapshot) nogil
+    armv2_status snapshot_cleanup(armv2_snapshot *snapshot) nogil
+    void MATERIALISE_FLAGS(armv2 *cpu) nogil
@@ -18,6 +18,7 @@ enum armv2_status {
     ARMV2STATUS_WAIT_FOR_INTERRUPT,
     ARMV2STATUS_DEVICE_ERROR,
     ARMV2STATUS_FAULT_FAULT,
+    ARMV2STATUS_IDLE,
 };
 
 #endif
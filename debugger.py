@@ -25,6 +25,8 @@ class Debugger(object):
         self.machine = machine
         self.breakpoints = {}
         self.next_breakpoint = None
+        # The run started by the last frame, which we find out about on the next one
+        self.frame_run = None
         self.last_time = None
         self.handlers = {
             messages.Types.STOP: self.handle_stop,
@@ -324,15 +326,16 @@ class Debugger(object):
     def handle_get_regs(self, message):
         if not self.connection:
             return
-        self.connection.send(
-            messages.RegisterValues(self.machine.regs, self.machine.cpsr, self.machine.pc_value)
-        )
+        regs = self.machine.get_all_regs()
+        self.connection.send(messages.RegisterValues(regs, regs[armv2.AllRegs.CPSR], regs[armv2.AllRegs.PC]))
 
     def handle_set_regs(self, message):
+        regs = self.machine.get_all_regs()
         for i, reg in message.regs:
-            self.machine.regs[i] = reg
+            regs[armv2.AllRegs.EFFECTIVE + i] = reg
 
-        self.machine.regs[15] = message.pc | message.cpsr
+        regs[armv2.AllRegs.EFFECTIVE + 15] = message.pc | message.cpsr
+        self.machine.set_all_regs(regs)
         self.connection.send(messages.OK())
 
     def handle_set_reg(self, message):
@@ -399,22 +402,24 @@ class Debugger(object):
         # reloading all symbols
         self.need_symbols = False
         symbols = []
-        pos = self.SYMBOLS_ADDR
-        value = None
+        data = b""
+        for region in self.machine.memory_regions():
+            if region.start <= self.SYMBOLS_ADDR < region.end:
+                data = bytes(memoryview(region)[self.SYMBOLS_ADDR - region.start :])
+                break
 
-        while value != 0:
-            value = struct.unpack(">I", self.machine.mem[pos : pos + 4])[0]
+        # Each symbol is a big endian value followed by its null terminated name, and a value of 0 ends them
+        pos = 0
+        while pos + 4 <= len(data):
+            value = struct.unpack_from(">I", data, pos)[0]
             if 0 == value:
                 break
-            name = []
             pos += 4
-            b = self.machine.mem[pos]
-            while b != 0:
-                name.append(chr(b))
-                pos += 1
-                b = self.machine.mem[pos]
-            pos += 1
-            name = "".join(name)
+            end = data.find(b"\0", pos)
+            if end < 0:
+                break
+            name = data[pos:end].decode("latin-1")
+            pos = end + 1
             symbols.append((value, name))
 
         self.symbols = symbols
@@ -438,6 +443,7 @@ class Debugger(object):
         self.machine = machine
         self.machine.tape_drive.register_callback(self.set_need_symbols)
         self.next_instruction = None
+        self.frame_run = None
         for bkpt in self.breakpoints:
             self.machine.set_breakpoint(bkpt)
         #    self.breakpoints[bkpt] = self.machine.memw[bkpt]
@@ -465,6 +471,9 @@ class Debugger(object):
         if num > 0:
             status = self.machine.step_and_wait(num)
 
+        return self.finish_step(status)
+
+    def finish_step(self, status):
         # self.state_window.update()
         if self.need_symbols:
             print("LOADING SYMBOLS")
@@ -499,6 +508,9 @@ class Debugger(object):
         result = None
         self.stopped = False
         status = self.step_num_internal(self.num_to_step, skip_breakpoint=explicit)
+        self.check_breakpoint(status)
+
+    def check_breakpoint(self, status):
         if armv2.Status.BREAKPOINT == status:
             print("**************** GOT BREAKPOINT **************")
             self.stop()
@@ -518,8 +530,16 @@ class Debugger(object):
         if not self.stopped:
             if self.machine.stepping:
                 return
-            else:
-                return self.resume()
+            # The cpu runs each frame's cycles while the frame is drawn, so rather than waiting for them we
+            # deal with how the last frame's went and start the next
+            if self.frame_run is not None:
+                status = self.finish_step(self.frame_run.result())
+                self.frame_run = None
+                self.check_breakpoint(status)
+            if not self.stopped and num > 0:
+                self.num_to_step -= num
+                self.frame_run = self.machine.step(num)
+                return
 
         # disassembly = disassemble.Disassemble(cpu.mem)
         # We're stopped, so display and wait for a keypress
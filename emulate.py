@@ -13,29 +13,20 @@ from optparse import OptionParser
 from . import sounds
 
 
-def new_machine(boot_rom):
-    machine = hardware.Machine(cpu_size=1 << 18, cpu_rom=boot_rom)
-    try:
-        machine.add_hardware(hardware.Keyboard(machine), name="keyboard")
-        machine.add_hardware(hardware.Display(machine, scale_factor=1), name="display")
-        machine.add_hardware(hardware.Clock(machine), name="clock")
-        machine.add_hardware(hardware.TapeDrive(machine), name="tape_drive")
-    except:
-        machine.delete()
-        raise
-    return machine
-
-
 class Emulator(object):
     # Speeds are cycles per ms
     speeds = [0x400, 0x200, 0x100, 16, 2]
     clock_rate = None
 
-    def __init__(self, callback=None, boot_rom="build/boot.rom", tapes=None, owner=None):
+    def __init__(
+        self, callback=None, boot_rom="build/boot.rom", tapes=None, owner=None, exec_mode=armv2.ExecMode.BLOCKS
+    ):
         self.last = 0
         self.boot_rom = boot_rom
+        # Pass armv2.ExecMode.JIT to compile hot code rather than run it in blocks
+        self.exec_mode = exec_mode
         self.powered_on = True
-        self.machine = new_machine(self.boot_rom)
+        self.machine = hardware.new_machine(self.boot_rom, exec_mode=self.exec_mode)
         self.owner = owner
 
         try:
@@ -118,7 +109,7 @@ class Emulator(object):
 
     def power_on(self):
         old_machine = self.machine
-        self.machine = new_machine(self.boot_rom)
+        self.machine = hardware.new_machine(self.boot_rom, exec_mode=self.exec_mode)
         # The new machine has something in common with the old; the state of its hardware. Copying the
         # hardware devices across seems to have some issues that I can't be bothered to resolve, so cheat and
         # copy the state of those things with state (like the tape drive) across manually
@@ -145,10 +136,6 @@ class Emulator(object):
             if event.type == pygame.locals.QUIT:
                 return True
 
-            if event.type == pygame.USEREVENT:
-                if self.dbg.wants_interrupt():
-                    self.dbg.machine.clock.fired()
-
             if event.type == pygame.locals.KEYDOWN:
                 key = event.key
                 try:
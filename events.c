@@ -0,0 +1,129 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "armv2.h"
+
+// Things devices want to happen after the cpu has run for a while, e.g. a timer going off. Time here is the
+// cpu's own cycle count rather than the host's clock, so a run does the same thing however fast the host
+// gets through it, and a cpu that's waiting for an interrupt can skip straight to the next event.
+//
+// The events are a binary min-heap on deadline in the cpu, and next_event is always the deadline at the top,
+// or NO_EVENT. run_armv2 only ever runs up to next_event, so the only cost to the run loop is the one
+// compare with it between runs.
+
+static void swap_events(struct armv2_event *a, struct armv2_event *b)
+{
+    struct armv2_event tmp = *a;
+    *a = *b;
+    *b = tmp;
+}
+
+static void sift_up(struct armv2 *cpu, uint32_t pos)
+{
+    while( pos > 0 ) {
+        uint32_t parent = (pos - 1) / 2;
+
+        if( cpu->events[parent].deadline <= cpu->events[pos].deadline ) {
+            break;
+        }
+        swap_events(cpu->events + parent, cpu->events + pos);
+        pos = parent;
+    }
+}
+
+static void sift_down(struct armv2 *cpu, uint32_t pos)
+{
+    while( 1 ) {
+        uint32_t smallest = pos;
+        uint32_t child    = pos * 2 + 1;
+
+        if( child < cpu->num_events && cpu->events[child].deadline < cpu->events[smallest].deadline ) {
+            smallest = child;
+        }
+        child++;
+        if( child < cpu->num_events && cpu->events[child].deadline < cpu->events[smallest].deadline ) {
+            smallest = child;
+        }
+        if( smallest == pos ) {
+            break;
+        }
+        swap_events(cpu->events + smallest, cpu->events + pos);
+        pos = smallest;
+    }
+}
+
+static void remove_event(struct armv2 *cpu, uint32_t pos)
+{
+    cpu->events[pos] = cpu->events[--cpu->num_events];
+    if( pos < cpu->num_events ) {
+        sift_down(cpu, pos);
+        sift_up(cpu, pos);
+    }
+}
+
+static void update_next_event(struct armv2 *cpu)
+{
+    cpu->next_event = cpu->num_events ? cpu->events[0].deadline : NO_EVENT;
+}
+
+// Call callback with extra once the cpu has run delay more cycles. A delay of 0 is the same as 1, so an
+// event can't keep the cpu from running by scheduling itself over and over
+enum armv2_status schedule_event(struct armv2 *cpu, uint64_t delay, event_callback_t callback, void *extra)
+{
+    if( NULL == cpu || NULL == callback ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( cpu->num_events >= MAX_EVENTS ) {
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+
+    cpu->events[cpu->num_events].deadline = cpu->cycles + (delay ? delay : 1);
+    cpu->events[cpu->num_events].callback = callback;
+    cpu->events[cpu->num_events].extra    = extra;
+    sift_up(cpu, cpu->num_events++);
+    update_next_event(cpu);
+
+    return ARMV2STATUS_OK;
+}
+
+// Forget every event with this callback and extra
+enum armv2_status cancel_events(struct armv2 *cpu, event_callback_t callback, void *extra)
+{
+    uint32_t i = 0;
+
+    if( NULL == cpu ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+
+    //Moving one event at a time back in to the heap could move one we haven't looked at yet behind us, so
+    //keep everything else in place and then make it a heap again from the bottom up
+    for( uint32_t j = 0; j < cpu->num_events; j++ ) {
+        if( cpu->events[j].callback != callback || cpu->events[j].extra != extra ) {
+            cpu->events[i++] = cpu->events[j];
+        }
+    }
+    cpu->num_events = i;
+    for( i = cpu->num_events / 2; i-- > 0; ) {
+        sift_down(cpu, i);
+    }
+    update_next_event(cpu);
+
+    return ARMV2STATUS_OK;
+}
+
+// Call everything that's due, in deadline order
+void run_events(struct armv2 *cpu)
+{
+    while( cpu->num_events && cpu->events[0].deadline <= cpu->cycles ) {
+        struct armv2_event event = cpu->events[0];
+        uint64_t again;
+
+        remove_event(cpu, 0);
+        update_next_event(cpu);
+        again = event.callback(event.extra, cpu->cycles);
+        if( again ) {
+            (void)schedule_event(cpu, again, event.callback, event.extra);
+        }
+    }
+}
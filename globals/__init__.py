@@ -13,3 +13,5 @@ dragging = None
 player_config = None
 screen_root = None
 time = 0
+dirs = None
+t = 0
@@ -1,11 +1,13 @@
 import armv2
-import pygame
 import threading
+import queue
+import collections
+import asyncio
+import concurrent.futures
 import traceback
 import signal
 import time
 import random
-from . import drawing
 import os
 import numpy
 import struct
@@ -15,6 +17,13 @@ from . import globals
 from .globals.types import Point
 import armv2_emulator
 
+try:
+    import pygame
+    from . import drawing
+except ImportError:
+    # Only a headless machine can be built without these, as it doesn't draw anything or make any sound
+    pygame = drawing = None
+
 
 def byte_reverse(x):
     out = 0
@@ -25,82 +34,35 @@ def byte_reverse(x):
     return out
 
 
-class Keyboard(armv2.Device):
+class Keyboard(armv2.KeyboardDevice):
     """
     A Keyboard device. The memory map looks like
 
     0x00 - 0x20 : bitmask of currently pressed ascii keys
     0x20 - 0xa0 : 128 byte ring buffer
     0xa0 - 0xa1 : byte indicating ringbuffer position
+
+    The memory itself is handled natively by armv2.KeyboardDevice, this just presses the keys
     """
 
     id = 0x41414141
-    bitmask_start = 0
-    ringbuffer_start = 0x20
-    ringbuffer_size = 128
-    ringbuffer_pos = ringbuffer_start + ringbuffer_size
 
     class InterruptCodes:
         KEY_DOWN = 0
         KEY_UP = 1
 
-    def __init__(self, cpu):
-        super(Keyboard, self).__init__(cpu)
-        self.ring_buffer = [0 for i in range(self.ringbuffer_size)]
-        self.pos = 0
-        self.key_state = 0
-
     def key_down(self, key):
-        armv2.debug_log("key down " + str(key))
-        self.key_state |= 1 << key
-        self.ring_buffer[self.pos] = key
-        self.pos += 1
-        if self.pos == len(self.ring_buffer):
-            self.pos = 0
+        if armv2.debug_enabled:
+            armv2.debug_log("key down %d", key)
+        self.press(key)
         self.cpu.interrupt(self.id, self.InterruptCodes.KEY_DOWN)
 
     def key_up(self, key):
-        armv2.debug_log("key up " + str(key))
-        self.key_state &= ~(1 << key)
+        if armv2.debug_enabled:
+            armv2.debug_log("key up %d", key)
+        self.release(key)
         self.cpu.interrupt(self.id, self.InterruptCodes.KEY_UP)
 
-    def read_callback(self, addr, value):
-        armv2.debug_log("keyboard reader %x %x\n" % (addr, value))
-        if addr < self.ringbuffer_start:
-            # It's a state request
-            return self.key_state >> (8 * addr) & 0xFFFFFFFF
-        elif addr < self.ringbuffer_pos:
-            pos = addr - self.ringbuffer_start
-            bytes = [self.ring_buffer[pos + i % len(self.ring_buffer)] for i in range(4)]
-            return (bytes[0]) | (bytes[1] << 8) | (bytes[2] << 16) | (bytes[3] << 24)
-        elif addr == self.ringbuffer_pos:
-            return self.pos
-
-        return 0
-
-    def read_byte_callback(self, addr, value):
-        armv2.debug_log("keyboard reader byte %x %x\n" % (addr, value))
-        if addr < self.ringbuffer_start:
-            # It's a state request
-            return self.key_state >> (8 * addr) & 0xFF
-        elif addr < self.ringbuffer_pos:
-            pos = addr - self.ringbuffer_start
-            out = self.ring_buffer[pos]
-            armv2.debug_log("Read key data %d\n" % out)
-            return out
-        elif addr == self.ringbuffer_pos:
-            return self.pos
-        else:
-            return 0
-
-    def write_callback(self, addr, value):
-        armv2.debug_log("keyboard writer %x %x\n" % (addr, value))
-        return 0
-
-    def write_byte_callback(self, addr, value):
-        armv2.debug_log("keyboard writer %x %x\n" % (addr, value))
-        return 0
-
 
 def set_pixels(pixels, word):
     for j in range(64):
@@ -155,14 +117,22 @@ class TapeDrive(armv2.Device):
         self.rewinding = None
         self.fast_forwarding = None
         self.loading = False
-        freq, sample_size, num_channels = pygame.mixer.get_init()
-        self.sample_rate = float(freq) / 1000
         self.start_time = None
         self.last_time = None
         self.wind_time = None
         self.pause_start = None
         # self.profiler = cProfile.Profile()
 
+        # A headless tape drive has nothing to play the tape through or draw the stripes on, so it hands over
+        # bytes as soon as they're asked for, as if loading had been skipped
+        self.headless = cpu.headless
+        if self.headless:
+            self.stripes = []
+            return
+
+        freq, sample_size, num_channels = pygame.mixer.get_init()
+        self.sample_rate = float(freq) / 1000
+
         screen_width = self.cpu.display.pixel_width()
         screen_height = self.cpu.display.pixel_height()
 
@@ -228,18 +198,24 @@ class TapeDrive(armv2.Device):
     def start_playing(self):
         if not self.tape:
             return
-        if not self.paused:
+        if self.headless:
+            self.skipped = True
+        elif not self.paused:
             self.tape.play_sound()
-        self.skipped = False
+            self.skipped = False
         self.playing = True
         # self.profiler.enable()
         self.start_time = globals.t
         self.last_time = self.start_time
+        if self.headless and self.loading and self.status == self.Codes.NOT_READY:
+            # Nothing calls update for a headless drive, so a byte asked for before PLAY was pressed has to be
+            # handed over now
+            self.cpu.call(self.feed_byte)
 
     def stop_playing(self):
         if not self.tape:
             return
-        if not self.paused:
+        if not self.paused and not self.headless:
             self.tape.stop_sound()
         self.playing = False
         self.start_time = None
@@ -250,7 +226,7 @@ class TapeDrive(armv2.Device):
     def pause(self):
         self.paused = True
         self.pause_start = globals.t
-        if self.playing:
+        if self.playing and not self.headless:
             self.tape.stop_sound()
 
     def unpause(self):
@@ -260,7 +236,7 @@ class TapeDrive(armv2.Device):
         self.paused = False
         self.pause_start = None
 
-        if self.playing:
+        if self.playing and not self.headless:
             self.tape.play_sound()
 
     @property
@@ -274,6 +250,10 @@ class TapeDrive(armv2.Device):
         if not self.tape:
             callback()
             return
+        if self.headless:
+            callback()
+            self.tape.rewind()
+            return
         duration = 1000
         self.wind_time = globals.t + duration
         self.rewinding = callback
@@ -283,6 +263,10 @@ class TapeDrive(armv2.Device):
         if not self.tape:
             callback()
             return
+        if self.headless:
+            callback()
+            self.tape.fast_forward()
+            return
         duration = 1000
         self.wind_time = globals.t + duration
         self.fast_forwarding = callback
@@ -333,7 +317,8 @@ class TapeDrive(armv2.Device):
 
     def skip_loading(self):
         if self.playing:
-            self.tape.sound.stop()
+            if not self.headless:
+                self.tape.sound.stop()
             self.skipped = True
 
     def is_byte_ready(self):
@@ -377,6 +362,8 @@ class TapeDrive(armv2.Device):
             self.cpu.cpu.interrupt(self.id, self.status)
 
     def update(self):
+        if self.headless:
+            return
 
         if self.rewinding:
             if globals.t >= self.wind_time + self.pause_time:
@@ -481,6 +468,29 @@ class TapeDrive(armv2.Device):
 
         drawing.draw_no_texture(self.quad_buffer, self.cpu.display.crt_pos.x, self.cpu.display.crt_pos.y)
 
+    def operation_callback(self, arg0, arg1):
+        # Copy up to arg1 bytes of the rest of the tape's current block straight in to memory at arg0, and
+        # return how many were copied. That's the same as skipping the loading and asking for each byte, but
+        # done in one go, so it's over by the time the cpu carries on and there's just the one interrupt. It
+        # only works once the tape is playing, so until then the caller has to use NEXT_BYTE, which waits
+        if not self.tape or self.open or not self.playing or self.paused:
+            return 0
+        data = self.tape.peek_bytes(arg1)
+        if not data:
+            # The end of the tape is left for NEXT_BYTE too, as that's where the interrupt for it comes from
+            return 0
+        try:
+            self.cpu.cpu.write_block(arg0, data)
+        except (armv2.AccessError, IndexError):
+            return 0
+        self.tape.skip_bytes(len(data))
+        self.skip_loading()
+        self.loading = True
+        self.data_byte = data[-1]
+        self.status = self.Codes.READY
+        self.cpu.cpu.interrupt(self.id, self.status)
+        return len(data)
+
     def write_byte_callback(self, addr, value):
         if addr == 0:
             # Trying to write to the read register. :(
@@ -524,7 +534,7 @@ def colour_to_quad(colour):
     return numpy.array([colour] * 4, numpy.float32)
 
 
-class Display(armv2.Device):
+class Display(armv2.DisplayDevice):
     """
     A Display
 
@@ -537,6 +547,10 @@ class Display(armv2.Device):
     0x0960 - 0x1160 : font data, 256 8 byte words, each of which is a bitmask for that character
 
     0x1160 - 0x36e0 : pixel data
+
+    The cpu reads and writes the memory like RAM, and armv2.DisplayDevice only keeps track of which lines of it
+    have been written. new_frame catches up with all of those at once, so a letter written during a frame
+    is drawn at the end of it, over anything written straight to its pixels in the meantime
     """
 
     class Colours:
@@ -598,17 +612,25 @@ class Display(armv2.Device):
     frame_buffer_start = font_end
     frame_buffer_end = frame_buffer_start + ((width * cell_size * height * cell_size) // 8)
 
-    def __init__(self, cpu, scale_factor):
-        super(Display, self).__init__(cpu)
+    # A headless machine is for runs that should do the same thing every time, so unless it's told otherwise
+    # its time port and rng always start from the same place
+    headless_epoch = 1609459200
+    headless_seed = 0x5EED
+
+    def __init__(self, cpu, scale_factor, epoch=None, seed=None):
+        if cpu.headless:
+            epoch = self.headless_epoch if epoch is None else epoch
+            seed = self.headless_seed if seed is None else seed
+        super(Display, self).__init__(cpu, epoch=epoch, seed=seed)
         self.dirty_rects = {}
         self.scale_factor = scale_factor
         # self.atlas = drawing.texture.PetsciiAtlas(os.path.join('fonts', 'petscii.png'))
 
-        self.colour_quads = [colour_to_quad(colour) for colour in self.Colours.palette]
+        # A headless display only keeps the memory and the frame buffer made from it, there's nothing to draw
+        # it with
+        self.headless = cpu.headless
 
-        self.cell_quads_buffer = drawing.QuadBuffer(self.width * self.height)
-        self.fore_vertex_buffer = drawing.VertexBuffer(self.pixel_size[0] * self.pixel_size[1])
-        self.cell_quads = [drawing.Quad(self.cell_quads_buffer) for i in range(self.width * self.height)]
+        self.colour_quads = [colour_to_quad(colour) for colour in self.Colours.palette]
 
         # The shape of this pixel data is an unfortunate side effect of trying to cram it all in in one large
         # uniform; 2400 uint32s is too many, so we're using 600 uvec4s. We could instead do 4 draw calls with
@@ -618,7 +640,7 @@ class Display(armv2.Device):
         # Each element of the pixel data has 4x32 = 128 bits. The screen is 320 pixels across, so it doesn't
         # really line up nicely. Note that the pixel data is stored from the bottom of the screen up (as
         # that's how we draw it to the screen in our opengl), but we want the CPU to see it from the top down,
-        # so we do that translation in the memory accesses
+        # so we do that translation when we catch up with the memory
         self.pixel_data_words = numpy.zeros(
             (self.pixel_size[0] * self.pixel_size[1] // (32 * 4), 4), numpy.uint32
         )
@@ -626,13 +648,50 @@ class Display(armv2.Device):
         self.pixel_data = self.pixel_data_words.view(dtype=numpy.uint8).reshape(
             (self.pixel_size[1], (self.pixel_size[0] // 8))
         )
+        self.powered_on = True
+        if not self.headless:
+            self.init_drawing()
+
+        # The display's memory as the cpu sees it, which has the frame buffer from the top down
+        memory = numpy.frombuffer(self, numpy.uint8)
+        self.palette_data = memory[self.palette_start : self.letter_start]
+        self.letter_data = memory[self.letter_start : self.letter_end]
+        self.font_data = memory[self.font_start : self.font_end].reshape((0x100, self.cell_size))
+        self.frame_buffer = memory[self.frame_buffer_start : self.frame_buffer_end].reshape(self.pixel_data.shape)
+        self.frame_buffer_words = self.frame_buffer.reshape(-1).view(numpy.uint32)
+        # A row of pixels is a whole number of words, so flipping the screen over moves words without breaking
+        # them up. This has the index in pixel_words of each word of the frame buffer as the cpu sees it
+        self.pixel_words = self.pixel_data_words.reshape(-1)
+        self.screen_index = (
+            numpy.arange(self.pixel_words.size).reshape((self.pixel_size[1], -1))[::-1].reshape(-1)
+        )
+
+        # Without emulate.init there's no globals.dirs, and a headless machine doesn't need one for anything else
+        fonts = os.path.join(os.path.dirname(__file__), "resource", "fonts")
+        if globals.dirs:
+            fonts = globals.dirs.fonts
+        with open(os.path.join(fonts, "petscii.txt"), "r") as f:
+            for line in f:
+                i, word = line.strip().split(" : ")
+                i, word = [int(v, 16) for v in (i, word)]
+                # Each 64 bit word reprents all the bits of an 8x8 cell from the bottom row up, so the last
+                # byte is the first row the cpu sees
+                self.font_data[i] = [byte_reverse(((word >> (row * 8)) & 0xFF)) for row in reversed(range(8))]
+
+        # initialise the whole screen
+        self.catch_up(numpy.ones(self.frame_buffer_end, bool))
+
+    def init_drawing(self):
+        self.cell_quads_buffer = drawing.QuadBuffer(self.width * self.height)
+        self.fore_vertex_buffer = drawing.VertexBuffer(self.pixel_size[0] * self.pixel_size[1])
+        self.cell_quads = [drawing.Quad(self.cell_quads_buffer) for i in range(self.width * self.height)]
+
         # self.crt_buffer = drawing.opengl.CrtBuffer(*self.pixel_size)
         self.crt_index = globals.crt_buffer.get()
         if self.crt_index is None:
             raise ValueError("No more CRTs available")
         self.crt_pos = self.crt_index * globals.crt_buffer.screen_size
         print(f"NEW CRT {self.crt_index=} {self.crt_pos=}")
-        self.powered_on = True
 
         for pos, quad in enumerate(self.cell_quads):
             x = pos % self.width
@@ -641,147 +700,28 @@ class Display(armv2.Device):
             tr = bl + Point(self.cell_size, self.cell_size)
             quad.set_vertices(bl, tr, 0)
 
-        self.font_data = [0 for i in range(256)]
-        self.letter_data = [0 for i in range(self.width * self.height)]
-        self.palette_data = [0 for i in range(self.width * self.height)]
-
-        with open(os.path.join(globals.dirs.fonts, "petscii.txt"), "r") as f:
-            for line in f:
-                i, word = line.strip().split(" : ")
-                i, word = [int(v, 16) for v in (i, word)]
-                # Each 64 bit word reprents all the bits of an 8x8 cell, but it's easier to store them as 8
-                # rows of a byte each as that's how they'll get written to memory
-                self.font_data[i] = numpy.array(
-                    [byte_reverse(((word >> (i * 8)) & 0xFF)) for i in range(8)],
-                    dtype=numpy.uint8,
-                )
-
-        # initialise the whole screen
-        for pos in range(len(self.letter_data)):
-            self.redraw_colours(pos)
-            self.redraw(pos)
-
     def power_down(self):
         self.powered_on = False
+        if self.headless:
+            return
         globals.crt_buffer.put(self.crt_index)
         # Even though we've given up the crt_buffer, we leave it set and draw from it to the screen so that we
         # get a nice clean black area (it's black because its pixels aren't being written to). It won't be
         # reused until this screen is cancelled
 
-    def read_callback(self, addr, value):
-        # The display has a secret RNG, did you know that?
-        if addr == self.frame_buffer_end:
-            return int(random.getrandbits(32))
-        if addr == self.frame_buffer_end + 4:
-            return int(time.time())
-
-        # If it's an aligned read from the frame buffer then it's easier for us to do it directly
-        if 0 == (addr & 3) and addr >= self.frame_buffer_start and addr < self.frame_buffer_end:
-            word = self.cpu_to_screen(addr - self.frame_buffer_start) // 4
-            return self.pixel_data_words[word // 4][word & 3]
-
-        # Otherwise we handle it byte-wise
-
-        bytes = [self.read_byte_callback(addr + i, 0) for i in range(4)]
-        return (bytes[0]) | (bytes[1] << 8) | (bytes[2] << 16) | (bytes[3] << 24)
-
     def pixel_width(self):
         return self.width * self.cell_size * self.scale_factor
 
     def pixel_height(self):
         return self.height * self.cell_size * self.scale_factor
 
-    def cpu_to_screen(self, offset):
-        offset *= 8
-        x, y = offset % self.pixel_size[0], offset // self.pixel_size[0]
-        y = self.pixel_size[1] - 1 - y
-        out = ((y * self.pixel_size[0]) + x) // 8
-        return out
-
-    def write_callback(self, addr, value):
-        if addr == self.letter_end:
-            random.seed(value)
-            return 0
-
-        # If it's an aligned read from the frame buffer then it's easier for us to do it directly
-        if 0 == (addr & 3) and addr >= self.frame_buffer_start and addr < self.frame_buffer_end:
-            word = self.cpu_to_screen(addr - self.frame_buffer_start) // 4
-            self.pixel_data_words[word // 4][word & 3] = value
-            return 0
-
-        for i in range(4):
-            byte = value & 0xFF
-            self.write_byte_callback(addr, byte)
-            addr += 1
-            value >>= 8
-        return 0
-
-    def read_byte_callback(self, addr, value):
-        if addr < self.letter_start:
-            # It's the palette
-            return self.palette_data[addr]
-        elif addr < self.letter_end:
-            pos = addr - self.letter_start
-            return self.letter_data[pos]
-        elif addr < self.font_end:
-            pos = addr - self.font_start
-            return self.font_data[pos // 8][pos & 7]
-        elif addr < self.frame_buffer_end:
-            pos = self.cpu_to_screen(addr - self.frame_buffer_start)
-            word = pos // 4
-            word = self.pixel_data_words[word // 4][word & 3]
-            byte = pos & 3
-            return (word >> (byte * 8)) & 0xFF
-
-    def write_byte_callback(self, addr, value):
-        if addr < self.letter_start:
-            # It's the palette
-            pos = addr
-            if value == self.palette_data[pos]:
-                # no change, ignore
-                return 0
-            self.palette_data[pos] = value
-            self.redraw_colours(pos)
-            # self.dirty_colours.add(pos)
-        elif addr < self.letter_end:
-            pos = addr - self.letter_start
-            # It would be nice if we could skip things that were staying the same, but what if there has been
-            # a direct write to video memory in this cell? computing which cells to mark as changed for every
-            # pixel is quite expensive, so skip this optimization for now
-            # if value == self.letter_data[pos]: #no change
-            #     return 0
-            self.letter_data[pos] = value
-            self.redraw(pos)
-            # self.dirty.add(pos)
-        elif addr < self.font_end:
-            pos = addr - self.font_start
-            if pos // 8 >= 0x80:
-                self.font_data[pos // 8][7 - (pos & 7)] = value
-        elif addr < self.frame_buffer_end:
-            pos = self.cpu_to_screen(addr - self.frame_buffer_start)
-            word = pos // 4
-            old_word = self.pixel_data_words[word // 4][word & 3]
-            shift = (pos & 3) * 8
-            mask = 0xFFFFFFFF ^ (0xFF << shift)
-            self.pixel_data_words[word // 4][word & 3] = (old_word & mask) | (value << shift)
-        return 0
-
     def redraw_colours(self, pos):
-        palette = self.palette_data[pos]
+        palette = int(self.palette_data[pos])
         back_colour = self.colour_quads[(palette >> 4) & 0xF]
         fore_colour = self.colour_quads[(palette) & 0xF]
         self.cell_quads[pos].set_colour(fore_colour)
         self.cell_quads[pos].set_back_colour(back_colour)
 
-    def redraw(self, pos):
-        letter = self.letter_data[pos]
-        letter_bits = self.font_data[letter]
-
-        x = pos % self.width
-        y = self.height - 1 - (pos // self.width)
-
-        self.pixel_data[y * 8 : (y + 1) * 8, x] = letter_bits
-
     def new_frame(self):
         # drawing.new_crt_frame(globals.crt_buffer)
         # self.crt_buffer.bind_for_writing()
@@ -795,15 +735,60 @@ class Display(armv2.Device):
         #     self.redraw_colours(pos)
 
         # self.dirty = set()
-        if self.powered_on:
+        # Once the dirty lines are taken the cpu can carry on writing, anything it writes now is in the next
+        # frame's lines
+        dirty = self.cpu.call(self.take_dirty)
+        lines = numpy.unpackbits(numpy.frombuffer(dirty, numpy.uint8), bitorder="little")
+        if lines.any():
+            self.catch_up(numpy.repeat(lines.astype(bool), armv2.DIRTY_LINE_SIZE)[: self.frame_buffer_end])
+        if self.powered_on and not self.headless:
             drawing.draw_pixels(self.cell_quads_buffer, self.pixel_data_words, self.crt_pos.x, self.crt_pos.y)
             # drawing.draw_no_texture(self.fore_vertex_buffer)
 
+    def catch_up(self, dirty):
+        # dirty has a flag for every byte of memory saying whether it might have been written to
+
+        # Writing a letter draws it in to the frame buffer even if it hasn't changed, as there could have been
+        # writes straight to the pixels of its cell since it was last drawn
+        dirty_words = dirty[self.frame_buffer_start :].reshape((-1, 4)).any(axis=1)
+        cells = numpy.flatnonzero(dirty[self.letter_start : self.letter_end])
+        if cells.size:
+            y, x = numpy.divmod(cells, self.width)
+            rows = y[:, None] * self.cell_size + numpy.arange(self.cell_size)
+            self.frame_buffer[rows, x[:, None]] = self.font_data[self.letter_data[cells]]
+            dirty_words[(rows * self.frame_buffer.shape[1] + x[:, None]).ravel() // 4] = True
+
+        words = numpy.flatnonzero(dirty_words)
+        self.pixel_words[self.screen_index[words]] = self.frame_buffer_words[words]
+
+        if self.headless:
+            # The colours are only needed for drawing, anyone who wants them can read the palette data
+            return
+        for pos in numpy.flatnonzero(dirty[self.palette_start : self.letter_start]):
+            self.redraw_colours(pos)
+
+    def read_frame_buffer(self, start, count):
+        # The count words of what's on the screen from word start of the frame buffer, as the cpu would see
+        # them once the display has caught up
+        return self.pixel_words[self.screen_index[start : start + count]]
+
+    def write_frame_buffer(self, start, words):
+        # Blit words in to the frame buffer from word start, as if the cpu had written them
+        words = numpy.asarray(words, numpy.uint32)
+
+        def write():
+            self.frame_buffer_words[start : start + words.size] = words
+            self.pixel_words[self.screen_index[start : start + words.size]] = words
+
+        self.cpu.call(write)
+
     def end_frame(self):
         # drawing.end_crt_frame(globals.crt_buffer)
         pass
 
     def draw_to_screen(self):
+        if self.headless:
+            return
         drawing.draw_crt_to_screen(
             globals.crt_buffer, self.crt_index.x, self.crt_index.y, globals.crt_buffer.num_screens_x
         )
@@ -816,78 +801,173 @@ class Clock(armv2.Device):
 
     id = 0x92D177B0
 
+    def __init__(self, cpu):
+        super(Clock, self).__init__(cpu)
+        self.period = 0
+
     def operation_callback(self, arg0, arg1):
-        pygame.time.set_timer(pygame.USEREVENT, arg0)
+        # Interrupt every arg0 ms, or stop for 0. They're the cpu's ms rather than the host's, so they go by as
+        # fast as the cpu runs
+        self.cancel_events()
+        self.period = arg0 * armv2.CYCLES_PER_MS
+        if self.period:
+            self.schedule(self.period)
         return 0
 
+    def copy_from(self, other):
+        # The clone's clock has been added to its cpu by now, so it can start ticking. It starts a whole period
+        # from the snapshot, as restoring keeps it that far off
+        self.cancel_events()
+        self.period = other.period
+        if self.period:
+            self.schedule(self.period)
+
+    def event(self, cycles):
+        self.fired()
+        return self.period
+
     def fired(self):
         self.cpu.interrupt(self.id, 0)
 
 
 class MemPassthrough(object):
-    def __init__(self, cv, accessor):
-        self.cv = cv
+    def __init__(self, machine, accessor):
+        self.machine = machine
         self.accessor = accessor
 
     def __getitem__(self, index):
-        with self.cv:
-            return self.accessor.__getitem__(index)
+        return self.machine.call(self.accessor.__getitem__, index)
 
     def __setitem__(self, index, values):
-        with self.cv:
-            return self.accessor.__setitem__(index, values)
+        return self.machine.call(self.accessor.__setitem__, index, values)
 
     def __len__(self):
-        with self.cv:
-            return self.accessor.__len__()
+        return self.accessor.__len__()
+
+
+class MachineState:
+    # Nothing to run, the thread is waiting for a command
+    STOPPED = 0
+    RUNNING = 1
+    # The last run ended with the cpu waiting for an interrupt
+    WAITING = 2
+    # The thread has gone, so nothing more will run
+    DEAD = 3
+
+
+class MachineRun(object):
+    def __init__(self, cycles):
+        self.cycles = cycles
+        self.future = concurrent.futures.Future()
+
+
+class MachineCall(object):
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.future = concurrent.futures.Future()
+
+    def execute(self):
+        try:
+            self.future.set_result(self.function(*self.args))
+        except BaseException as e:
+            self.future.set_exception(e)
 
 
 class Machine:
-    def __init__(self, cpu_size, cpu_rom):
+    # The cpu runs on a thread of its own, and nothing else touches it directly. Everything else puts commands
+    # on a queue for that thread, and gets a future back for when it's done. Runs are done in slices of
+    # slice_cycles, and between slices the thread does whatever else has been asked of it, so a memory access
+    # from another thread waits for at most one slice rather than for a whole run, and the main thread can
+    # draw a frame while the cpu gets on with the next one.
+    slice_cycles = 0x4000
+
+    STOP = object()
+    WAKE = object()
+    QUIT = object()
+
+    # A headless machine's devices don't draw anything or make any sound, so it needs neither pygame nor
+    # OpenGL and can be run on a server, as many at a time as there are cpus for. Its clock keeps the cpu's
+    # time like any other. The cpu runs in block mode unless the caller asks for another exec_mode, such as
+    # armv2.ExecMode.JIT
+    def __init__(self, cpu_size, cpu_rom, headless=False, exec_mode=armv2.ExecMode.BLOCKS):
         self.rom_filename = cpu_rom
+        self.headless = headless
         self.cpu = armv2.Armv2(size=cpu_size, filename=cpu_rom)
+        self.cpu.exec_mode = exec_mode
         self.hardware = []
-        self.running = True
-        self.steps_to_run = 0
-        # I'm not sure why I need a regular lock here rather than the default (A RLock), but with the default
-        # I get weird deadlocks on KeyboardInterrupt
-        self.cv = threading.Condition(threading.Lock())
-        self.mem = MemPassthrough(self.cv, self.cpu.mem)
-        self.memw = MemPassthrough(self.cv, self.cpu.memw)
+        self.commands = queue.SimpleQueue()
+        # Only used by the cpu thread
+        self.runs = collections.deque()
+        self.last_run = None
+        self.state = MachineState.STOPPED
+        self.mem = MemPassthrough(self, self.cpu.mem)
+        self.memw = MemPassthrough(self, self.cpu.memw)
         self.thread = threading.Thread(target=self.thread_main)
         self.tape_drive = None
         self.status = armv2.Status.OK
         self.thread.start()
 
+    def call(self, function, *args):
+        # Call function on the cpu thread while the cpu isn't running and wait for what it returns. Device
+        # callbacks are already on that thread, so they get it called straight away
+        if threading.current_thread() is self.thread:
+            return function(*args)
+        return self.post(function, *args).result()
+
+    def post(self, function, *args):
+        # Like call but without waiting, it returns a concurrent.futures.Future for the result
+        command = MachineCall(function, args)
+        if self.state == MachineState.DEAD:
+            raise RuntimeError("Thread is not running!")
+        self.commands.put(command)
+        return command.future
+
     @property
     def regs(self):
-        with self.cv:
-            return self.cpu.regs
+        return self.call(getattr, self.cpu, "regs")
 
     @regs.setter
     def regs(self, value):
-        with self.cv:
-            self.cpu.regs = value
+        self.call(setattr, self.cpu, "regs", value)
+
+    def snapshot(self):
+        # Only the cpu and its RAM, the devices carry on as they are
+        return self.call(self.cpu.snapshot)
+
+    def restore(self, snapshot):
+        self.call(self.cpu.restore, snapshot)
+
+    def get_all_regs(self):
+        return self.call(self.cpu.get_all_regs)
+
+    def set_all_regs(self, regs):
+        self.call(self.cpu.set_all_regs, regs)
 
     @property
     def stepping(self):
-        with self.cv:
-            return self.steps_to_run != 0
+        return self.last_run is not None and not self.last_run.done()
 
     @property
     def mode(self):
-        with self.cv:
-            return self.cpu.mode
+        return self.call(getattr, self.cpu, "mode")
 
     @property
     def pc(self):
-        with self.cv:
-            return self.cpu.pc
+        return self.call(getattr, self.cpu, "pc")
 
     @property
     def pc_value(self):
-        with self.cv:
-            return self.cpu.pc & 0x03FFFFFC
+        return self.pc & 0x03FFFFFC
+
+    @property
+    def skipped_cycles(self):
+        return self.call(getattr, self.cpu, "skipped_cycles")
+
+    def memory_regions(self):
+        # Read only views of the mapped RAM, see Armv2.memory_regions. Nothing stops the cpu writing to them
+        # while they're read, so only look at them while the cpu isn't running
+        return self.call(self.cpu.memory_regions)
 
     @property
     def cpsr(self):
@@ -895,54 +975,92 @@ class Machine:
         cpsr = self.regs[15] & 0xFC000000
         return mode | cpsr
 
-    def thread_main_loop(self):
-        while self.running and (
-            (self.steps_to_run == 0)
-            or (self.status == armv2.Status.WAIT_FOR_INTERRUPT and not (self.cpu.pins & armv2.Pins.INTERRUPT))
-        ):
-            self.cv.wait(5)
-            num_left = self.steps_to_run
-            if self.steps_to_run > 0:
-                # self.cv.release()
-                # self.cv.notify()
-                self.status, num_left = self.cpu.step(self.steps_to_run)
-                # self.cv.acquire()
-            if num_left != self.steps_to_run:
-                armv2.debug_log(f"{self.steps_to_run=:d} {self.status=:x} {num_left=} {self.cpu.pins=:x}")
-            self.steps_to_run = 0
-            self.cv.notify()
+    def take_commands(self, block):
+        # Do everything that's been asked of us, waiting for something first if block is set. Returns False
+        # once we've been told to quit
+        try:
+            command = self.commands.get(block)
+            while True:
+                if command is self.QUIT:
+                    return False
+                if command is self.WAKE:
+                    self.wake()
+                elif command is self.STOP:
+                    while self.runs:
+                        self.runs.popleft().future.set_result(self.status)
+                elif isinstance(command, MachineRun):
+                    self.runs.append(command)
+                else:
+                    command.execute()
+                command = self.commands.get_nowait()
+        except queue.Empty:
+            pass
+        return True
+
+    def run_slice(self):
+        run = self.runs[0]
+        if self.status == armv2.Status.WAIT_FOR_INTERRUPT and not (self.cpu.pins & armv2.Pins.INTERRUPT):
+            # There's no point running until something interrupts us
+            num_left = run.cycles
+        else:
+            self.state = MachineState.RUNNING
+            cycles = min(run.cycles, self.slice_cycles)
+            self.status, num_left = self.cpu.step(cycles)
+            if num_left and armv2.debug_enabled:
+                armv2.debug_log("status=%x num_left=%d pins=%x", self.status, num_left, self.cpu.pins)
+            run.cycles -= cycles - num_left
+            if run.cycles and self.status == armv2.Status.OK:
+                return
+
+        self.runs.popleft()
+        if self.status == armv2.Status.WAIT_FOR_INTERRUPT:
+            self.state = MachineState.WAITING
+        else:
+            self.state = MachineState.STOPPED
+        run.future.set_result(self.status)
 
     def thread_main(self):
         try:
-            with self.cv:
-                while self.running:
-                    self.thread_main_loop()
+            while self.take_commands(block=not self.runs):
+                if self.runs:
+                    self.run_slice()
         finally:
-            # in case we exit this and leave running on (due to an exception say)
-            self.running = False
+            # in case we exit this due to an exception say, nobody should be left waiting
+            self.state = MachineState.DEAD
+            error = RuntimeError("Thread is not running!")
+            while self.runs:
+                self.runs.popleft().future.set_exception(error)
+            try:
+                while True:
+                    command = self.commands.get_nowait()
+                    if isinstance(command, (MachineRun, MachineCall)):
+                        command.future.set_exception(error)
+            except queue.Empty:
+                pass
 
     def step(self, num):
-        with self.cv:
-            self.steps_to_run = int(num)
-            self.cv.notify()
+        # Run num cycles, or until a breakpoint or waiting for an interrupt. Returns a
+        # concurrent.futures.Future for the status it stops with
+        run = MachineRun(int(num))
+        if self.state == MachineState.DEAD:
+            raise RuntimeError("Thread is not running!")
+        self.commands.put(run)
+        self.last_run = run.future
+        return run.future
 
     def step_and_wait(self, num):
-        self.step(num)
+        return self.step(num).result()
 
-        with self.cv:
-            while self.running:
-                while self.running and (self.steps_to_run and self.status != armv2.Status.WAIT_FOR_INTERRUPT):
-                    self.cv.wait(0.1)
+    async def run(self, cycles):
+        # The same as step for asyncio, e.g. status = await machine.run(cycles)
+        return await asyncio.wrap_future(self.step(cycles))
 
-                if not self.running:
-                    break
-                return self.status
-            # if we get here it's not running
-            raise RuntimeError("Thread is not running!")
+    def stop(self):
+        # Abandon every run that hasn't finished, they complete with the status the cpu stopped with
+        self.commands.put(self.STOP)
 
     def add_hardware(self, device, name=None):
-        with self.cv:
-            self.cpu.add_hardware(device)
+        self.call(self.cpu.add_hardware, device)
         self.hardware.append(device)
         if name is not None:
             setattr(self, name, device)
@@ -967,23 +1085,28 @@ class Machine:
         self.cpu.reset_watchpoints()
 
     def delete(self):
-        with self.cv:
-            self.running = False
-            self.cv.notify()
+        self.commands.put(self.QUIT)
         armv2.debug_log("joining thread")
         self.thread.join()
         armv2.debug_log("Killed")
         if self.tape_drive:
             self.tape_drive.delete()
 
+    def wake(self):
+        # If the CPU is presently paused, it won't ever know it's received an interrupt, it needs to take
+        # one step to take the exception
+        if not self.runs:
+            self.runs.append(MachineRun(1))
+
     def interrupt(self, hw_id, code):
-        with self.cv:
-            self.cpu.interrupt(hw_id, code)
-            # If the CPU is presently paused, it won't ever know it's received an interrupt, it needs to take
-            # one step to take the exception
-            if self.steps_to_run == 0:
-                self.steps_to_run = 1
-            self.cv.notify()
+        # The core queues interrupts itself without a lock, so this can come from any thread and only has to
+        # make sure the cpu thread gets round to taking it
+        if not self.cpu.interrupt(hw_id, code) and armv2.debug_enabled:
+            armv2.debug_log("interrupt queue full, dropped %x %x", hw_id, code)
+        if threading.current_thread() is self.thread:
+            self.wake()
+        elif self.state != MachineState.DEAD:
+            self.commands.put(self.WAKE)
 
     def is_waiting(self):
         return self.status == armv2.Status.WAIT_FOR_INTERRUPT
@@ -1009,3 +1132,16 @@ class Machine:
         #         length = width*4 + data*10
         #         while length >= width:
         #             self.display.screen.fill(colour_one, pygame.Rect((pos%width,pos // width),((pos+length)
+
+
+def new_machine(boot_rom, headless=False, exec_mode=armv2.ExecMode.BLOCKS):
+    machine = Machine(cpu_size=1 << 18, cpu_rom=boot_rom, headless=headless, exec_mode=exec_mode)
+    try:
+        machine.add_hardware(Keyboard(machine), name="keyboard")
+        machine.add_hardware(Display(machine, scale_factor=1), name="display")
+        machine.add_hardware(Clock(machine), name="clock")
+        machine.add_hardware(TapeDrive(machine), name="tape_drive")
+    except:
+        machine.delete()
+        raise
+    return machine
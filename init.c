@@ -51,16 +51,23 @@ enum armv2_status init(struct armv2 *cpu, uint32_t memsize)
     }
 
     memset(cpu, 0, sizeof(struct armv2));
-    /* cpu->physical_ram = malloc(memsize); */
-    /* if( NULL == cpu->physical_ram ) { */
-    /*     cpu->physical_ram = NULL; */
-    /*     return ARMV2STATUS_MEMORY_ERROR; */
-    /* } */
+    //Pages can be faulted in anywhere in the address space, so we reserve all of it rather than just memsize.
+    //Nothing is backed until it's touched, and fault() still keeps us to memsize worth of pages. If we can't
+    //have it, fault() maps each page separately instead
+    cpu->physical_ram = mmap(NULL, MAX_MEMORY, PROT_READ | PROT_WRITE, MAP_ANONYMOUS | MAP_PRIVATE | MAP_NORESERVE,
+                             -1, 0);
+    if( MAP_FAILED == cpu->physical_ram ) {
+        LOG("Error reserving physical ram, mapping pages separately\n");
+        cpu->physical_ram = NULL;
+    }
 
     cpu->physical_ram_size = memsize;
     cpu->free_ram = cpu->physical_ram_size;
+    cpu->next_event = NO_EVENT;
+    for( uint32_t i = 0; i < INTERRUPT_QUEUE_SIZE; i++ ) {
+        cpu->interrupts.entries[i].sequence = i;
+    }
     LOG("Have %u pages %u\n", num_pages, memsize);
-    //memset(cpu->physical_ram, 0, memsize);
 
     reset_breakpoints(cpu);
     reset_watchpoints(cpu);
@@ -87,6 +94,7 @@ enum armv2_status init(struct armv2 *cpu, uint32_t memsize)
     /* } */
 
     cpu->flags = FLAG_INIT;
+    cpu->jit_threshold = JIT_THRESHOLD;
     //Start with the interrupt flag on so we don't get interrupts until we're ready
     cpu->regs.actual[PC] = MODE_SUP | FLAG_I;
     cpu->pins = 0;
@@ -97,9 +105,7 @@ enum armv2_status init(struct armv2 *cpu, uint32_t memsize)
     }
 
     //We start in supervisor mode bank those registers
-    for(uint32_t i=13; i < 15; i++) {
-        cpu->regs.effective[i] = &cpu->regs.actual[R13_S + (i - 13)];
-    }
+    bank_registers(cpu);
 
     //Set up the exception conditions
     for(uint32_t i=0;i<EXCEPT_NONE;i++) {
@@ -130,15 +136,304 @@ static void clean_bitmask(uint64_t **bm) {
     }
 }
 
-static void cleanup_page_info(struct page_info **info) {
-    if( NULL == info ) {
+// The first of the mapped regions that ends at or after addr, or the number of them if there isn't one
+static uint32_t region_from(struct armv2 *cpu, uint32_t addr)
+{
+    uint32_t low  = 0;
+    uint32_t high = cpu->num_mapped_regions;
+
+    while( low < high ) {
+        uint32_t mid = low + (high - low) / 2;
+        if( cpu->mapped_regions[mid].end < addr ) {
+            low = mid + 1;
+        }
+        else {
+            high = mid;
+        }
+    }
+    return low;
+}
+
+static void region_insert(struct armv2 *cpu, uint32_t index, uint32_t start, uint32_t end)
+{
+    memmove(cpu->mapped_regions + index + 1, cpu->mapped_regions + index,
+            (cpu->num_mapped_regions - index) * sizeof(struct region));
+    cpu->mapped_regions[index].start = start;
+    cpu->mapped_regions[index].end   = end;
+    cpu->num_mapped_regions++;
+}
+
+static void region_delete(struct armv2 *cpu, uint32_t index)
+{
+    cpu->num_mapped_regions--;
+    memmove(cpu->mapped_regions + index, cpu->mapped_regions + index + 1,
+            (cpu->num_mapped_regions - index) * sizeof(struct region));
+}
+
+// Pages come and go one at a time, so a new one can only grow the region next to it, join the two either
+// side of it, or start a region of its own. It mustn't already be in there
+void region_index_add(struct armv2 *cpu, uint32_t page_num)
+{
+    uint32_t start = page_num << PAGE_SIZE_BITS;
+    uint32_t end   = start + PAGE_SIZE;
+    uint32_t index = region_from(cpu, start);
+    struct region *region = cpu->mapped_regions + index;
+
+    if( index < cpu->num_mapped_regions && region->end == start ) {
+        region->end = end;
+        if( index + 1 < cpu->num_mapped_regions && region[1].start == end ) {
+            region->end = region[1].end;
+            region_delete(cpu, index + 1);
+        }
+    }
+    else if( index < cpu->num_mapped_regions && region->start == end ) {
+        region->start = start;
+    }
+    else {
+        region_insert(cpu, index, start, end);
+    }
+    cpu->map_generation++;
+}
+
+// ...and taking one away shrinks, splits or gets rid of the region it was in
+void region_index_remove(struct armv2 *cpu, uint32_t page_num)
+{
+    uint32_t start = page_num << PAGE_SIZE_BITS;
+    uint32_t end   = start + PAGE_SIZE;
+    uint32_t index = region_from(cpu, end);
+    struct region *region = cpu->mapped_regions + index;
+
+    if( index >= cpu->num_mapped_regions || region->start > start ) {
         return;
     }
-    if( NULL != (*info)->memory && MAP_FAILED != (*info)->memory) {
+    if( region->start == start && region->end == end ) {
+        region_delete(cpu, index);
+    }
+    else if( region->start == start ) {
+        region->start = end;
+    }
+    else if( region->end == end ) {
+        region->end = start;
+    }
+    else {
+        region_insert(cpu, index + 1, end, region->end);
+        region->end = start;
+    }
+    cpu->map_generation++;
+}
+
+static void cleanup_page_info(struct armv2 *cpu, uint32_t page_num) {
+    struct page_info **info = &cpu->page_tables[page_num];
+
+    CLEAR_PAGE_BIT(cpu->ram_readable, page_num);
+    CLEAR_PAGE_BIT(cpu->ram_writable, page_num);
+    if( NULL != cpu->physical_ram && (*info)->memory == cpu->physical_ram + page_num * WORDS_PER_PAGE ) {
+        //This gives the memory back but leaves the page reserved. After a restore or a clone physical_ram is a
+        //private mapping of the snapshot's file, which MADV_DONTNEED would bring the snapshot's contents back
+        //from, so the page gets a fresh anonymous mapping to make sure it's zeroes if it's faulted in again
+        if( MAP_FAILED == mmap((*info)->memory, PAGE_SIZE, PROT_READ | PROT_WRITE,
+                               MAP_ANONYMOUS | MAP_PRIVATE | MAP_FIXED | MAP_NORESERVE, -1, 0) ) {
+            memset((*info)->memory, 0, PAGE_SIZE);
+        }
+    }
+    else if( NULL == (*info)->mapped_device && NULL != (*info)->memory && MAP_FAILED != (*info)->memory) {
+        //A device's pages are its own memory, so they're its to free
         munmap((*info)->memory, PAGE_SIZE);
     }
+    (void)free((*info)->decoded);
+    flush_blocks(*info);
+    (void)free((*info)->blocks);
     (void)free(*info);
     *info = NULL;
+    region_index_remove(cpu, page_num);
+}
+
+// Undo fault() or map_memory() for the page containing addr
+enum armv2_status release_page(struct armv2 *cpu, uint32_t addr)
+{
+    if( NULL == cpu || PAGEOF(addr) >= NUM_PAGE_TABLES ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( NULL != cpu->page_tables[PAGEOF(addr)] ) {
+        cleanup_page_info(cpu, PAGEOF(addr));
+        cpu->free_ram += PAGE_SIZE;
+    }
+    return ARMV2STATUS_OK;
+}
+
+// Where a device sees addr, the same as the load and store instructions give it
+static void *device_offset(struct page_info *page, uint32_t addr, uint32_t *offset)
+{
+    if( page->mapped_device ) {
+        *offset = addr - page->mapped_device->mapped.start;
+        return page->mapped_device->extra;
+    }
+    *offset = INPAGE(addr);
+    return NULL;
+}
+
+static uint32_t device_read(struct page_info *page, uint32_t addr)
+{
+    uint32_t offset;
+    void *extra = device_offset(page, addr, &offset);
+
+    return page->read_callback(extra, offset, 0);
+}
+
+static void device_write(struct page_info *page, uint32_t addr, uint32_t value)
+{
+    uint32_t offset;
+    void *extra = device_offset(page, addr, &offset);
+
+    page->write_callback(extra, offset, value);
+}
+
+// Fill regs with ALL_REGS_SIZE words describing every register at once, see ALL_REGS_EFFECTIVE
+enum armv2_status get_all_regs(struct armv2 *cpu, uint32_t *regs)
+{
+    if( NULL == cpu || NULL == regs ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    MATERIALISE_FLAGS(cpu);
+    for( uint32_t i = 0; i < NUM_EFFECTIVE_REGS; i++ ) {
+        regs[ALL_REGS_EFFECTIVE + i] = GETREG(cpu, i);
+    }
+    regs[ALL_REGS_CPSR] = cpu->regs.actual[PC] & 0xfc000003;
+    regs[ALL_REGS_MODE] = GETMODE(cpu);
+    regs[ALL_REGS_PC]   = (cpu->pc + 4) & 0x03fffffc;
+    memcpy(regs + ALL_REGS_ACTUAL, cpu->regs.actual, sizeof(cpu->regs.actual));
+
+    return ARMV2STATUS_OK;
+}
+
+// The other way round to get_all_regs. Every register is set from the ALL_REGS_ACTUAL part, and then the ones
+// in the ALL_REGS_EFFECTIVE part on top of them, for the mode in its r15. The other parts are only there for
+// reading, so the cpu carries on from the pc in r15 just as it would after a movs pc
+enum armv2_status set_all_regs(struct armv2 *cpu, const uint32_t *regs)
+{
+    if( NULL == cpu || NULL == regs ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    cpu->lazy.op = LAZY_NONE;
+    memcpy(cpu->regs.actual, regs + ALL_REGS_ACTUAL, sizeof(cpu->regs.actual));
+    cpu->regs.actual[PC] = regs[ALL_REGS_EFFECTIVE + PC];
+    bank_registers(cpu);
+    for( uint32_t i = 0; i < NUM_EFFECTIVE_REGS; i++ ) {
+        GETREG(cpu, i) = regs[ALL_REGS_EFFECTIVE + i];
+    }
+    cpu->pc = (regs[ALL_REGS_EFFECTIVE + PC] & 0x03fffffc) - 4;
+
+    return ARMV2STATUS_OK;
+}
+
+// Copy len bytes of the guest's memory starting at addr into buf, the way the debugger sees it: RAM is copied
+// a page at a time, devices are asked for each word once and unmapped memory reads as zero. Guest words are
+// kept in host order, so on our little endian hosts the bytes of a RAM page are already in guest order
+enum armv2_status read_block(struct armv2 *cpu, uint32_t addr, uint32_t len, uint8_t *buf)
+{
+    if( NULL == cpu || (NULL == buf && len) || addr > MAX_MEMORY || len > MAX_MEMORY - addr ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+
+    while( len > 0 ) {
+        struct page_info *page = cpu->page_tables[PAGEOF(addr)];
+        uint32_t amount = PAGE_SIZE - INPAGE(addr);
+
+        if( amount > len ) {
+            amount = len;
+        }
+        if( NULL == page || (NULL == page->read_callback && NULL == page->memory) ) {
+            memset(buf, 0, amount);
+        }
+        else if( NULL == page->read_callback ) {
+            memcpy(buf, ((uint8_t*)page->memory) + INPAGE(addr), amount);
+        }
+        else {
+            for( uint32_t i = 0; i < amount; ) {
+                uint32_t word = device_read(page, (addr + i) & ~3);
+                for( uint32_t b = (addr + i) & 3; b < 4 && i < amount; b++, i++ ) {
+                    buf[i] = (word >> (b << 3)) & 0xff;
+                }
+            }
+        }
+        addr += amount;
+        buf  += amount;
+        len  -= amount;
+    }
+
+    return ARMV2STATUS_OK;
+}
+
+// The other way round. RAM that hasn't been touched yet is faulted in, as it would be for a store from the
+// cpu, but every page has to be there or faultable or nothing is written. Anything decoded from RAM we write
+// over is thrown away, and a device gets a write for each word, with partial words read first so the bytes
+// around the ones we're writing stay the same
+enum armv2_status write_block(struct armv2 *cpu, uint32_t addr, uint32_t len, const uint8_t *buf)
+{
+    uint32_t missing = 0;
+
+    if( NULL == cpu || (NULL == buf && len) || addr > MAX_MEMORY || len > MAX_MEMORY - addr ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( 0 == len ) {
+        return ARMV2STATUS_OK;
+    }
+    for( uint32_t page_num = PAGEOF(addr); page_num <= PAGEOF(addr + len - 1); page_num++ ) {
+        struct page_info *page = cpu->page_tables[page_num];
+        if( NULL == page ) {
+            missing++;
+        }
+        else if( NULL == page->write_callback && NULL == page->memory ) {
+            return ARMV2STATUS_INVALID_PAGE;
+        }
+    }
+    if( missing > cpu->free_ram / PAGE_SIZE ) {
+        return ARMV2STATUS_INVALID_PAGE;
+    }
+    for( uint32_t page_num = PAGEOF(addr); missing && page_num <= PAGEOF(addr + len - 1); page_num++ ) {
+        if( NULL == cpu->page_tables[page_num] ) {
+            if( ARMV2STATUS_OK != fault(cpu, page_num << PAGE_SIZE_BITS) ) {
+                return ARMV2STATUS_INVALID_PAGE;
+            }
+            missing--;
+        }
+    }
+
+    while( len > 0 ) {
+        struct page_info *page = cpu->page_tables[PAGEOF(addr)];
+        uint32_t amount = PAGE_SIZE - INPAGE(addr);
+
+        if( amount > len ) {
+            amount = len;
+        }
+        if( NULL == page->write_callback ) {
+            memcpy(((uint8_t*)page->memory) + INPAGE(addr), buf, amount);
+            for( uint32_t word = addr & ~3; word < addr + amount; word += 4 ) {
+                INVALIDATE_DECODED(page, word);
+                MARK_DIRTY(page, word);
+            }
+        }
+        else {
+            for( uint32_t i = 0; i < amount; ) {
+                uint32_t word_addr = (addr + i) & ~3;
+                uint32_t word = 0;
+                uint32_t b = (addr + i) & 3;
+
+                if( 0 != b || amount - i < 4 ) {
+                    word = page->read_callback ? device_read(page, word_addr) : 0;
+                }
+                for( ; b < 4 && i < amount; b++, i++ ) {
+                    word = (word & ~(0xffu << (b << 3))) | ((uint32_t)buf[i] << (b << 3));
+                }
+                device_write(page, word_addr, word);
+            }
+        }
+        addr += amount;
+        buf  += amount;
+        len  -= amount;
+    }
+
+    return ARMV2STATUS_OK;
 }
 
 enum armv2_status cleanup_armv2(struct armv2 *cpu)
@@ -154,11 +449,13 @@ enum armv2_status cleanup_armv2(struct armv2 *cpu)
     }
 
     for( uint32_t i = 0;i < NUM_PAGE_TABLES; i++ ) {
-        if(NULL != cpu->page_tables[i]) {
-            cleanup_page_info(&cpu->page_tables[i]);
-            cpu->free_ram += PAGE_SIZE;
-        }
+        (void)release_page(cpu, i << PAGE_SIZE_BITS);
+    }
+    if( NULL != cpu->physical_ram ) {
+        munmap(cpu->physical_ram, MAX_MEMORY);
+        cpu->physical_ram = NULL;
     }
+    jit_cleanup(cpu);
     return ARMV2STATUS_OK;
 }
 
@@ -210,6 +507,10 @@ static enum armv2_status load_section( struct armv2 *cpu, uint32_t start, uint32
             }
         }
         read_bytes = fread(cpu->page_tables[page_num]->memory, 1, to_read,f);
+        //The whole page may have changed, so anything we've decoded from it is stale
+        free(cpu->page_tables[page_num]->decoded);
+        cpu->page_tables[page_num]->decoded = NULL;
+        cpu->page_tables[page_num]->blocks_stale = 1;
 
         if( read_bytes != to_read ) {
             if( read_bytes != section_length ) {
@@ -311,6 +612,7 @@ enum armv2_status map_memory(struct armv2 *cpu, uint32_t device_num, uint32_t st
     }
 
     uint32_t page_pos    = 0;
+    uint32_t page_num    = 0;
     uint32_t page_start  = PAGEOF(start);
     uint32_t page_end    = PAGEOF(end);
     struct hardware_mapping hw_mapping = {0};
@@ -358,9 +660,18 @@ enum armv2_status map_memory(struct armv2 *cpu, uint32_t device_num, uint32_t st
                 page->mapped_device = hw_mapping.device;
             }
             cpu->page_tables[page_pos] = page;
+            region_index_add(cpu, page_pos);
         }
         //Already checked everything's OK, and we're single threaded, so this should be ok I think...
 
+        page_num = page_pos - page_start;
+        if( hw_mapping.device->memory && page_num < 64 && ((hw_mapping.device->ram_pages >> page_num) & 1) ) {
+            page->memory = hw_mapping.device->memory + page_num * WORDS_PER_PAGE;
+            if( hw_mapping.device->dirty ) {
+                page->dirty = hw_mapping.device->dirty + page_num;
+            }
+            continue;
+        }
         page->read_callback       = hw_mapping.device->read_callback;
         page->write_callback      = hw_mapping.device->write_callback;
         page->read_byte_callback  = hw_mapping.device->read_byte_callback;
@@ -390,29 +701,102 @@ enum armv2_status add_mapping(struct hardware_mapping **head, struct hardware_ma
     return ARMV2STATUS_OK;
 }
 
+// Whether an interrupt just like this one is already waiting to be taken. The cpu could be taking it off
+// while we look, so an entry only counts if its sequence says it's still there after we've read it
+static int interrupt_queued(struct interrupt_queue *queue, uint32_t hw_id, uint32_t code)
+{
+    uint32_t tail = __atomic_load_n(&queue->tail, __ATOMIC_ACQUIRE);
+
+    for( uint32_t pos = __atomic_load_n(&queue->head, __ATOMIC_ACQUIRE); pos != tail; pos++ ) {
+        struct interrupt_entry *entry = queue->entries + (pos & (INTERRUPT_QUEUE_SIZE - 1));
+        uint32_t id, entry_code;
+
+        if( __atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) != pos + 1 ) {
+            continue;
+        }
+        id         = __atomic_load_n(&entry->id, __ATOMIC_RELAXED);
+        entry_code = __atomic_load_n(&entry->code, __ATOMIC_RELAXED);
+        if( id == hw_id && entry_code == code && __atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) == pos + 1 ) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+// Queue an interrupt for the cpu to take once it has IRQs enabled. This is safe from any thread, even while
+// the cpu is running, as nothing here takes a lock: a poster claims the entry at the tail by moving the tail
+// on, fills it in, and then moves its sequence on to say it's ready. An interrupt from a device with the
+// same code as one that's still waiting is dropped, as the handler will find whatever it was for when it
+// gets to that one. If the queue is full we return ARMV2STATUS_MEMORY_ERROR and the interrupt is lost
 enum armv2_status interrupt(struct armv2 *cpu, uint32_t hw_id, uint32_t code)
 {
+    struct interrupt_queue *queue;
+    struct interrupt_entry *entry;
+    uint32_t pos;
+
     if( NULL == cpu || !CPU_INITIALISED(cpu) ) {
         return ARMV2STATUS_INVALID_ARGS;
     }
+    queue = &cpu->interrupts;
+    if( interrupt_queued(queue, hw_id, code) ) {
+        return ARMV2STATUS_OK;
+    }
+
+    pos = __atomic_load_n(&queue->tail, __ATOMIC_RELAXED);
+    while( 1 ) {
+        int32_t diff;
 
-    //TODO: some kind of interrupt queue, for now drop interrupts that happen while we're doing this
-    if( PIN_OFF(cpu,I) && FLAG_CLEAR(cpu,I) ) {
-        cpu->hardware_manager.last_interrupt_id = hw_id;
-        cpu->hardware_manager.last_interrupt_code = code;
-        SETPIN(cpu,I);
+        entry = queue->entries + (pos & (INTERRUPT_QUEUE_SIZE - 1));
+        diff  = (int32_t)(__atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) - pos);
+        if( 0 == diff ) {
+            //On failure pos is updated to where the tail is now
+            if( __atomic_compare_exchange_n(&queue->tail, &pos, pos + 1, 1, __ATOMIC_RELAXED, __ATOMIC_RELAXED) ) {
+                break;
+            }
+        }
+        else if( diff < 0 ) {
+            //The entry still has the one from a trip round ago in it
+            return ARMV2STATUS_MEMORY_ERROR;
+        }
+        else {
+            pos = __atomic_load_n(&queue->tail, __ATOMIC_RELAXED);
+        }
     }
 
+    __atomic_store_n(&entry->id, hw_id, __ATOMIC_RELAXED);
+    __atomic_store_n(&entry->code, code, __ATOMIC_RELAXED);
+    __atomic_store_n(&entry->sequence, pos + 1, __ATOMIC_RELEASE);
+    __atomic_fetch_or(&cpu->pins, PIN_I, __ATOMIC_RELEASE);
+
     return ARMV2STATUS_OK;
 }
 
+static void update_debug_flag(struct armv2 *cpu)
+{
+    if( cpu->num_breakpoints || cpu->num_watchpoints[READ_WATCHPOINT] || cpu->num_watchpoints[WRITE_WATCHPOINT] ) {
+        SETCPUFLAG(cpu, DEBUG);
+    }
+    else {
+        CLEARCPUFLAG(cpu, DEBUG);
+    }
+}
+
 enum armv2_status set_breakpoint(struct armv2 *cpu, uint32_t addr)
 {
     if( NULL == cpu || !CPU_INITIALISED(cpu) || NULL == cpu->breakpoint_bitmask ) {
         return ARMV2STATUS_INVALID_ARGS;
     }
 
-    SET_BREAKPOINT(cpu, addr);
+    if( !HAS_BREAKPOINT(cpu, addr) ) {
+        SET_BREAKPOINT(cpu, addr);
+        cpu->num_breakpoints++;
+        update_debug_flag(cpu);
+    }
+    //Blocks are built so that breakpoints are always at the start of one, so any that run over this
+    //address need rebuilding
+    if( PAGEOF(addr) < NUM_PAGE_TABLES && NULL != cpu->page_tables[PAGEOF(addr)] ) {
+        cpu->page_tables[PAGEOF(addr)]->blocks_stale = 1;
+    }
 
     return ARMV2STATUS_OK;
 }
@@ -423,7 +807,14 @@ enum armv2_status unset_breakpoint(struct armv2 *cpu, uint32_t addr)
         return ARMV2STATUS_INVALID_ARGS;
     }
 
-    CLEAR_BREAKPOINT(cpu, addr);
+    if( HAS_BREAKPOINT(cpu, addr) ) {
+        CLEAR_BREAKPOINT(cpu, addr);
+        cpu->num_breakpoints--;
+        update_debug_flag(cpu);
+    }
+    if( PAGEOF(addr) < NUM_PAGE_TABLES && NULL != cpu->page_tables[PAGEOF(addr)] ) {
+        cpu->page_tables[PAGEOF(addr)]->blocks_stale = 1;
+    }
 
     return ARMV2STATUS_OK;
 }
@@ -434,20 +825,15 @@ enum armv2_status set_watchpoint(struct armv2 *cpu, enum watchpoint_type type, u
         return ARMV2STATUS_INVALID_ARGS;
     }
 
-    switch( type ) {
-    case READ_WATCHPOINT:
-        SET_READ_WATCHPOINT(cpu, addr);
-        break;
-
-    case WRITE_WATCHPOINT:
-        SET_WRITE_WATCHPOINT(cpu, addr);
-        break;
-
-    case ACCESS_WATCHPOINT:
+    if( (READ_WATCHPOINT == type || ACCESS_WATCHPOINT == type) && !HAS_WATCHPOINT(cpu, READ, addr) ) {
         SET_READ_WATCHPOINT(cpu, addr);
+        cpu->num_watchpoints[READ_WATCHPOINT]++;
+    }
+    if( (WRITE_WATCHPOINT == type || ACCESS_WATCHPOINT == type) && !HAS_WATCHPOINT(cpu, WRITE, addr) ) {
         SET_WRITE_WATCHPOINT(cpu, addr);
-        break;
+        cpu->num_watchpoints[WRITE_WATCHPOINT]++;
     }
+    update_debug_flag(cpu);
 
     return ARMV2STATUS_OK;
 }
@@ -458,20 +844,15 @@ enum armv2_status unset_watchpoint(struct armv2 *cpu, enum watchpoint_type type,
         return ARMV2STATUS_INVALID_ARGS;
     }
 
-    switch( type ) {
-    case READ_WATCHPOINT:
-        CLEAR_READ_WATCHPOINT(cpu, addr);
-        break;
-
-    case WRITE_WATCHPOINT:
-        CLEAR_WRITE_WATCHPOINT(cpu, addr);
-        break;
-
-    case ACCESS_WATCHPOINT:
+    if( (READ_WATCHPOINT == type || ACCESS_WATCHPOINT == type) && HAS_WATCHPOINT(cpu, READ, addr) ) {
         CLEAR_READ_WATCHPOINT(cpu, addr);
+        cpu->num_watchpoints[READ_WATCHPOINT]--;
+    }
+    if( (WRITE_WATCHPOINT == type || ACCESS_WATCHPOINT == type) && HAS_WATCHPOINT(cpu, WRITE, addr) ) {
         CLEAR_WRITE_WATCHPOINT(cpu, addr);
-        break;
+        cpu->num_watchpoints[WRITE_WATCHPOINT]--;
     }
+    update_debug_flag(cpu);
 
     return ARMV2STATUS_OK;
 }
@@ -480,6 +861,8 @@ enum armv2_status unset_watchpoint(struct armv2 *cpu, enum watchpoint_type type,
 enum armv2_status reset_breakpoints(struct armv2 *cpu)
 {
     clean_bitmask(&cpu->breakpoint_bitmask);
+    cpu->num_breakpoints = 0;
+    update_debug_flag(cpu);
     //We want a bit for every addressable word, i.e one every 32 bits
     cpu->breakpoint_bitmask = mmap(NULL, BP_BITMASK_SIZE, PROT_READ | PROT_WRITE,
                                    MAP_ANONYMOUS | MAP_SHARED, -1, 0);
@@ -495,6 +878,7 @@ enum armv2_status reset_watchpoints(struct armv2 *cpu)
     //Do the same thing for watchpoint masks
     for(int i = 0; i < MAX_WATCHPOINT; i++) {
         clean_bitmask(cpu->watchpoint_bitmask + i);
+        cpu->num_watchpoints[i] = 0;
         cpu->watchpoint_bitmask[i] = mmap(NULL, BP_BITMASK_SIZE, PROT_READ | PROT_WRITE,
                                           MAP_ANONYMOUS | MAP_SHARED, -1, 0);
         if( MAP_FAILED == cpu->watchpoint_bitmask[i] ) {
@@ -502,6 +886,7 @@ enum armv2_status reset_watchpoints(struct armv2 *cpu)
             goto cleanup;
         }
     }
+    update_debug_flag(cpu);
 
     return ARMV2STATUS_OK;
 cleanup:
@@ -511,3 +896,14 @@ cleanup:
 
     return ARMV2STATUS_MEMORY_ERROR;
 }
+
+enum armv2_status set_exec_mode(struct armv2 *cpu, enum exec_mode mode)
+{
+    if( NULL == cpu || !CPU_INITIALISED(cpu) || mode >= EXEC_MAX ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+
+    cpu->exec_mode = mode;
+
+    return ARMV2STATUS_OK;
+}
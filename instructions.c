@@ -3,9 +3,6 @@
 #include <stdarg.h>
 #include <stdbool.h>
 
-#define ALU_TYPE_IMM   0x02000000
-#define MUL_TYPE_MLA   0x00200000
-#define ALU_SETS_FLAGS 0x00100000
 #define ALU_OPCODE_AND 0x0
 #define ALU_OPCODE_EOR 0x1
 #define ALU_OPCODE_SUB 0x2
@@ -65,13 +62,20 @@ uint32_t operand_shift(struct armv2 *cpu, uint32_t bits, uint32_t type_flag, uin
         //shift amount is in the instruction
         shift_amount = (bits >> 7) & 0x1f;
     }
+    if( rm == PC ) {
+        //Reading r15 gets the flags too
+        MATERIALISE_FLAGS(cpu);
+    }
     op2 = GETREG(cpu, rm);
 
     switch( shift_type ) {
     case ALU_SHIFT_LSL:
         if( shift_amount == 0 ) {
-            // This is a special case from the spec and we have to preserve the old carry
-            shift_c = GETPSR(cpu) & FLAG_C;
+            // This is a special case from the spec and we have to preserve the old carry. Nobody's going to
+            // look at it unless they asked for it, and it might mean working out the flags
+            if( carry ) {
+                shift_c = GETPSR(cpu) & FLAG_C;
+            }
         }
         else if( shift_amount < 32 ) {
             shift_c = (op2 >> (32 - shift_amount)) & 1;
@@ -140,7 +144,7 @@ uint32_t operand_shift(struct armv2 *cpu, uint32_t bits, uint32_t type_flag, uin
             if( type_flag == 0 ) {
                 //this means something weird. RRX
                 shift_c = op2 & 1;
-                op2 = (op2 >> 1) | (((cpu->regs.actual[PC] >> 29) & 1) << 31);
+                op2 = (op2 >> 1) | (((GETPSR(cpu) >> 29) & 1) << 31);
             }
         }
         else if (shift_amount < 32){
@@ -212,6 +216,8 @@ static enum armv2_status perform_store(struct page_info *page, uint32_t addr, ui
     }
     else if( NULL != page->memory ) {
         page->memory[INPAGE(addr) >> 2] = value;
+        INVALIDATE_DECODED(page, addr);
+        MARK_DIRTY(page, addr);
     }
     else {
         //No callback and no memory page is an error
@@ -221,32 +227,83 @@ static enum armv2_status perform_store(struct page_info *page, uint32_t addr, ui
     return ARMV2STATUS_OK;
 }
 
-enum armv2_exception alu_instruction(struct armv2 *cpu, uint32_t instruction)
+void materialise_flags(struct armv2 *cpu)
+{
+    uint32_t result = cpu->lazy.result;
+    uint32_t flags  = (result & FLAG_N) | (result == 0 ? FLAG_Z : 0);
+
+    switch( cpu->lazy.op ) {
+    case LAZY_ARITHMETIC: {
+        uint32_t op1      = cpu->lazy.op1;
+        uint32_t op2      = cpu->lazy.op2;
+        uint64_t result64 = ((uint64_t)op1) + op2 + cpu->lazy.carry_in;
+        /*      ADDITION SIGN BITS */
+        /*    num1sign num2sign sumsign */
+        /*   --------------------------- */
+        /*        0 0 0 */
+        /* *OVER* 0 0 1 (adding two positives should be positive) */
+        /*        0 1 0 */
+        /*        0 1 1 */
+        /*        1 0 0 */
+        /*        1 0 1 */
+        /* *OVER* 1 1 0 (adding two negatives should be negative) */
+        /*        1 1 1 */
+        if( result64 >> 32 ) {
+            flags |= FLAG_C;
+        }
+        if( (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000 ) {
+            flags |= FLAG_V;
+        }
+        cpu->regs.actual[PC] = (cpu->regs.actual[PC] & 0x0fffffff) | flags;
+        break;
+    }
+    case LAZY_LOGICAL:
+        cpu->regs.actual[PC] = (cpu->regs.actual[PC] & 0x3fffffff) | flags;
+        break;
+    default:
+        return;
+    }
+    cpu->lazy.op = LAZY_NONE;
+}
+
+enum armv2_exception alu_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
-    uint32_t opcode   = (instruction>>21)&0xf;
-    uint32_t rn       = (instruction>>16)&0xf;
-    uint32_t rd       = (instruction>>12)&0xf;
+    uint32_t instruction = op->instruction;
+    uint32_t opcode   = op->opcode;
+    uint32_t rn       = op->rn;
+    uint32_t rd       = op->rd;
     uint32_t result   = 0;
     uint32_t source_val;
-    uint32_t shift_c = (cpu->regs.actual[PC]&FLAG_C);
-    uint32_t arith_v = cpu->regs.actual[PC]&FLAG_V;
-    uint64_t result64;
+    uint32_t shift_c  = 0;
+    uint32_t op1      = 0;
+    uint32_t op2      = 0;
+    uint32_t carry    = 0;
+    uint32_t arithmetic = 1;
+    //Only the logical instructions that set the flags care about the shifter's carry
+    uint32_t *shift_c_out = NULL;
 
-    if( instruction & ALU_TYPE_IMM ) {
-        uint32_t right_rotate = (instruction >> 7) & 0x1e;
-        if( right_rotate != 0 ) {
-            source_val = ((instruction & 0xff) << (32 - right_rotate)) | ((instruction & 0xff) >> right_rotate);
+    switch(opcode) {
+    case ALU_OPCODE_SUB: case ALU_OPCODE_RSB: case ALU_OPCODE_ADD: case ALU_OPCODE_ADC:
+    case ALU_OPCODE_SBC: case ALU_OPCODE_RSC: case ALU_OPCODE_CMP: case ALU_OPCODE_CMN:
+        break;
+    default:
+        arithmetic = 0;
+        if( (instruction & ALU_SETS_FLAGS) && rd != PC ) {
+            shift_c_out = &shift_c;
         }
-        else {
-            source_val = instruction & 0xff;
+        break;
+    }
+
+    if( instruction & ALU_TYPE_IMM ) {
+        //The decoder has already done the rotation, and the carry is left alone
+        source_val = op->imm;
+        if( shift_c_out ) {
+            shift_c = GETPSR(cpu) & FLAG_C;
         }
     }
     else {
-        source_val = operand_shift(cpu, instruction & 0xfff, instruction & 0x10, &shift_c);
+        source_val = operand_shift(cpu, instruction & 0xfff, instruction & 0x10, shift_c_out);
     }
-    uint32_t op2;
-    uint32_t op1;
-    uint32_t carry = (cpu->regs.actual[PC] >> 29) & 1;
     uint32_t rn_val = rn == PC ? GETPC(cpu) : GETREG(cpu,rn);
 
     switch(opcode) {
@@ -262,70 +319,39 @@ enum armv2_exception alu_instruction(struct armv2 *cpu, uint32_t instruction)
 
     case ALU_OPCODE_SUB:
     case ALU_OPCODE_CMP:
-        op2 = ~source_val;
         op1 = rn_val;
-        result64 = ((uint64_t)op1) + op2 + 1;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        /*      ADDITION SIGN BITS */
-        /*    num1sign num2sign sumsign */
-        /*   --------------------------- */
-        /*        0 0 0 */
-        /* *OVER* 0 0 1 (adding two positives should be positive) */
-        /*        0 1 0 */
-        /*        0 1 1 */
-        /*        1 0 0 */
-        /*        1 0 1 */
-        /* *OVER* 1 1 0 (adding two negatives should be negative) */
-        /*        1 1 1 */
-
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
-
+        op2 = ~source_val;
+        carry = 1;
         break;
+
     case ALU_OPCODE_RSB:
         op1 = source_val;
         op2 = ~rn_val;
-        result64 = ((uint64_t)op1) + op2 + 1;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
+        carry = 1;
         break;
 
     case ALU_OPCODE_ADD:
     case ALU_OPCODE_CMN:
-        op2 = source_val;
         op1 = rn_val;
-        result64 = ((uint64_t)op1) + op2;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
+        op2 = source_val;
         break;
 
     case ALU_OPCODE_ADC:
         op1 = rn_val;
         op2 = source_val;
-        result64 = ((uint64_t)op1) + op2 + carry;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
+        carry = (GETPSR(cpu) >> 29) & 1;
         break;
 
     case ALU_OPCODE_SBC:
         op1 = rn_val;
         op2 = ~source_val;
-        result64 = ((uint64_t)op1) + op2 + carry;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
+        carry = (GETPSR(cpu) >> 29) & 1;
         break;
 
     case ALU_OPCODE_RSC:
         op1 = ~rn_val;
         op2 = source_val;
-        result64 = ((uint64_t)op2) + op1 + carry;
-        result = result64 & 0xffffffff;
-        shift_c = result64 >> 32;
-        arith_v = (op1 ^ op2 ^ 0x80000000) & (op1 ^ result) & 0x80000000;
+        carry = (GETPSR(cpu) >> 29) & 1;
         break;
 
     case ALU_OPCODE_ORR:
@@ -344,9 +370,15 @@ enum armv2_exception alu_instruction(struct armv2 *cpu, uint32_t instruction)
         result = ~source_val;
         break;
     }
+    if( arithmetic ) {
+        result = op1 + op2 + carry;
+    }
+
     if( rd == PC ) {
         if( instruction & ALU_SETS_FLAGS ) {
-            //this means we update the whole register, except for prohibited flags in user mode
+            //this means we update the whole register, except for prohibited flags in user mode. Either way
+            //the flags come from the result so anything pending is forgotten
+            cpu->lazy.op = LAZY_NONE;
             if( GETMODE(cpu) == MODE_USR ) {
                 cpu->regs.actual[PC] = (cpu->regs.actual[PC] & PC_PROTECTED_BITS)
                     | (result & PC_UNPROTECTED_BITS);
@@ -363,11 +395,20 @@ enum armv2_exception alu_instruction(struct armv2 *cpu, uint32_t instruction)
     }
     else {
         if( instruction&ALU_SETS_FLAGS ) {
-            uint32_t n = (result & FLAG_N);
-            uint32_t z = result == 0 ? FLAG_Z : 0;
-            uint32_t c = shift_c ? FLAG_C : 0;
-            uint32_t v = arith_v ? FLAG_V : 0;
-            cpu->regs.actual[PC] = (cpu->regs.actual[PC] & 0x0fffffff) | n | z | c | v;
+            //We don't work the flags out now, just remember enough to do so when someone looks at them
+            if( arithmetic ) {
+                cpu->lazy.op       = LAZY_ARITHMETIC;
+                cpu->lazy.op1      = op1;
+                cpu->lazy.op2      = op2;
+                cpu->lazy.carry_in = carry;
+            }
+            else {
+                //C and V live in the PSR, so get anything older out of the way first
+                MATERIALISE_FLAGS(cpu);
+                cpu->regs.actual[PC] = (cpu->regs.actual[PC] & ~FLAG_C) | (shift_c ? FLAG_C : 0);
+                cpu->lazy.op = LAZY_LOGICAL;
+            }
+            cpu->lazy.result = result;
         }
         if( (opcode & 0xc) != 0x8 ) {
             GETREG(cpu,rd) = result;
@@ -377,14 +418,16 @@ enum armv2_exception alu_instruction(struct armv2 *cpu, uint32_t instruction)
     return EXCEPT_NONE;
 }
 
-enum armv2_exception multiply_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception multiply_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
     //mul rd,rm,rs means rd = (rm * rs) & 0xffffffff
     //mla rd,rm,rs,rn means rd = (rm * rs + rn) & 0xffffffff
-    uint32_t rm = instruction & 0xf;
-    uint32_t rn = (instruction >> 12) & 0xf;
-    uint32_t rs = (instruction >>  8) & 0xf;
-    uint32_t rd = (instruction >> 16) & 0xf;
+    //Note that multiplies have rd and rn the other way round from the data processing instructions
+    uint32_t instruction = op->instruction;
+    uint32_t rm = op->rm;
+    uint32_t rn = op->rd;
+    uint32_t rs = op->rs;
+    uint32_t rd = op->rn;
     uint32_t result;
 
     if( instruction & MUL_TYPE_MLA ) {
@@ -419,23 +462,16 @@ enum armv2_exception multiply_instruction(struct armv2 *cpu, uint32_t instructio
         GETREG(cpu,rd) = (rm * rs + rn) & 0xffffffff;
     }
     if( instruction&ALU_SETS_FLAGS ) {
-        //apparently we set C to a meaningless value! I'll just leave it
-        uint32_t n = (result & FLAG_N);
-        uint32_t z = result == 0 ? FLAG_Z : 0;
-        cpu->regs.actual[PC] = (cpu->regs.actual[PC] & 0x3fffffff) | n | z;
+        //apparently we set C to a meaningless value! I'll just leave it, so only N and Z come from here
+        MATERIALISE_FLAGS(cpu);
+        cpu->lazy.op     = LAZY_LOGICAL;
+        cpu->lazy.result = result;
     }
 
     return EXCEPT_NONE;
 }
 
-#define SDT_REGISTER   ALU_TYPE_IMM
-#define SDT_PREINDEX   0x01000000
-#define SDT_OFFSET_ADD 0x00800000
-#define SDT_LOAD_BYTE  0x00400000
-#define SDT_WRITE_BACK 0x00200000
-#define SDT_LDR        0x00100000
-
-enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
     //LDR/STR{B}{T} rd,address
     //address is one of:
@@ -447,14 +483,15 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
     //[rn],Rm
     //[rn],rm <shift> count
     //First get the value of operand 2
+    uint32_t instruction = op->instruction;
     uint32_t op2;
-    uint32_t rd = (instruction >> 12) & 0xf;
-    uint32_t rn = (instruction >> 16) & 0xf;
+    uint32_t rd = op->rd;
+    uint32_t rn = op->rn;
     uint32_t rn_val;
     struct page_info *page;
 
     if( !(instruction & SDT_REGISTER) ) {
-        op2 = instruction & 0xfff;
+        op2 = op->imm;
     }
     else {
         op2 = operand_shift(cpu, instruction & 0xfff, 0, NULL);
@@ -481,13 +518,20 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
         //The address bus is 26 bits so this is a address exception
         return EXCEPT_ADDRESS;
     }
-    page = cpu->page_tables[PAGEOF(rn_val)];
-    if( NULL == page ) {
-        //This is a data abort. Could also check for permission here
-        if( ARMV2STATUS_OK != fault(cpu, rn_val) ) {
-            return EXCEPT_DATA_ABORT;
-        }
+    if( (instruction & SDT_LDR) ? RAM_READABLE(cpu, rn_val) : RAM_WRITABLE(cpu, rn_val) ) {
+        //Plain RAM that we can use directly, so we don't need the page. That also means no permission checks
+        //and nothing decoded to invalidate
+        page = NULL;
+    }
+    else {
         page = cpu->page_tables[PAGEOF(rn_val)];
+        if( NULL == page ) {
+            //This is a data abort. Could also check for permission here
+            if( ARMV2STATUS_OK != fault(cpu, rn_val) ) {
+                return EXCEPT_DATA_ABORT;
+            }
+            page = cpu->page_tables[PAGEOF(rn_val)];
+        }
     }
 
     //do the load/store
@@ -498,12 +542,20 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
         if( rn_val & 0x3 && !(instruction & SDT_LOAD_BYTE) ) {
             return EXCEPT_DATA_ABORT;
         }
-        if( GETMODE(cpu) == MODE_USR && !(page->flags & PERM_READ) ) {
-            return EXCEPT_DATA_ABORT;
+        if( NULL == page ) {
+            value = cpu->physical_ram[rn_val >> 2];
+            if( instruction & SDT_LOAD_BYTE ) {
+                value = (value >> ((rn_val & 3) << 3)) & 0xff;
+            }
         }
+        else {
+            if( GETMODE(cpu) == MODE_USR && !(page->flags & PERM_READ) ) {
+                return EXCEPT_DATA_ABORT;
+            }
 
-        if( ARMV2STATUS_OK != perform_load(page, rn_val, &value, instruction & SDT_LOAD_BYTE) ) {
-            return EXCEPT_DATA_ABORT;
+            if( ARMV2STATUS_OK != perform_load(page, rn_val, &value, instruction & SDT_LOAD_BYTE) ) {
+                return EXCEPT_DATA_ABORT;
+            }
         }
         if( HAS_READ_WATCHPOINT(cpu, rn_val) ) {
             SETCPUFLAG(cpu, WATCHPOINT);
@@ -521,7 +573,7 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
     else {
         //STR
         uint32_t value;
-        if( GETMODE(cpu) == MODE_USR && !(page->flags & PERM_WRITE) ) {
+        if( NULL != page && GETMODE(cpu) == MODE_USR && !(page->flags & PERM_WRITE) ) {
             return EXCEPT_DATA_ABORT;
         }
         if( rd == PC ) {
@@ -531,7 +583,20 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
             value = GETREG(cpu, rd);
         }
 
-        if( instruction & SDT_LOAD_BYTE ) {
+        if( NULL == page ) {
+            uint32_t *word = &cpu->physical_ram[rn_val >> 2];
+            if( instruction & SDT_LOAD_BYTE ) {
+                uint32_t shift = (rn_val & 3) << 3;
+                *word = (*word & ~(0xff << shift)) | ((value & 0xff) << shift);
+            }
+            else if( rn_val & 0x3 ) {
+                return EXCEPT_DATA_ABORT;
+            }
+            else {
+                *word = value;
+            }
+        }
+        else if( instruction & SDT_LOAD_BYTE ) {
             uint32_t byte_mask = 0xff << ((rn_val & 3) << 3);
             uint32_t rest_mask = ~byte_mask;
             uint32_t store_val;
@@ -588,26 +653,55 @@ enum armv2_exception single_data_transfer_instruction(struct armv2 *cpu, uint32_
 
     return EXCEPT_NONE;
 }
-enum armv2_exception branch_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception branch_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
-    if( (instruction >> 24 & 1) ) {
+    if( (op->instruction >> 24 & 1) ) {
         GETREG(cpu, LR) = ((cpu->pc + 4) & 0x03fffffc) | GETMODEPSR(cpu);
     }
-    cpu->pc = (cpu->pc + 8 + ((instruction & 0xffffff) << 2) - 4) & 0x3ffffff;
+    cpu->pc = (cpu->pc + 8 + op->imm - 4) & 0x3ffffff;
     //+8 due to the weird prefetch thing, -4 for the hack as we're going to add 4 in the next loop
 
     return EXCEPT_NONE;
 }
 
-#define MDT_LDM        SDT_LDR
-#define MDT_WRITE_BACK SDT_WRITE_BACK
-#define MDT_HAT        SDT_LOAD_BYTE
-#define MDT_OFFSET_ADD SDT_OFFSET_ADD
-#define MDT_PREINDEX   SDT_PREINDEX
+//Does the bitmask have any of the words starting at addr set? There are never more than 16 words, so they're
+//in at most two of the uint64s
+static inline bool watchpoint_in_range(const uint64_t *bitmask, uint32_t addr, uint32_t words)
+{
+    uint32_t first = addr >> 2;
+    uint64_t bits = bitmask[first >> 6] >> (first & 0x3f);
 
-enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, uint32_t instruction)
+    if( (first & 0x3f) + words > 64 ) {
+        bits |= bitmask[(first >> 6) + 1] << (64 - (first & 0x3f));
+    }
+    return (bits & ((UINT64_C(1) << words) - 1)) != 0;
+}
+
+static inline void ldm_to_pc(struct armv2 *cpu, uint32_t value, bool setflags)
 {
-    uint32_t rn         = (instruction>>16) & 0xf;
+    if( setflags ) {
+        //this means we update the whole register, except for prohibited flags in user mode
+        cpu->lazy.op = LAZY_NONE;
+        if( GETMODE(cpu) == MODE_USR ) {
+            // This is currently unreachable, setflags needs to be set in this case
+            cpu->regs.actual[PC] = (cpu->regs.actual[PC] & PC_PROTECTED_BITS)
+                | (value & PC_UNPROTECTED_BITS);
+        }
+        else {
+            cpu->regs.actual[PC] = value;
+        }
+    }
+    else {
+        // In this case we want to strip the flags and mode
+        SETPC(cpu, value);
+    }
+    cpu->pc = GETPC(cpu) - 4;
+}
+
+enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
+{
+    uint32_t instruction = op->instruction;
+    uint32_t rn         = op->rn;
     uint32_t ldm        = instruction & MDT_LDM;
     uint32_t write_back = instruction & MDT_WRITE_BACK;
     bool pc_in_transfer_list = (instruction >> PC) & 1;
@@ -616,7 +710,7 @@ enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, uint32_t
     uint32_t preindex   = instruction & MDT_PREINDEX;
     bool user_bank  = false;
     uint32_t address = 0;
-    uint32_t num_registers = __builtin_popcount(instruction & 0xffff);
+    uint32_t num_registers = op->imm;
     int rs = 0;
     enum armv2_exception retval = EXCEPT_NONE;
     uint32_t write_back_old = 0;
@@ -685,6 +779,49 @@ enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, uint32_t
     if( retval != EXCEPT_NONE ) {
         return retval;
     }
+
+    if( 0 == (address & 0x3) && PAGEOF(address) == PAGEOF(address + (num_registers * 4) - 4) &&
+        (ldm ?
+         RAM_READABLE(cpu, address) &&
+         !(WATCHPOINTS_SET(cpu, READ) && watchpoint_in_range(cpu->watchpoint_bitmask[READ_WATCHPOINT],
+                                                             address, num_registers)) :
+         RAM_WRITABLE(cpu, address) &&
+         !(WATCHPOINTS_SET(cpu, WRITE) && watchpoint_in_range(cpu->watchpoint_bitmask[WRITE_WATCHPOINT],
+                                                              address, num_registers))) ) {
+        //The whole transfer is in one page of plain RAM and nobody's watching it, so none of the checks below
+        //can fail and we can copy straight between memory and the registers
+        uint32_t *memory = cpu->physical_ram + (address >> 2);
+        uint32_t list = instruction & 0xffff;
+
+        first_reg = list ? __builtin_ctz(list) : INVALID_REG;
+        while( list ) {
+            rs = __builtin_ctz(list);
+            list &= list - 1;
+            if( ldm ) {
+                if( rs == PC ) {
+                    ldm_to_pc(cpu, *memory, setflags);
+                }
+                else if( user_bank ) {
+                    GETUSERREG(cpu, rs) = *memory;
+                }
+                else {
+                    GETREG(cpu, rs) = *memory;
+                }
+            }
+            else if( rs == PC ) {
+                *memory = ((cpu->pc + 4) & 0x03fffffc) | GETMODEPSR(cpu);
+            }
+            else if( write_back && (rs == first_reg) && rs == rn ) {
+                *memory = write_back_old;
+            }
+            else {
+                *memory = user_bank ? GETUSERREG(cpu, rs) : GETREG(cpu, rs);
+            }
+            memory++;
+        }
+        return EXCEPT_NONE;
+    }
+
     //shitty hack, cancel the increment we're about to do
     address -= 4;
     for(rs = 0; rs < 16; rs++) {
@@ -725,22 +862,7 @@ enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, uint32_t
             }
 
             if( rs == PC ) {
-                if( setflags ) {
-                    //this means we update the whole register, except for prohibited flags in user mode
-                    if( GETMODE(cpu) == MODE_USR ) {
-                        // This is currently unreachable, setflags needs to be set in this case
-                        cpu->regs.actual[PC] = (cpu->regs.actual[PC] & PC_PROTECTED_BITS)
-                            | (value & PC_UNPROTECTED_BITS);
-                    }
-                    else {
-                        cpu->regs.actual[PC] = value;
-                    }
-                }
-                else {
-                    // In this case we want to strip the flags and mode
-                    SETPC(cpu, value);
-                }
-                cpu->pc = GETPC(cpu) - 4;
+                ldm_to_pc(cpu, value, setflags);
             }
             else {
                 if( user_bank ) {
@@ -783,12 +905,12 @@ enum armv2_exception multi_data_transfer_instruction(struct armv2 *cpu, uint32_t
 }
 
 
-enum armv2_exception swap_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception swap_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
-    uint32_t rm   = instruction & 0xf;
-    uint32_t rd   = (instruction >> 12) & 0xf;
-    uint32_t rn   = (instruction >> 16) & 0xf;
-    uint32_t byte = instruction & SDT_LOAD_BYTE;
+    uint32_t rm   = op->rm;
+    uint32_t rd   = op->rd;
+    uint32_t rn   = op->rn;
+    uint32_t byte = op->instruction & SDT_LOAD_BYTE;
     uint32_t store_value = 0;
     uint32_t load_value = 0;
     struct page_info *page;
@@ -862,20 +984,21 @@ enum armv2_exception swap_instruction(struct armv2 *cpu, uint32_t instruction)
     return EXCEPT_NONE;
 }
 
-enum armv2_exception software_interrupt_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception software_interrupt_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
-    uint32_t type = instruction & 0x00ffffff;
+    uint32_t type = op->instruction & 0x00ffffff;
     return type == SWI_BREAKPOINT ? EXCEPT_BREAKPOINT : EXCEPT_SOFTWARE_INTERRUPT;
 }
 
 //Not bothering transfers yet
-enum armv2_exception coprocessor_data_transfer_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception coprocessor_data_transfer_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
     return EXCEPT_NONE;
 }
 
-enum armv2_exception coprocessor_register_transfer_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception coprocessor_register_transfer_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
+    uint32_t instruction = op->instruction;
     uint32_t crm      = (instruction >>  0) & 0xf;
     uint32_t aux      = (instruction >>  5) & 0x7;
     uint32_t proc_num = (instruction >>  8) & 0xf;
@@ -884,6 +1007,9 @@ enum armv2_exception coprocessor_register_transfer_instruction(struct armv2 *cpu
     uint32_t opcode   = (instruction >> 20) & 0xf;
     coprocessor_data_operation_t handler = NULL;
 
+    //The coprocessors can read r15, flags and all
+    MATERIALISE_FLAGS(cpu);
+
     switch(proc_num) {
     case COPROCESSOR_HW_MANAGER:
         handler = hw_manager_register_transfer;
@@ -905,8 +1031,9 @@ enum armv2_exception coprocessor_register_transfer_instruction(struct armv2 *cpu
     }
     return EXCEPT_NONE;
 }
-enum armv2_exception coprocessor_data_operation_instruction(struct armv2 *cpu, uint32_t instruction)
+enum armv2_exception coprocessor_data_operation_instruction(struct armv2 *cpu, const struct decoded_instruction *op)
 {
+    uint32_t instruction = op->instruction;
     uint32_t crm      = (instruction >>  0) & 0xf;
     uint32_t aux      = (instruction >>  5) & 0x7;
     uint32_t proc_num = (instruction >>  8) & 0xf;
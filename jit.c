@@ -0,0 +1,330 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+#include <sys/mman.h>
+#include "armv2.h"
+
+// A template code generator for x86-64. Each ARM instruction we know how to do is turned into a fixed
+// sequence of x86 instructions that works directly on the cpu structure, which the generated function is
+// passed in rdi. We only handle the data processing instructions that can't fault, can't touch memory and
+// don't read or write the PC, so the generated code never has to give control back part way through. Only
+// the leading run of those in a block is compiled, and the run loop does the rest of the block as normal.
+//
+// Registers are always read and written through regs.effective[] as the same block can run in different
+// modes. Within the generated code eax holds the result, ecx the second operand, and flags are collected
+// in r8-r11 and cl before anything can clobber them.
+
+#if defined(__x86_64__)
+
+#define EFFECTIVE_OFFSET(reg) ((int32_t)(offsetof(struct armv2, regs.effective) + (reg) * sizeof(uint32_t *)))
+#define PSR_OFFSET            ((int32_t)(offsetof(struct armv2, regs.actual) + PC * sizeof(uint32_t)))
+
+//The most any one instruction needs, with plenty to spare
+#define MAX_OP_CODE_SIZE (128)
+
+struct emitter {
+    uint8_t  *pos;
+    uint8_t  *end;
+};
+
+static void emit(struct emitter *e, const uint8_t *bytes, size_t len)
+{
+    if( e->pos + len <= e->end ) {
+        memcpy(e->pos, bytes, len);
+    }
+    e->pos += len;
+}
+
+#define EMIT(e, ...) do {                                   \
+        static const uint8_t bytes[] = { __VA_ARGS__ };     \
+        emit((e), bytes, sizeof(bytes));                    \
+    } while(0)
+
+static void emit_u32(struct emitter *e, uint32_t value)
+{
+    uint8_t bytes[4] = { value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0xff, value >> 24 };
+    emit(e, bytes, sizeof(bytes));
+}
+
+static void emit_u8(struct emitter *e, uint8_t value)
+{
+    emit(e, &value, 1);
+}
+
+//mov eax, *cpu->regs.effective[reg]
+static void load_eax(struct emitter *e, uint32_t reg)
+{
+    EMIT(e, 0x48, 0x8b, 0x87);  //mov rax, [rdi + disp32]
+    emit_u32(e, EFFECTIVE_OFFSET(reg));
+    EMIT(e, 0x8b, 0x00);        //mov eax, [rax]
+}
+
+//mov ecx, *cpu->regs.effective[reg]
+static void load_ecx(struct emitter *e, uint32_t reg)
+{
+    EMIT(e, 0x48, 0x8b, 0x8f);  //mov rcx, [rdi + disp32]
+    emit_u32(e, EFFECTIVE_OFFSET(reg));
+    EMIT(e, 0x8b, 0x09);        //mov ecx, [rcx]
+}
+
+//*cpu->regs.effective[reg] = eax, without touching the flags
+static void store_eax(struct emitter *e, uint32_t reg)
+{
+    EMIT(e, 0x48, 0x8b, 0x97);  //mov rdx, [rdi + disp32]
+    emit_u32(e, EFFECTIVE_OFFSET(reg));
+    EMIT(e, 0x89, 0x02);        //mov [rdx], eax
+}
+
+//Can we compile this one? If not the block's compiled part stops before it
+static int compilable(const struct decoded_instruction *op)
+{
+    uint32_t instruction = op->instruction;
+    uint32_t is_test = (op->opcode & 0xc) == 0x8;
+
+    if( op->handler != alu_instruction || CONDITION_BITS(instruction) != COND_AL ) {
+        return 0;
+    }
+    if( op->rd == PC || op->rn == PC ) {
+        return 0;
+    }
+    switch( op->opcode ) {
+    case 0x5: //ADC
+    case 0x6: //SBC
+    case 0x7: //RSC
+        return 0;
+    default:
+        break;
+    }
+    if( is_test && !(instruction & ALU_SETS_FLAGS) ) {
+        return 0;
+    }
+    if( !(instruction & ALU_TYPE_IMM) ) {
+        uint32_t shift_type   = (instruction >> 5) & 3;
+        uint32_t shift_amount = (instruction >> 7) & 0x1f;
+        //Shifts by a register, and the special meanings of a shift by 0 other than LSL, go to the
+        //interpreter
+        if( (instruction & 0x10) || op->rm == PC ) {
+            return 0;
+        }
+        if( shift_amount == 0 && shift_type != 0 ) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static void compile_op(struct emitter *e, const struct decoded_instruction *op)
+{
+    uint32_t instruction  = op->instruction;
+    uint32_t sets_flags   = instruction & ALU_SETS_FLAGS;
+    uint32_t shift_carry  = 0;
+    uint32_t arithmetic   = 0;
+    uint32_t subtract     = 0;
+
+    //Second operand into ecx
+    if( instruction & ALU_TYPE_IMM ) {
+        //The decoder has already rotated it. Like the interpreter we leave C alone for these
+        EMIT(e, 0xb9);          //mov ecx, imm32
+        emit_u32(e, op->imm);
+    }
+    else {
+        uint32_t shift_type   = (instruction >> 5) & 3;
+        uint32_t shift_amount = (instruction >> 7) & 0x1f;
+        load_ecx(e, op->rm);
+        if( shift_amount != 0 ) {
+            //The x86 shifts leave the last bit shifted out in CF, which is the ARM shifter carry, and for
+            //ror CF is the top bit of the result which is the same thing
+            static const uint8_t shift_modrm[4] = { 0xe1, 0xe9, 0xf9, 0xc9 }; //shl, shr, sar, ror ecx
+            emit_u8(e, 0xc1);
+            emit_u8(e, shift_modrm[shift_type]);
+            emit_u8(e, shift_amount);
+            EMIT(e, 0x41, 0x0f, 0x92, 0xc2);    //setc r10b
+            shift_carry = 1;
+        }
+    }
+
+    //First operand into eax
+    if( op->opcode != 0xd && op->opcode != 0xf ) {
+        load_eax(e, op->rn);
+    }
+
+    switch( op->opcode ) {
+    case 0x0: //AND
+    case 0x8: //TST
+        EMIT(e, 0x21, 0xc8);    //and eax, ecx
+        break;
+    case 0x1: //EOR
+    case 0x9: //TEQ
+        EMIT(e, 0x31, 0xc8);    //xor eax, ecx
+        break;
+    case 0x2: //SUB
+    case 0xa: //CMP
+        EMIT(e, 0x29, 0xc8);    //sub eax, ecx
+        arithmetic = subtract = 1;
+        break;
+    case 0x3: //RSB
+        EMIT(e, 0x29, 0xc1,     //sub ecx, eax
+                0x89, 0xc8);    //mov eax, ecx
+        arithmetic = subtract = 1;
+        break;
+    case 0x4: //ADD
+    case 0xb: //CMN
+        EMIT(e, 0x01, 0xc8);    //add eax, ecx
+        arithmetic = 1;
+        break;
+    case 0xc: //ORR
+        EMIT(e, 0x09, 0xc8);    //or eax, ecx
+        break;
+    case 0xd: //MOV
+        EMIT(e, 0x89, 0xc8);    //mov eax, ecx
+        break;
+    case 0xe: //BIC
+        EMIT(e, 0xf7, 0xd1,     //not ecx
+                0x21, 0xc8);    //and eax, ecx
+        break;
+    case 0xf: //MVN
+        EMIT(e, 0xf7, 0xd1,     //not ecx
+                0x89, 0xc8);    //mov eax, ecx
+        break;
+    }
+
+    if( sets_flags ) {
+        if( !arithmetic ) {
+            EMIT(e, 0x85, 0xc0);                //test eax, eax
+        }
+        EMIT(e, 0x41, 0x0f, 0x98, 0xc0,         //sets r8b
+                0x41, 0x0f, 0x94, 0xc1);        //setz r9b
+        if( arithmetic ) {
+            //ARM's carry for a subtraction is the opposite of x86's borrow
+            if( subtract ) {
+                EMIT(e, 0x0f, 0x93, 0xc1);      //setnc cl
+            }
+            else {
+                EMIT(e, 0x0f, 0x92, 0xc1);      //setc cl
+            }
+            EMIT(e, 0x41, 0x0f, 0x90, 0xc3);    //seto r11b
+        }
+    }
+
+    //Everything that's needed from the x86 flags has been saved now
+    if( (op->opcode & 0xc) != 0x8 ) {
+        store_eax(e, op->rd);
+    }
+
+    if( sets_flags ) {
+        uint32_t keep = 0x3fffffff;
+        EMIT(e, 0x45, 0x0f, 0xb6, 0xc0,         //movzx r8d, r8b
+                0x41, 0xc1, 0xe0, 0x1f,         //shl r8d, 31
+                0x45, 0x0f, 0xb6, 0xc9,         //movzx r9d, r9b
+                0x41, 0xc1, 0xe1, 0x1e,         //shl r9d, 30
+                0x45, 0x09, 0xc8);              //or r8d, r9d
+        if( arithmetic ) {
+            EMIT(e, 0x0f, 0xb6, 0xc9,           //movzx ecx, cl
+                    0xc1, 0xe1, 0x1d,           //shl ecx, 29
+                    0x45, 0x0f, 0xb6, 0xdb,     //movzx r11d, r11b
+                    0x41, 0xc1, 0xe3, 0x1c,     //shl r11d, 28
+                    0x41, 0x09, 0xc8,           //or r8d, ecx
+                    0x45, 0x09, 0xd8);          //or r8d, r11d
+            keep = 0x0fffffff;
+        }
+        else if( shift_carry ) {
+            EMIT(e, 0x45, 0x0f, 0xb6, 0xd2,     //movzx r10d, r10b
+                    0x41, 0xc1, 0xe2, 0x1d,     //shl r10d, 29
+                    0x45, 0x09, 0xd0);          //or r8d, r10d
+            keep = 0x1fffffff;
+        }
+        EMIT(e, 0x8b, 0x97);                    //mov edx, [rdi + disp32]
+        emit_u32(e, PSR_OFFSET);
+        EMIT(e, 0x81, 0xe2);                    //and edx, imm32
+        emit_u32(e, keep);
+        EMIT(e, 0x44, 0x09, 0xc2,               //or edx, r8d
+              0x89, 0x97);                      //mov [rdi + disp32], edx
+        emit_u32(e, PSR_OFFSET);
+    }
+}
+
+static int jit_init(struct armv2 *cpu)
+{
+    if( NULL != cpu->jit.code ) {
+        return 1;
+    }
+    cpu->jit.code = mmap(NULL, JIT_BUFFER_SIZE, PROT_READ | PROT_EXEC, MAP_ANONYMOUS | MAP_PRIVATE, -1, 0);
+    if( MAP_FAILED == cpu->jit.code ) {
+        LOG("Error mmaping jit buffer\n");
+        cpu->jit.code = NULL;
+        return 0;
+    }
+    cpu->jit.used = 0;
+    cpu->jit.full = 0;
+    return 1;
+}
+
+void jit_compile(struct armv2 *cpu, struct block *block)
+{
+    uint8_t code[MAX_BLOCK_LENGTH * MAX_OP_CODE_SIZE + 1];
+    struct emitter e = {.pos = code, .end = code + sizeof(code)};
+    uint32_t length = 0;
+    size_t size;
+
+    while( length < block->length && compilable(block->ops + length) ) {
+        compile_op(&e, block->ops + length);
+        length++;
+    }
+    if( 0 == length ) {
+        return;
+    }
+    EMIT(&e, 0xc3); //ret
+    if( e.pos > e.end ) {
+        return;
+    }
+    size = e.pos - code;
+
+    if( !jit_init(cpu) ) {
+        return;
+    }
+    if( cpu->jit.used + size > JIT_BUFFER_SIZE ) {
+        //The run loop will throw everything away and start again when it next can
+        cpu->jit.full = 1;
+        return;
+    }
+
+    //Never writable and executable at the same time
+    if( 0 != mprotect(cpu->jit.code, JIT_BUFFER_SIZE, PROT_READ | PROT_WRITE) ) {
+        return;
+    }
+    memcpy(cpu->jit.code + cpu->jit.used, code, size);
+    if( 0 != mprotect(cpu->jit.code, JIT_BUFFER_SIZE, PROT_READ | PROT_EXEC) ) {
+        LOG("Error making jit buffer executable\n");
+        return;
+    }
+
+    block->jit        = (jit_function_t)(cpu->jit.code + cpu->jit.used);
+    block->jit_length = length;
+    //Keep each function 16 byte aligned
+    cpu->jit.used = (cpu->jit.used + size + 15) & ~15;
+}
+
+void jit_cleanup(struct armv2 *cpu)
+{
+    if( NULL != cpu->jit.code ) {
+        munmap(cpu->jit.code, JIT_BUFFER_SIZE);
+        cpu->jit.code = NULL;
+    }
+    cpu->jit.used = 0;
+    cpu->jit.full = 0;
+}
+
+#else
+
+//No code generator for this architecture, so EXEC_JIT behaves just like EXEC_BLOCKS
+void jit_compile(struct armv2 *cpu, struct block *block)
+{
+}
+
+void jit_cleanup(struct armv2 *cpu)
+{
+}
+
+#endif
@@ -0,0 +1,121 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
+
+#include "armv2.h"
+
+// Running many machines at once, e.g. for regression runs or fuzzing. Rather than a thread per machine we
+// keep a fixed number of workers, and each pool_run gives them a batch of cpus to get through. A worker
+// takes the next job that nobody has started, runs that cpu for its instructions and comes back for
+// another, so a cpu that stops early just frees its thread up for the rest of the batch.
+//
+// The cpus themselves share nothing, so the only locking is around handing out the jobs. Device callbacks
+// are called from whichever worker is running the cpu, so they have to be happy with that.
+
+static void *pool_worker(void *arg)
+{
+    struct armv2_pool *pool = arg;
+    struct pool_job *job;
+
+    pthread_mutex_lock(&pool->lock);
+    while( 1 ) {
+        while( !pool->quit && pool->next_job >= pool->num_jobs ) {
+            pthread_cond_wait(&pool->work, &pool->lock);
+        }
+        if( pool->quit ) {
+            break;
+        }
+        job = pool->jobs + pool->next_job++;
+        pthread_mutex_unlock(&pool->lock);
+
+        job->status = run_armv2(job->cpu, &job->instructions);
+
+        pthread_mutex_lock(&pool->lock);
+        if( 0 == --pool->jobs_left ) {
+            pthread_cond_signal(&pool->done);
+        }
+    }
+    pthread_mutex_unlock(&pool->lock);
+
+    return NULL;
+}
+
+enum armv2_status pool_init(struct armv2_pool *pool, uint32_t num_threads)
+{
+    if( NULL == pool || 0 == num_threads ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+
+    memset(pool, 0, sizeof(struct armv2_pool));
+    pool->threads = calloc(num_threads, sizeof(pthread_t));
+    if( NULL == pool->threads ) {
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+    pthread_mutex_init(&pool->lock, NULL);
+    pthread_cond_init(&pool->work, NULL);
+    pthread_cond_init(&pool->done, NULL);
+
+    for( uint32_t i = 0; i < num_threads; i++ ) {
+        if( 0 != pthread_create(pool->threads + i, NULL, pool_worker, pool) ) {
+            LOG("Error starting pool thread %u\n", i);
+            pool_cleanup(pool);
+            return ARMV2STATUS_MEMORY_ERROR;
+        }
+        pool->num_threads++;
+    }
+
+    return ARMV2STATUS_OK;
+}
+
+// Run every job and wait for them all to finish. The same cpu mustn't appear in more than one job
+enum armv2_status pool_run(struct armv2_pool *pool, struct pool_job *jobs, uint32_t num_jobs)
+{
+    if( NULL == pool || NULL == pool->threads || (NULL == jobs && num_jobs) ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( 0 == num_jobs ) {
+        return ARMV2STATUS_OK;
+    }
+
+    pthread_mutex_lock(&pool->lock);
+    pool->jobs      = jobs;
+    pool->num_jobs  = num_jobs;
+    pool->next_job  = 0;
+    pool->jobs_left = num_jobs;
+    pthread_cond_broadcast(&pool->work);
+
+    while( pool->jobs_left ) {
+        pthread_cond_wait(&pool->done, &pool->lock);
+    }
+    pool->jobs     = NULL;
+    pool->num_jobs = 0;
+    pool->next_job = 0;
+    pthread_mutex_unlock(&pool->lock);
+
+    return ARMV2STATUS_OK;
+}
+
+enum armv2_status pool_cleanup(struct armv2_pool *pool)
+{
+    if( NULL == pool || NULL == pool->threads ) {
+        return ARMV2STATUS_OK;
+    }
+
+    pthread_mutex_lock(&pool->lock);
+    pool->quit = 1;
+    pthread_cond_broadcast(&pool->work);
+    pthread_mutex_unlock(&pool->lock);
+
+    for( uint32_t i = 0; i < pool->num_threads; i++ ) {
+        pthread_join(pool->threads[i], NULL);
+    }
+    free(pool->threads);
+    pool->threads     = NULL;
+    pool->num_threads = 0;
+    pthread_cond_destroy(&pool->done);
+    pthread_cond_destroy(&pool->work);
+    pthread_mutex_destroy(&pool->lock);
+
+    return ARMV2STATUS_OK;
+}
@@ -5,7 +5,7 @@ import numpy
 
 setup(
     cmdclass={"build_ext": build_ext},
-    ext_modules=[Extension("armv2", ["armv2.pyx"], extra_objects=["libarmv2.a"])],
+    ext_modules=[Extension("armv2", ["armv2.pyx"], extra_objects=["libarmv2.a"], extra_link_args=["-pthread"])],
 )
 
 setup(
@@ -0,0 +1,257 @@
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/mman.h>
+
+#include "armv2.h"
+
+// Saving everything about a cpu that the guest can change, so it can be put back as many times as we like,
+// e.g. to start lots of test runs from just after boot rather than booting each one.
+//
+// Physical RAM is one mapping of the whole address space, with page n of the guest at page n of the mapping.
+// A snapshot writes the mapped pages of it to a memfd once, at the same offsets, and restoring maps the file
+// back over physical RAM privately. That makes restoring cheap however much RAM there is: the kernel shares
+// the snapshot's pages until the guest writes to one, and only then copies it. The file is shared between
+// every cpu it's restored to, and the snapshot can be thrown away without affecting any of them.
+//
+// The virtual clock is saved too, so a device's idea of the time carries on from the snapshot. The events
+// belong to the devices, so restoring leaves them as far off as they were rather than putting back the
+// snapshot's.
+//
+// Devices keep their own state, so snapshots are only of the cpu. Pages mapped to devices are left as they
+// are by restoring, and the device has to be where it was.
+//
+// The same file also makes clones: new cpus with their own devices that start from the snapshot, like
+// forking a process that has already booted.
+
+// PIN_I is whether there's anything in the interrupt queue, so the queue is saved as well, without the
+// sequences, which only mean anything for the queue they came from
+static void save_interrupts(struct armv2 *cpu, struct armv2_snapshot *snapshot)
+{
+    struct interrupt_queue *queue = &cpu->interrupts;
+
+    for( uint32_t pos = queue->head; snapshot->num_interrupts < INTERRUPT_QUEUE_SIZE; pos++ ) {
+        struct interrupt_entry *entry = queue->entries + (pos & (INTERRUPT_QUEUE_SIZE - 1));
+
+        if( __atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) != pos + 1 ) {
+            break;
+        }
+        snapshot->interrupts[snapshot->num_interrupts].id   = entry->id;
+        snapshot->interrupts[snapshot->num_interrupts].code = entry->code;
+        snapshot->num_interrupts++;
+    }
+}
+
+// Throw away whatever is queued now and put back what the snapshot had, and set PIN_I to match. Anything
+// posted by another thread while this happens might be lost, so devices shouldn't be running then
+static void restore_interrupts(struct armv2 *cpu, const struct armv2_snapshot *snapshot)
+{
+    struct interrupt_queue *queue = &cpu->interrupts;
+    uint32_t pins = snapshot->pins & ~PIN_I;
+
+    for( uint32_t i = 0; i < INTERRUPT_QUEUE_SIZE; i++ ) {
+        queue->entries[i].sequence = i;
+    }
+    for( uint32_t i = 0; i < snapshot->num_interrupts; i++ ) {
+        queue->entries[i].id       = snapshot->interrupts[i].id;
+        queue->entries[i].code     = snapshot->interrupts[i].code;
+        queue->entries[i].sequence = i + 1;
+    }
+    if( snapshot->num_interrupts ) {
+        pins |= PIN_I;
+    }
+    __atomic_store_n(&queue->head, 0, __ATOMIC_RELEASE);
+    __atomic_store_n(&queue->tail, snapshot->num_interrupts, __ATOMIC_RELEASE);
+    __atomic_store_n(&cpu->pins, pins, __ATOMIC_RELEASE);
+}
+
+static int is_physical_page(struct armv2 *cpu, uint32_t page_num)
+{
+    struct page_info *page = cpu->page_tables[page_num];
+
+    return NULL != page && page->memory == cpu->physical_ram + page_num * WORDS_PER_PAGE;
+}
+
+enum armv2_status snapshot_armv2(struct armv2 *cpu, struct armv2_snapshot *snapshot)
+{
+    if( NULL == cpu || NULL == snapshot ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( NULL == cpu->physical_ram ) {
+        //Without the one big mapping there's nothing to map the snapshot back over
+        return ARMV2STATUS_INVALID_CPUSTATE;
+    }
+
+    memset(snapshot, 0, sizeof(struct armv2_snapshot));
+    snapshot->ram_fd = memfd_create("armv2_snapshot", MFD_CLOEXEC);
+    if( snapshot->ram_fd < 0 ) {
+        LOG("Error creating snapshot file\n");
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+    //Only the pages we write take up any room
+    if( 0 != ftruncate(snapshot->ram_fd, MAX_MEMORY) ) {
+        LOG("Error sizing snapshot file\n");
+        snapshot_cleanup(snapshot);
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+
+    for( uint32_t i = 0; i < NUM_PAGE_TABLES; i++ ) {
+        if( !is_physical_page(cpu, i) ) {
+            continue;
+        }
+        if( PAGE_SIZE != pwrite(snapshot->ram_fd, cpu->page_tables[i]->memory, PAGE_SIZE, (off_t)i * PAGE_SIZE) ) {
+            LOG("Error writing page %u to snapshot\n", i);
+            snapshot_cleanup(snapshot);
+            return ARMV2STATUS_IO_ERROR;
+        }
+        snapshot->page_flags[i] = cpu->page_tables[i]->flags;
+        snapshot->num_pages++;
+    }
+
+    MATERIALISE_FLAGS(cpu);
+    memcpy(snapshot->regs, cpu->regs.actual, sizeof(snapshot->regs));
+    snapshot->pc               = cpu->pc;
+    snapshot->flags            = cpu->flags;
+    snapshot->pins             = cpu->pins;
+    snapshot->hardware_manager = cpu->hardware_manager;
+    snapshot->cycles           = cpu->cycles;
+    save_interrupts(cpu, snapshot);
+
+    return ARMV2STATUS_OK;
+}
+
+enum armv2_status restore_armv2(struct armv2 *cpu, const struct armv2_snapshot *snapshot)
+{
+    void *ram;
+    uint32_t free_ram;
+
+    if( NULL == cpu || NULL == snapshot || snapshot->ram_fd < 0 ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( NULL == cpu->physical_ram ) {
+        return ARMV2STATUS_INVALID_CPUSTATE;
+    }
+    //Everything we have now is going, so we'll have its room as well
+    free_ram = cpu->free_ram;
+    for( uint32_t i = 0; i < NUM_PAGE_TABLES; i++ ) {
+        if( is_physical_page(cpu, i) ) {
+            free_ram += PAGE_SIZE;
+        }
+        else if( snapshot->page_flags[i] && NULL != cpu->page_tables[i] ) {
+            //A device has been put where the snapshot has RAM
+            return ARMV2STATUS_ALREADY_MAPPED;
+        }
+    }
+    if( free_ram / PAGE_SIZE < snapshot->num_pages ) {
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+
+    //Throw away all the RAM we have now, along with anything decoded from it
+    for( uint32_t i = 0; i < NUM_PAGE_TABLES; i++ ) {
+        if( is_physical_page(cpu, i) ) {
+            (void)release_page(cpu, i << PAGE_SIZE_BITS);
+        }
+    }
+    ram = mmap(cpu->physical_ram, MAX_MEMORY, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_FIXED | MAP_NORESERVE,
+               snapshot->ram_fd, 0);
+    if( MAP_FAILED == ram ) {
+        LOG("Error mapping snapshot\n");
+        return ARMV2STATUS_MEMORY_ERROR;
+    }
+
+    for( uint32_t i = 0; i < NUM_PAGE_TABLES; i++ ) {
+        enum armv2_status result;
+
+        if( 0 == snapshot->page_flags[i] ) {
+            continue;
+        }
+        result = fault(cpu, i << PAGE_SIZE_BITS);
+        if( ARMV2STATUS_OK != result ) {
+            return result;
+        }
+        cpu->page_tables[i]->flags = snapshot->page_flags[i];
+        if( !(snapshot->page_flags[i] & PERM_WRITE) ) {
+            CLEAR_PAGE_BIT(cpu->ram_writable, i);
+        }
+    }
+
+    memcpy(cpu->regs.actual, snapshot->regs, sizeof(snapshot->regs));
+    cpu->lazy.op           = LAZY_NONE;
+    bank_registers(cpu);
+    cpu->pc                = snapshot->pc;
+    //Whether there are breakpoints is up to the debugger, not the snapshot
+    cpu->flags             = (snapshot->flags & ~FLAG_DEBUG) | (cpu->flags & FLAG_DEBUG);
+    cpu->hardware_manager  = snapshot->hardware_manager;
+    restore_interrupts(cpu, snapshot);
+
+    //Moving every deadline by the same amount keeps them in heap order
+    for( uint32_t i = 0; i < cpu->num_events; i++ ) {
+        cpu->events[i].deadline = cpu->events[i].deadline - cpu->cycles + snapshot->cycles;
+    }
+    cpu->cycles     = snapshot->cycles;
+    cpu->next_event = cpu->num_events ? cpu->events[0].deadline : NO_EVENT;
+
+    return ARMV2STATUS_OK;
+}
+
+// Make clone a copy of cpu as it was when snapshot was taken from it. The clone has to have been through
+// init() and been given its own copies of cpu's devices, added in the same order, and these get mapped
+// where cpu's are. After that it's an ordinary restore, so every clone of a snapshot shares the pages none
+// of them have written to.
+enum armv2_status clone_armv2(struct armv2 *clone, struct armv2 *cpu, const struct armv2_snapshot *snapshot)
+{
+    enum armv2_status result;
+
+    if( NULL == clone || NULL == cpu || clone == cpu || NULL == snapshot ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( NULL == clone->physical_ram ) {
+        return ARMV2STATUS_INVALID_CPUSTATE;
+    }
+    if( clone->num_hardware_devices != cpu->num_hardware_devices ) {
+        return ARMV2STATUS_NO_SUCH_DEVICE;
+    }
+
+    //The restore would throw away the clone's RAM anyway, and doing it first leaves room for the devices
+    for( uint32_t i = 0; i < NUM_PAGE_TABLES; i++ ) {
+        if( is_physical_page(clone, i) ) {
+            (void)release_page(clone, i << PAGE_SIZE_BITS);
+        }
+    }
+
+    //Each device remembers where it was mapped
+    for( uint32_t i = 0; i < cpu->num_hardware_devices; i++ ) {
+        struct hardware_device *device = cpu->hardware_devices[i];
+
+        if( NULL == device || 0 == device->mapped.end ) {
+            continue;
+        }
+        result = map_memory(clone, i, device->mapped.start, device->mapped.end);
+        if( ARMV2STATUS_OK != result ) {
+            return result;
+        }
+    }
+
+    clone->boot_rom      = cpu->boot_rom;
+    clone->jit_threshold = cpu->jit_threshold;
+    result = set_exec_mode(clone, cpu->exec_mode);
+    if( ARMV2STATUS_OK != result ) {
+        return result;
+    }
+
+    return restore_armv2(clone, snapshot);
+}
+
+enum armv2_status snapshot_cleanup(struct armv2_snapshot *snapshot)
+{
+    if( NULL == snapshot ) {
+        return ARMV2STATUS_INVALID_ARGS;
+    }
+    if( snapshot->ram_fd >= 0 ) {
+        close(snapshot->ram_fd);
+        snapshot->ram_fd = -1;
+    }
+    return ARMV2STATUS_OK;
+}
@@ -75,8 +75,23 @@ int load_tape_data( uint8_t *tape_area, bool *final, size_t *written_out ) {
 
     section_length &= (~TAPE_FLAG_FINAL);
 
+    //The tape drive can copy the rest of its block straight in to memory, which is much quicker than asking for
+    //each byte. If it copies nothing (the tape isn't playing, or the drive can't do it) we ask for each byte as
+    //usual
+    bool dma = true;
+
     while(result == READY && section_length != 0) {
         uint8_t byte;
+        if( dma ) {
+            size_t copied = tape_dma( tape_area, section_length );
+            if( copied ) {
+                section_length -= copied;
+                tape_area += copied;
+                written += copied;
+                continue;
+            }
+            dma = false;
+        }
         result = tape_next_byte( &byte );
         if(READY == result) {
             section_length--;
@@ -41,6 +41,13 @@ void set_alarm(int milliseconds) {
     asm("pop {r7}");
 }
 
+size_t tape_dma(void *dest, size_t len) {
+    asm("push {r7}");
+    asm("mov r7,#4");
+    asm("swi #0");
+    asm("pop {r7}");
+}
+
 uint32_t ntohl( uint32_t in ) {
     return __builtin_bswap32( in );
 }
@@ -56,6 +56,7 @@ extern uint32_t                      *framebuffer;
 
 uint64_t wait_for_interrupt();
 void set_alarm(int milliseconds);
+size_t tape_dma(void *dest, size_t len);
 
 void crash_handler(uint32_t type, uint32_t pc, uint32_t sp, uint32_t lr);
 uint32_t ntohl( uint32_t );
@@ -4,280 +4,996 @@
 #include <stdint.h>
 #include <string.h>
 #include <sys/mman.h>
+#include <pthread.h>
 #include "armv2.h"
 
-enum armv2_status run_armv2(struct armv2 *cpu, int32_t *instructions_in_out)
+void decode_instruction(struct decoded_instruction *op, uint32_t instruction)
 {
-    uint32_t running = 1;
-    uint32_t old_mode = 0;
-    int32_t instructions = *instructions_in_out;
+    instruction_handler_t handler = NULL;
 
-    //instructions of -1 means run forever
-    while(running) {
-        old_mode = GETMODE(cpu);
+    op->instruction = instruction;
+    op->opcode      = (instruction >> 21) & 0xf;
+    op->rn          = (instruction >> 16) & 0xf;
+    op->rd          = (instruction >> 12) & 0xf;
+    op->rs          = (instruction >>  8) & 0xf;
+    op->rm          = instruction & 0xf;
+    op->imm         = 0;
 
-        if( instructions == 0 ) {
-            *instructions_in_out = 0;
-            return ARMV2STATUS_OK;
+    switch((instruction >> 26) & 03) {
+    case 0:
+        if((instruction & 0x0fc000f0) == 0x00000090) {
+            handler = multiply_instruction;
         }
-
-        if( WAITING(cpu) && PIN_OFF(cpu, I) && PIN_OFF(cpu, F) ) {
-            *instructions_in_out = instructions;
-            return ARMV2STATUS_WAIT_FOR_INTERRUPT;
+        else if((instruction & 0x0fb00ff0) == 0x01000090) {
+            handler = swap_instruction;
         }
-        if( instructions > 0 ) {
-            instructions--;
+        else {
+            //data processing instruction...
+            handler = alu_instruction;
+            if( instruction & 0x02000000 ) {
+                uint32_t right_rotate = (instruction >> 7) & 0x1e;
+                op->imm = instruction & 0xff;
+                if( right_rotate != 0 ) {
+                    op->imm = (op->imm << (32 - right_rotate)) | (op->imm >> right_rotate);
+                }
+            }
         }
+        break;
+    case 1:
+        //LDR or STR, or undefined
+        handler = single_data_transfer_instruction;
+        op->imm = instruction & 0xfff;
+        break;
+    case 2:
+        //LDM or STM or branch
+        if(instruction & 0x02000000) {
+            handler = branch_instruction;
+            op->imm = (instruction & 0xffffff) << 2;
+        }
+        else {
+            handler = multi_data_transfer_instruction;
+            op->imm = __builtin_popcount(instruction & 0xffff);
+        }
+        break;
+    case 3:
+        //coproc functions or swi
+        if((instruction & 0x0f000000) == 0x0f000000) {
+            handler = software_interrupt_instruction;
+        }
+        else if((instruction & 0x02000000) == 0) {
+            handler = coprocessor_data_transfer_instruction;
+        }
+        else if(instruction & 0x10) {
+            handler = coprocessor_register_transfer_instruction;
+        }
+        else {
+            handler = coprocessor_data_operation_instruction;
+        }
+        break;
+    }
+    op->handler = handler;
+}
 
-        enum armv2_exception exception = EXCEPT_NONE;
-        cpu->pc = (cpu->pc + 4) & 0x3ffffff;
+struct decoded_instruction *decoded_page(struct armv2 *cpu, struct page_info *page, uint32_t addr)
+{
+    if( NULL == page->decoded && NULL != page->memory ) {
+        //calloc gives us NULL handlers, so everything gets decoded on first use
+        page->decoded = calloc(WORDS_PER_PAGE, sizeof(struct decoded_instruction));
+        //From now on stores to the page have to go the long way round so they see the decoded copy
+        CLEAR_PAGE_BIT(cpu->ram_writable, PAGEOF(addr));
+    }
+    return page->decoded;
+}
 
-        //check if PC is valid
-        SETPC(cpu,cpu->pc + 8);
+//Take the interrupt at the front of the queue so INTERRUPT_DATA can say what it was, and leave the pin set
+//if there's another behind it. Anything that posts after we've cleared the pin sets it again itself. The pin
+//can also be set without anything queued, in which case the last interrupt's data stands
+static void take_queued_interrupt(struct armv2 *cpu)
+{
+    struct interrupt_queue *queue = &cpu->interrupts;
+    struct interrupt_entry *entry = queue->entries + (queue->head & (INTERRUPT_QUEUE_SIZE - 1));
 
-        //Before we do anything, we check to see if we need to do an FIQ or an IRQ
-        if( FLAG_CLEAR(cpu,F) ) {
-            if( PIN_ON(cpu,F) ) {
-                //crumbs, time to do an FIQ!
-                cpu->regs.actual[R14_F] = cpu->regs.actual[PC] - 4;
-                SETMODE(cpu, MODE_FIQ);
-                SETFLAG(cpu, F);
-                SETFLAG(cpu, I);
-
-                for(uint32_t i = 8; i < 15; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[R8_F + (i - 8)];
-                }
-                cpu->pc = g_vector_table[EXCEPT_FIQ] - 4;
-                continue;
+    if( __atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) == queue->head + 1 ) {
+        cpu->hardware_manager.last_interrupt_id   = entry->id;
+        cpu->hardware_manager.last_interrupt_code = entry->code;
+        //Free for whoever posts a trip round from now
+        __atomic_store_n(&entry->sequence, queue->head + INTERRUPT_QUEUE_SIZE, __ATOMIC_RELEASE);
+        __atomic_store_n(&queue->head, queue->head + 1, __ATOMIC_RELEASE);
+    }
+
+    __atomic_fetch_and(&cpu->pins, ~PIN_I, __ATOMIC_ACQ_REL);
+    entry = queue->entries + (queue->head & (INTERRUPT_QUEUE_SIZE - 1));
+    if( __atomic_load_n(&entry->sequence, __ATOMIC_ACQUIRE) == queue->head + 1 ) {
+        __atomic_fetch_or(&cpu->pins, PIN_I, __ATOMIC_RELEASE);
+    }
+}
+
+//Called with the pc already moved on to the next instruction. If an FIQ or IRQ is due, set the cpu up to
+//run its handler and return 1
+static inline int take_interrupt(struct armv2 *cpu)
+{
+    if( FLAG_CLEAR(cpu,F) ) {
+        if( PIN_ON(cpu,F) ) {
+            //crumbs, time to do an FIQ!
+            MATERIALISE_FLAGS(cpu);
+            cpu->regs.actual[R14_F] = cpu->regs.actual[PC] - 4;
+            SETMODE(cpu, MODE_FIQ);
+            SETFLAG(cpu, F);
+            SETFLAG(cpu, I);
+
+            for(uint32_t i = 8; i < 15; i++) {
+                cpu->regs.effective[i] = &cpu->regs.actual[R8_F + (i - 8)];
             }
+            cpu->pc = g_vector_table[EXCEPT_FIQ] - 4;
+            return 1;
         }
-        if( FLAG_CLEAR(cpu,I) ) {
-            if( PIN_ON(cpu,I) ) {
-                //crumbs, time to do an IRQ!
-                //set the LR first
-                cpu->regs.actual[R14_I] = cpu->regs.actual[PC] - 4;
-                //set the mode to IRQ mode
-                SETMODE(cpu, MODE_IRQ);
-                //mask interrupts so they won't be taken next time.
-                CLEARPIN(cpu, I);
-                SETFLAG(cpu, I);
-                //in case it's waiting for an interrupt
-                CLEARCPUFLAG(cpu, WAIT);
-                cpu->pc = g_vector_table[EXCEPT_IRQ] - 4;
-
-                for(uint32_t i = 8;i < 13; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[i];
-                }
+    }
+    if( FLAG_CLEAR(cpu,I) ) {
+        if( PIN_ON(cpu,I) ) {
+            //crumbs, time to do an IRQ!
+            MATERIALISE_FLAGS(cpu);
+            //set the LR first
+            cpu->regs.actual[R14_I] = cpu->regs.actual[PC] - 4;
+            //set the mode to IRQ mode
+            SETMODE(cpu, MODE_IRQ);
+            //mask interrupts so they won't be taken next time.
+            take_queued_interrupt(cpu);
+            SETFLAG(cpu, I);
+            //in case it's waiting for an interrupt
+            CLEARCPUFLAG(cpu, WAIT);
+            cpu->pc = g_vector_table[EXCEPT_IRQ] - 4;
 
-                for(uint32_t i = 13;i < 15; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[R13_I + (i - 13)];
-                }
-                continue;
+            for(uint32_t i = 8;i < 13; i++) {
+                cpu->regs.effective[i] = &cpu->regs.actual[i];
             }
-        }
 
-        if(cpu->page_tables[PAGEOF(cpu->pc)] == NULL) {
-            //Trying to execute an unmapped page!
-            //some sort of exception
-            if( ARMV2STATUS_OK != fault(cpu, cpu->pc) ) {
-                exception = EXCEPT_PREFETCH_ABORT;
-                goto handle_exception;
+            for(uint32_t i = 13;i < 15; i++) {
+                cpu->regs.effective[i] = &cpu->regs.actual[R13_I + (i - 13)];
             }
+            return 1;
         }
+    }
+    return 0;
+}
 
-        if( HAS_BREAKPOINT(cpu, cpu->pc) ) {
-            exception = EXCEPT_BREAKPOINT;
-            goto handle_exception;
-        }
+static inline int interrupt_pending(struct armv2 *cpu)
+{
+    return (FLAG_CLEAR(cpu, F) && PIN_ON(cpu, F)) || (FLAG_CLEAR(cpu, I) && PIN_ON(cpu, I));
+}
 
-        uint32_t instruction = DEREF(cpu, cpu->pc);
+static inline int condition_passed(struct armv2 *cpu, uint32_t instruction)
+{
+    //The commonest tests only need N or Z, which we can get from a pending result without working the rest
+    //out
+    if( cpu->lazy.op != LAZY_NONE ) {
         switch(CONDITION_BITS(instruction)) {
-        case COND_EQ: //Z set
-            if(FLAG_SET(cpu, Z)) {
-                break;
-            }
-            continue;
-        case COND_NE: //Z clear
-            if(FLAG_CLEAR(cpu, Z)) {
-                break;
-            }
-            continue;
-        case COND_CS: //C set
-            if(FLAG_SET(cpu, C)) {
-                break;
-            }
-            continue;
-        case COND_CC: //C clear
-            if(FLAG_CLEAR(cpu, C)) {
-                break;
-            }
-            continue;
-        case COND_MI: //N set
-            if(FLAG_SET(cpu, N)) {
-                break;
-            }
-            continue;
-        case COND_PL: //N clear
-            if(FLAG_CLEAR(cpu, N)) {
-                break;
-            }
-            continue;
-        case COND_VS: //V set
-            if(FLAG_SET(cpu, V)) {
-                break;
-            }
-            continue;
-        case COND_VC: //V clear
-            if(FLAG_CLEAR(cpu, V)) {
-                break;
+        case COND_EQ:
+            return cpu->lazy.result == 0;
+        case COND_NE:
+            return cpu->lazy.result != 0;
+        case COND_MI:
+            return cpu->lazy.result >> 31;
+        case COND_PL:
+            return !(cpu->lazy.result >> 31);
+        case COND_AL:
+            return 1;
+        case COND_NV:
+            return 0;
+        default:
+            materialise_flags(cpu);
+            break;
+        }
+    }
+
+    switch(CONDITION_BITS(instruction)) {
+    case COND_EQ: //Z set
+        return FLAG_SET(cpu, Z);
+    case COND_NE: //Z clear
+        return FLAG_CLEAR(cpu, Z);
+    case COND_CS: //C set
+        return FLAG_SET(cpu, C);
+    case COND_CC: //C clear
+        return FLAG_CLEAR(cpu, C);
+    case COND_MI: //N set
+        return FLAG_SET(cpu, N);
+    case COND_PL: //N clear
+        return FLAG_CLEAR(cpu, N);
+    case COND_VS: //V set
+        return FLAG_SET(cpu, V);
+    case COND_VC: //V clear
+        return FLAG_CLEAR(cpu, V);
+    case COND_HI: //C set and Z clear
+        return FLAG_SET(cpu, C) && FLAG_CLEAR(cpu, Z);
+    case COND_LS: //C clear or Z set
+        return FLAG_CLEAR(cpu, C) || FLAG_SET(cpu, Z);
+    case COND_GE: //N set and V set,  or N clear and V clear
+        return (!!FLAG_SET(cpu, N)) == (!!FLAG_SET(cpu, V));
+    case COND_LT: //N set and V clear or N clear and V set
+        return (!!FLAG_SET(cpu, N)) != (!!FLAG_SET(cpu, V));
+    case COND_GT: //Z clear and either N set and V set, or N clear and V clear
+        return FLAG_CLEAR(cpu, Z) && (!!FLAG_SET(cpu, N)) == (!!FLAG_SET(cpu, V));
+    case COND_LE: //Z set or N set and V clear, or N clear and V set
+        return FLAG_SET(cpu, Z) || (!!FLAG_SET(cpu, N)) != (!!FLAG_SET(cpu, V));
+    case COND_AL: //Always
+        return 1;
+    case COND_NV: //Never
+    default:
+        return 0;
+    }
+}
+
+//Point the registers the instructions use at the right bank for the mode the cpu is in
+void bank_registers(struct armv2 *cpu)
+{
+    for(uint32_t i = 8;i < NUM_EFFECTIVE_REGS; i++) {
+        cpu->regs.effective[i] = &cpu->regs.actual[i];
+    }
+    switch(GETMODE(cpu)) {
+    case MODE_SUP:
+        for(uint32_t i = 13;i < 15; i++) {
+            cpu->regs.effective[i] = &cpu->regs.actual[R13_S + (i - 13)];
+        }
+        break;
+    case MODE_IRQ:
+        for(uint32_t i = 13;i < 15; i++) {
+            cpu->regs.effective[i] = &cpu->regs.actual[R13_I + (i - 13)];
+        }
+        break;
+    case MODE_FIQ:
+        for(uint32_t i = 8;i < 15; i++) {
+            cpu->regs.effective[i] = &cpu->regs.actual[R8_F + (i - 8)];
+        }
+        break;
+    default:
+        break;
+    }
+}
+
+//Deal with whatever exception the last instruction raised, and bank registers if it changed the mode
+static inline enum armv2_status finish_instruction(struct armv2 *cpu, enum armv2_exception exception,
+                                                   uint32_t old_mode, int32_t instructions)
+{
+    if(exception != EXCEPT_NONE) {
+        //LOG("Instruction exception %d\n",exception);
+        if(exception == EXCEPT_BREAKPOINT) {
+            if(instructions == -1 || HASCPUFLAG(cpu, FOREVER)) {
+                //this means we're running forver, so treat this as an SWI
+                exception = EXCEPT_SOFTWARE_INTERRUPT;
             }
-            continue;
-        case COND_HI: //C set and Z clear
-            if(FLAG_SET(cpu, C) && FLAG_CLEAR(cpu, Z)) {
-                break;
+            else {
+                //This is special and means stop executing the emulator
+                //Don't advance PC next time since we're at a bkpt
+                cpu->pc -= 4;
+                return ARMV2STATUS_BREAKPOINT;
             }
+        }
+        struct exception_handler ex_handler = cpu->exception_handlers[exception];
+        MATERIALISE_FLAGS(cpu);
+        cpu->regs.actual[ex_handler.save_reg] = cpu->regs.actual[PC];
+        cpu->regs.actual[PC] = ((cpu->regs.actual[PC]) & 0x03fffffc) | ex_handler.mode | ex_handler.flags;
+        cpu->pc = ex_handler.pc - 4;
+    }
+
+    if(GETMODE(cpu) != old_mode) {
+        //The instruction changed the mode of the processor so we need to bank registers
+        bank_registers(cpu);
+    }
+    return ARMV2STATUS_OK;
+}
+
+//Execute the instruction after cpu->pc, or take an interrupt instead. With debug clear there are no
+//breakpoints or watchpoints to look for, and since it's always a constant the checks disappear altogether
+static inline __attribute__((always_inline)) enum armv2_status step_instruction(struct armv2 *cpu,
+                                                                               int32_t *instructions,
+                                                                               const int debug)
+{
+    uint32_t old_mode = GETMODE(cpu);
+    enum armv2_exception exception = EXCEPT_NONE;
+
+    if( *instructions > 0 ) {
+        (*instructions)--;
+    }
+
+    cpu->pc = (cpu->pc + 4) & 0x3ffffff;
+
+    //check if PC is valid
+    SETPC(cpu,cpu->pc + 8);
+
+    //Before we do anything, we check to see if we need to do an FIQ or an IRQ
+    if( take_interrupt(cpu) ) {
+        return ARMV2STATUS_OK;
+    }
+
+    if(cpu->page_tables[PAGEOF(cpu->pc)] == NULL) {
+        //Trying to execute an unmapped page!
+        //some sort of exception
+        if( ARMV2STATUS_OK != fault(cpu, cpu->pc) ) {
+            exception = EXCEPT_PREFETCH_ABORT;
+            goto handle_exception;
+        }
+    }
+
+    if( debug && BREAKPOINT_AT(cpu, cpu->pc) ) {
+        exception = EXCEPT_BREAKPOINT;
+        goto handle_exception;
+    }
+
+    struct page_info *page = cpu->page_tables[PAGEOF(cpu->pc)];
+    struct decoded_instruction scratch;
+    struct decoded_instruction *op = decoded_page(cpu, page, cpu->pc);
+    if( NULL != op ) {
+        op += WORDINPAGE(cpu->pc);
+        if( NULL == op->handler ) {
+            decode_instruction(op, page->memory[WORDINPAGE(cpu->pc)]);
+        }
+    }
+    else {
+        //We couldn't get a cache for this page, so decode it every time
+        op = &scratch;
+        decode_instruction(op, page->memory[WORDINPAGE(cpu->pc)]);
+    }
+
+    if( !condition_passed(cpu, op->instruction) ) {
+        return ARMV2STATUS_OK;
+    }
+    old_mode = GETMODE(cpu);
+    exception = op->handler(cpu, op);
+
+    if( debug && HASCPUFLAG(cpu, WATCHPOINT) && exception == EXCEPT_NONE) {
+        exception = EXCEPT_BREAKPOINT;
+        CLEARCPUFLAG(cpu, WATCHPOINT);
+    }
+
+    //handle the exception if there was one
+handle_exception:
+    return finish_instruction(cpu, exception, old_mode, *instructions);
+}
+
+//Could executing this instruction move the PC somewhere other than the next word? If so it has to be the
+//last in its block. That includes SWIs and the coprocessor instructions, as they can wait for an
+//interrupt or change the memory map under us
+static int ends_block(const struct decoded_instruction *op)
+{
+    uint32_t instruction = op->instruction;
+
+    if( op->handler == alu_instruction ) {
+        return op->rd == PC;
+    }
+    if( op->handler == multiply_instruction ) {
+        return 0;
+    }
+    if( op->handler == swap_instruction ) {
+        return op->rd == PC;
+    }
+    if( op->handler == single_data_transfer_instruction ) {
+        if( (instruction & SDT_LDR) && op->rd == PC ) {
+            return 1;
+        }
+        return op->rn == PC && (!(instruction & SDT_PREINDEX) || (instruction & SDT_WRITE_BACK));
+    }
+    if( op->handler == multi_data_transfer_instruction ) {
+        return (instruction & MDT_LDM) && ((instruction >> PC) & 1);
+    }
+    //branches, SWIs and coprocessor instructions
+    return 1;
+}
+
+//Is this run of instructions a loop that could be spinning waiting for something outside the cpu? That's
+//one that branches back to its own start and doesn't do anything on the way round except read memory and
+//work things out in registers. Whether it really is stuck is only known when it runs, see run_blocks
+static int idle_loop(const struct decoded_instruction *ops, uint32_t length, uint32_t start)
+{
+    const struct decoded_instruction *last = ops + length - 1;
+    uint32_t last_addr = start + (length - 1) * 4;
+
+    if( last->handler != branch_instruction || (last->instruction & (1 << 24)) ||
+        ((last_addr + 8 + last->imm) & 0x3ffffff) != start ) {
+        return 0;
+    }
+    for(const struct decoded_instruction *op = ops; op < last; op++) {
+        if( ends_block(op) ) {
+            return 0;
+        }
+        if( op->handler == alu_instruction || op->handler == multiply_instruction ) {
             continue;
-        case COND_LS: //C clear or Z set
-            if(FLAG_CLEAR(cpu, C) || FLAG_SET(cpu, Z)) {
-                break;
-            }
+        }
+        if( op->handler == single_data_transfer_instruction && (op->instruction & SDT_LDR) ) {
             continue;
-        case COND_GE: //N set and V set,  or N clear and V clear
-            if( (!!FLAG_SET(cpu, N)) == (!!FLAG_SET(cpu, V)) ) {
-                break;
+        }
+        return 0;
+    }
+    return 1;
+}
+
+static struct block *build_block(struct armv2 *cpu, struct page_info *page, uint32_t start)
+{
+    struct decoded_instruction *decoded = decoded_page(cpu, page, start);
+    struct block *block;
+    uint32_t addr = start;
+    uint32_t length = 0;
+
+    if( NULL == decoded ) {
+        return NULL;
+    }
+
+    while(1) {
+        struct decoded_instruction *op = decoded + WORDINPAGE(addr);
+        if( NULL == op->handler ) {
+            decode_instruction(op, page->memory[WORDINPAGE(addr)]);
+        }
+        length++;
+        addr += 4;
+        //Anything with a breakpoint has to start a block, as that's the only place we check them
+        if( ends_block(op) || length == MAX_BLOCK_LENGTH || PAGEOF(addr) != PAGEOF(start) ||
+            BREAKPOINT_AT(cpu, addr) ) {
+            break;
+        }
+    }
+
+    block = malloc(sizeof(struct block) + length * sizeof(struct decoded_instruction));
+    if( NULL == block ) {
+        return NULL;
+    }
+    block->page   = page;
+    block->start  = start;
+    block->length = length;
+    block->executions = 0;
+    block->jit_length = 0;
+    block->jit        = NULL;
+    for(uint32_t i = 0; i < BLOCK_CHAINS; i++) {
+        block->chain[i] = NULL;
+    }
+    memcpy(block->ops, decoded + WORDINPAGE(start), length * sizeof(struct decoded_instruction));
+    block->idle_candidate = idle_loop(block->ops, length, start);
+
+    return block;
+}
+
+void flush_blocks(struct page_info *page)
+{
+    if( NULL != page->blocks ) {
+        for(uint32_t i = 0; i < WORDS_PER_PAGE; i++) {
+            free(page->blocks[i]);
+            page->blocks[i] = NULL;
+        }
+    }
+    page->blocks_stale = 0;
+}
+
+//Throw away every block, and with them everything that's been compiled
+void flush_all_blocks(struct armv2 *cpu)
+{
+    for(uint32_t i = 0; i < NUM_PAGE_TABLES; i++) {
+        if( NULL != cpu->page_tables[i] ) {
+            flush_blocks(cpu->page_tables[i]);
+        }
+    }
+    cpu->jit.used = 0;
+    cpu->jit.full = 0;
+}
+
+//Find or build the block starting at pc, or return NULL if the interpreter should execute it instead. last
+//is the block we've just run, if its chain already knows where pc is we can skip the lookup
+static struct block *next_block(struct armv2 *cpu, struct block *last, uint32_t pc)
+{
+    struct page_info *page = cpu->page_tables[PAGEOF(pc)];
+    struct block *block;
+
+    if( NULL == page || NULL == page->memory ) {
+        //Faults and devices are for the interpreter
+        return NULL;
+    }
+    if( page->blocks_stale ) {
+        flush_blocks(page);
+        last = NULL;
+    }
+    if( NULL != last && last->page == page ) {
+        for(uint32_t i = 0; i < BLOCK_CHAINS; i++) {
+            if( NULL != last->chain[i] && last->chain[i]->start == pc ) {
+                return last->chain[i];
             }
+        }
+    }
+    if( BREAKPOINT_AT(cpu, pc) ) {
+        return NULL;
+    }
+    if( NULL == page->blocks ) {
+        page->blocks = calloc(WORDS_PER_PAGE, sizeof(struct block *));
+        if( NULL == page->blocks ) {
+            return NULL;
+        }
+    }
+
+    block = page->blocks[WORDINPAGE(pc)];
+    if( NULL == block ) {
+        block = build_block(cpu, page, pc);
+        if( NULL == block ) {
+            return NULL;
+        }
+        page->blocks[WORDINPAGE(pc)] = block;
+    }
+
+    if( NULL != last && last->page == page ) {
+        //Take a free slot if there is one, otherwise the last slot goes to whoever came most recently
+        uint32_t i = 0;
+        while( i < BLOCK_CHAINS - 1 && NULL != last->chain[i] ) {
+            i++;
+        }
+        last->chain[i] = block;
+    }
+    return block;
+}
+
+static inline enum armv2_status run_block(struct armv2 *cpu, struct block *block, int32_t *instructions)
+{
+    uint32_t old_mode = GETMODE(cpu);
+    enum armv2_exception exception = EXCEPT_NONE;
+    uint32_t i = 0;
+
+    if( NULL != block->jit && (*instructions < 0 || *instructions >= block->jit_length) ) {
+        //None of the compiled instructions can raise an exception, touch memory or look at the pc, so
+        //we can do all of them and then catch the pc up. The generated code keeps the flags up to date
+        //itself
+        MATERIALISE_FLAGS(cpu);
+        block->jit(cpu);
+        cpu->pc = (cpu->pc + 4 * block->jit_length) & 0x3ffffff;
+        SETPC(cpu,cpu->pc + 8);
+        if( *instructions > 0 ) {
+            *instructions -= block->jit_length;
+        }
+        i = block->jit_length;
+    }
+
+    for(; i < block->length && *instructions != 0; i++) {
+        const struct decoded_instruction *op = block->ops + i;
+
+        if( *instructions > 0 ) {
+            (*instructions)--;
+        }
+        cpu->pc = (cpu->pc + 4) & 0x3ffffff;
+        SETPC(cpu,cpu->pc + 8);
+
+        if( !condition_passed(cpu, op->instruction) ) {
             continue;
-        case COND_LT: //N set and V clear or N clear and V set
-            if( (!!FLAG_SET(cpu, N)) != (!!FLAG_SET(cpu, V)) ) {
-                break;
+        }
+
+        uint32_t pc = cpu->pc;
+        exception = op->handler(cpu, op);
+
+        if( HASCPUFLAG(cpu, WATCHPOINT) && exception == EXCEPT_NONE) {
+            exception = EXCEPT_BREAKPOINT;
+            CLEARCPUFLAG(cpu, WATCHPOINT);
+        }
+        //Only the last instruction in a block should move the pc, but any of them can raise an exception. We
+        //also stop if the block's page has been written to, as the rest of it might not match memory any more
+        if( exception != EXCEPT_NONE || cpu->pc != pc || block->page->blocks_stale ) {
+            break;
+        }
+    }
+
+    return finish_instruction(cpu, exception, old_mode, *instructions);
+}
+
+//Give up on the rest of this run because nothing will happen until a device or an interrupt changes
+//something. Whatever's left is counted as skipped and left in instructions_in_out
+static inline enum armv2_status go_idle(struct armv2 *cpu, int32_t *instructions_in_out, int32_t instructions,
+                                        enum armv2_status status)
+{
+    if( instructions > 0 ) {
+        cpu->skipped_cycles += instructions;
+    }
+    *instructions_in_out = instructions;
+    return status;
+}
+
+//The interpreters have no blocks to mark loops ahead of time, so they look at one when a branch goes back
+//to an earlier address. If it could be idle its registers are kept, and if they're the same the next time
+//the branch is taken then it's stuck just as in run_blocks. The trip also has to be exactly the loop's
+//instructions, as otherwise an interrupt handler might have run in the middle of it
+struct idle_watch {
+    uint32_t start;
+    int32_t  instructions;
+    uint32_t regs[NUMREGS];
+};
+
+#define IDLE_WATCH_NONE 0xffffffff
+
+//Called once the branch at from has been taken backwards, with what's left of the instructions to run
+static int idle_trip(struct armv2 *cpu, struct idle_watch *watch, uint32_t from, int32_t instructions)
+{
+    uint32_t start = (cpu->pc + 4) & 0x3ffffff;
+    uint32_t length = ((from - start) >> 2) + 1;
+    struct page_info *page = cpu->page_tables[PAGEOF(start)];
+
+    if( interrupt_pending(cpu) ) {
+        watch->start = IDLE_WATCH_NONE;
+        return 0;
+    }
+    MATERIALISE_FLAGS(cpu);
+    if( start == watch->start && watch->instructions - instructions == (int32_t)length &&
+        0 == memcmp(watch->regs, cpu->regs.actual, sizeof(watch->regs)) ) {
+        return 1;
+    }
+
+    watch->start = IDLE_WATCH_NONE;
+    if( length > MAX_BLOCK_LENGTH || PAGEOF(from) != PAGEOF(start) || NULL == page || NULL == page->decoded ||
+        !idle_loop(page->decoded + WORDINPAGE(start), length, start) ) {
+        return 0;
+    }
+    watch->start = start;
+    watch->instructions = instructions;
+    memcpy(watch->regs, cpu->regs.actual, sizeof(watch->regs));
+    return 0;
+}
+
+static enum armv2_status run_blocks(struct armv2 *cpu, int32_t *instructions_in_out)
+{
+    int32_t instructions = *instructions_in_out;
+    struct block *last = NULL;
+    enum armv2_status status;
+    uint32_t idle_regs[NUMREGS];
+
+    while(1) {
+        struct block *block = NULL;
+
+        if( cpu->jit.full ) {
+            flush_all_blocks(cpu);
+            last = NULL;
+        }
+
+        if( instructions == 0 ) {
+            *instructions_in_out = 0;
+            return ARMV2STATUS_OK;
+        }
+
+        if( WAITING(cpu) && PIN_OFF(cpu, I) && PIN_OFF(cpu, F) ) {
+            return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_WAIT_FOR_INTERRUPT);
+        }
+
+        //Interrupts are only checked for here between blocks
+        if( !interrupt_pending(cpu) ) {
+            block = next_block(cpu, last, (cpu->pc + 4) & 0x3ffffff);
+        }
+
+        if( NULL == block ) {
+            //The interpreter deals with interrupts, faults, breakpoints and device memory one instruction at a
+            //time
+            status = step_instruction(cpu, &instructions, 1);
+        }
+        else {
+            if( EXEC_JIT == cpu->exec_mode && block->executions < cpu->jit_threshold ) {
+                if( ++block->executions == cpu->jit_threshold ) {
+                    jit_compile(cpu, block);
+                }
             }
-            continue;
-        case COND_GT: //Z clear and either N set and V set, or N clear and V clear
-            if((FLAG_CLEAR(cpu, Z) && (!!FLAG_SET(cpu, N)) == (!!FLAG_SET(cpu, V)) )) {
-                break;
+            if( block->idle_candidate ) {
+                MATERIALISE_FLAGS(cpu);
+                memcpy(idle_regs, cpu->regs.actual, sizeof(idle_regs));
             }
-            continue;
-        case COND_LE: //Z set or N set and V clear, or N clear and V set
-            if((FLAG_SET(cpu, Z) || (!!FLAG_SET(cpu, N)) != (!!FLAG_SET(cpu, V)) )) {
-                break;
+            status = run_block(cpu, block, &instructions);
+            //If a trip round the loop left every register and flag as it found them then the next one will
+            //do exactly the same, and so will every one after that until memory changes under it
+            if( ARMV2STATUS_OK == status && block->idle_candidate && ((cpu->pc + 4) & 0x3ffffff) == block->start &&
+                !interrupt_pending(cpu) && (MATERIALISE_FLAGS(cpu), 0 == memcmp(idle_regs, cpu->regs.actual,
+                                                                                sizeof(idle_regs))) ) {
+                return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_IDLE);
             }
-            continue;
-        case COND_AL: //Always
-            break;
-        case COND_NV: //Never
-            continue;
         }
-        instruction_handler_t handler = NULL;
-        //We're executing the instruction
-        switch((instruction >> 26) & 03) {
-        case 0:
-            if((instruction & 0x0fc000f0) == 0x00000090) {
-                handler = multiply_instruction;
+        if( ARMV2STATUS_OK != status ) {
+            *instructions_in_out = instructions;
+            return status;
+        }
+        last = block;
+    }
+}
+
+#ifdef ARMV2_THREADED_DISPATCH
+
+//The class of an instruction can be told from bits 20-27 and 4-7, so those index the dispatch table
+#define CLASS_INDEX(instruction) ((((instruction) >> 16) & 0xff0) | (((instruction) >> 4) & 0xf))
+#define CLASS_TABLE_SIZE         (1 << 12)
+
+//The same interpreter with the dispatch done by GCC's labels as values. Each handler's label ends with its
+//own copy of DISPATCH, so the indirect jump to the next instruction's handler happens from a different
+//place for each class and the branch predictor gets to learn what tends to follow what. Anything out of
+//the ordinary (no instructions left, interrupts, faults, breakpoints or an instruction we haven't decoded
+//yet) goes to slow_path which is just the ordinary loop for one instruction
+static void *class_table[CLASS_TABLE_SIZE];
+static pthread_once_t class_table_once = PTHREAD_ONCE_INIT;
+
+static enum armv2_status run_threaded(struct armv2 *cpu, int32_t *instructions_in_out);
+
+//Only run_threaded can take the addresses of its labels, so it fills the table in when it's called without
+//a cpu. This is done through pthread_once as a pool can have several cpus starting on different threads
+static void fill_class_table(void)
+{
+    run_threaded(NULL, NULL);
+}
+
+static enum armv2_status run_threaded(struct armv2 *cpu, int32_t *instructions_in_out)
+{
+    int32_t instructions;
+    const struct decoded_instruction *op = NULL;
+    enum armv2_status status;
+    struct idle_watch watch = {.start = IDLE_WATCH_NONE};
+    uint32_t branch_addr;
+
+    if( NULL == cpu ) {
+        for(uint32_t i = 0; i < CLASS_TABLE_SIZE; i++) {
+            struct decoded_instruction decoded;
+            decode_instruction(&decoded, ((i & 0xff0) << 16) | ((i & 0xf) << 4));
+
+            if( decoded.handler == multiply_instruction ) {
+                class_table[i] = &&multiply;
             }
-            else if((instruction & 0x0fb00ff0) == 0x01000090) {
-                handler = swap_instruction;
+            else if( decoded.handler == swap_instruction ) {
+                class_table[i] = &&swap;
             }
-            else {
-                //data processing instruction...
-                handler = alu_instruction;
+            else if( decoded.handler == single_data_transfer_instruction ) {
+                class_table[i] = &&single_data_transfer;
             }
-            break;
-        case 1:
-            //LDR or STR, or undefined
-            handler = single_data_transfer_instruction;
-            break;
-        case 2:
-            //LDM or STM or branch
-            if(instruction & 0x02000000) {
-                handler = branch_instruction;
+            else if( decoded.handler == branch_instruction ) {
+                class_table[i] = &&branch;
             }
-            else {
-                handler = multi_data_transfer_instruction;
+            else if( decoded.handler == multi_data_transfer_instruction ) {
+                class_table[i] = &&multi_data_transfer;
             }
-            break;
-        case 3:
-            //coproc functions or swi
-            if((instruction & 0x0f000000) == 0x0f000000) {
-                handler = software_interrupt_instruction;
+            else if( decoded.handler == software_interrupt_instruction ) {
+                class_table[i] = &&software_interrupt;
+            }
+            else if( decoded.handler == coprocessor_data_transfer_instruction ) {
+                class_table[i] = &&coprocessor_data_transfer;
             }
-            else if((instruction & 0x02000000) == 0) {
-                handler = coprocessor_data_transfer_instruction;
+            else if( decoded.handler == coprocessor_register_transfer_instruction ) {
+                class_table[i] = &&coprocessor_register_transfer;
             }
-            else if(instruction & 0x10) {
-                handler = coprocessor_register_transfer_instruction;
+            else if( decoded.handler == coprocessor_data_operation_instruction ) {
+                class_table[i] = &&coprocessor_data_operation;
             }
             else {
-                handler = coprocessor_data_operation_instruction;
+                class_table[i] = &&alu;
             }
-            break;
         }
-        old_mode = GETMODE(cpu);
-        exception = handler(cpu, instruction);
+        return ARMV2STATUS_OK;
+    }
 
-        if( HASCPUFLAG(cpu, WATCHPOINT) && exception == EXCEPT_NONE) {
-            exception = EXCEPT_BREAKPOINT;
-            CLEARCPUFLAG(cpu, WATCHPOINT);
+    pthread_once(&class_table_once, fill_class_table);
+    instructions = *instructions_in_out;
+
+#define DISPATCH() do {                                                                 \
+        if( instructions != 0 && !WAITING(cpu) && !interrupt_pending(cpu) ) {           \
+            uint32_t next_pc = (cpu->pc + 4) & 0x3ffffff;                               \
+            struct page_info *page = cpu->page_tables[PAGEOF(next_pc)];                 \
+            if( NULL != page && NULL != page->decoded && !BREAKPOINT_AT(cpu, next_pc) && \
+                NULL != page->decoded[WORDINPAGE(next_pc)].handler ) {                  \
+                op = page->decoded + WORDINPAGE(next_pc);                               \
+                if( instructions > 0 ) {                                                \
+                    instructions--;                                                     \
+                }                                                                       \
+                cpu->pc = next_pc;                                                      \
+                SETPC(cpu, cpu->pc + 8);                                                \
+                if( CONDITION_BITS(op->instruction) == COND_AL ||                       \
+                    condition_passed(cpu, op->instruction) ) {                          \
+                    goto *class_table[CLASS_INDEX(op->instruction)];                    \
+                }                                                                       \
+                goto dispatch;                                                          \
+            }                                                                           \
+        }                                                                               \
+        goto slow_path;                                                                 \
+    } while(0)
+
+#define EXECUTE(handler) do {                                                           \
+        EXECUTE_ONLY(handler);                                                          \
+        DISPATCH();                                                                     \
+    } while(0)
+
+#define EXECUTE_ONLY(handler) do {                                                      \
+        uint32_t old_mode = GETMODE(cpu);                                               \
+        enum armv2_exception exception = handler(cpu, op);                              \
+        if( HASCPUFLAG(cpu, WATCHPOINT) && exception == EXCEPT_NONE) {                  \
+            exception = EXCEPT_BREAKPOINT;                                              \
+            CLEARCPUFLAG(cpu, WATCHPOINT);                                              \
+        }                                                                               \
+        if( exception != EXCEPT_NONE || GETMODE(cpu) != old_mode ) {                    \
+            status = finish_instruction(cpu, exception, old_mode, instructions);        \
+            if( ARMV2STATUS_OK != status ) {                                            \
+                *instructions_in_out = instructions;                                    \
+                return status;                                                          \
+            }                                                                           \
+        }                                                                               \
+    } while(0)
+
+dispatch:
+    DISPATCH();
+
+slow_path:
+    if( instructions == 0 ) {
+        *instructions_in_out = 0;
+        return ARMV2STATUS_OK;
+    }
+    if( WAITING(cpu) && PIN_OFF(cpu, I) && PIN_OFF(cpu, F) ) {
+        return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_WAIT_FOR_INTERRUPT);
+    }
+    branch_addr = (cpu->pc + 4) & 0x3ffffff;
+    status = step_instruction(cpu, &instructions, 1);
+    if( ARMV2STATUS_OK != status ) {
+        *instructions_in_out = instructions;
+        return status;
+    }
+    if( ((cpu->pc + 4) & 0x3ffffff) <= branch_addr && idle_trip(cpu, &watch, branch_addr, instructions) ) {
+        return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_IDLE);
+    }
+    DISPATCH();
+
+alu:
+    EXECUTE(alu_instruction);
+multiply:
+    EXECUTE(multiply_instruction);
+swap:
+    //The table can't see bits 8-11, which have to be clear for a swap
+    if( (op->instruction & 0x0fb00ff0) != 0x01000090 ) {
+        goto alu;
+    }
+    EXECUTE(swap_instruction);
+single_data_transfer:
+    EXECUTE(single_data_transfer_instruction);
+branch:
+    //Only branches can go round a loop that idle_loop would take, so they're the only ones that look, along
+    //with slow_path for the first time round
+    branch_addr = cpu->pc;
+    EXECUTE_ONLY(branch_instruction);
+    if( ((cpu->pc + 4) & 0x3ffffff) <= branch_addr && idle_trip(cpu, &watch, branch_addr, instructions) ) {
+        return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_IDLE);
+    }
+    DISPATCH();
+multi_data_transfer:
+    EXECUTE(multi_data_transfer_instruction);
+software_interrupt:
+    EXECUTE(software_interrupt_instruction);
+coprocessor_data_transfer:
+    EXECUTE(coprocessor_data_transfer_instruction);
+coprocessor_register_transfer:
+    EXECUTE(coprocessor_register_transfer_instruction);
+coprocessor_data_operation:
+    EXECUTE(coprocessor_data_operation_instruction);
+
+#undef EXECUTE_ONLY
+#undef EXECUTE
+#undef DISPATCH
+}
+
+#endif
+
+//The plain interpreter loop. We have one copy of it with debug set and one without, and each returns OK
+//early if FLAG_DEBUG changes under it so that run_armv2 can carry on in the other
+static inline __attribute__((always_inline)) enum armv2_status run_interpreter(struct armv2 *cpu,
+                                                                              int32_t *instructions_in_out,
+                                                                              const int debug)
+{
+    int32_t instructions = *instructions_in_out;
+    enum armv2_status status;
+    struct idle_watch watch = {.start = IDLE_WATCH_NONE};
+
+    //instructions of -1 means run forever
+    while(1) {
+        uint32_t addr = (cpu->pc + 4) & 0x3ffffff;
+
+        if( instructions == 0 ) {
+            *instructions_in_out = 0;
+            return ARMV2STATUS_OK;
         }
 
-        //handle the exception if there was one
-    handle_exception:
-        if(exception != EXCEPT_NONE) {
-            //LOG("Instruction exception %d\n",exception);
-            if(exception == EXCEPT_BREAKPOINT) {
-                if(instructions == -1) {
-                    //this means we're running forver, so treat this as an SWI
-                    exception = EXCEPT_SOFTWARE_INTERRUPT;
-                }
-                else {
-                    //This is special and means stop executing the emulator
-                    //Don't advance PC next time since we're at a bkpt
-                    cpu->pc -= 4;
-                    *instructions_in_out = instructions;
-                    return ARMV2STATUS_BREAKPOINT;
-                }
-            }
-            struct exception_handler ex_handler = cpu->exception_handlers[exception];
-            cpu->regs.actual[ex_handler.save_reg] = cpu->regs.actual[PC];
-            cpu->regs.actual[PC] = ((cpu->regs.actual[PC]) & 0x03fffffc) | ex_handler.mode | ex_handler.flags;
-            cpu->pc = ex_handler.pc - 4;
+        if( WAITING(cpu) && PIN_OFF(cpu, I) && PIN_OFF(cpu, F) ) {
+            return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_WAIT_FOR_INTERRUPT);
+        }
+
+        if( !debug != !HASCPUFLAG(cpu, DEBUG) ) {
+            *instructions_in_out = instructions;
+            return ARMV2STATUS_OK;
         }
 
-        if(GETMODE(cpu) != old_mode) {
-            //The instruction changed the mode of the processor so we need to bank registers
-            if(MODE_FIQ == old_mode) {
-                for(uint32_t i = 8;i < NUM_EFFECTIVE_REGS; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[i];
+        status = step_instruction(cpu, &instructions, debug);
+        if( ARMV2STATUS_OK != status ) {
+            *instructions_in_out = instructions;
+            return status;
+        }
+        if( ((cpu->pc + 4) & 0x3ffffff) <= addr && idle_trip(cpu, &watch, addr, instructions) ) {
+            return go_idle(cpu, instructions_in_out, instructions, ARMV2STATUS_IDLE);
+        }
+    }
+}
+
+static enum armv2_status run_engine(struct armv2 *cpu, int32_t *instructions_in_out)
+{
+    enum armv2_status status;
+
+    if( EXEC_BLOCKS == cpu->exec_mode || EXEC_JIT == cpu->exec_mode ) {
+        return run_blocks(cpu, instructions_in_out);
+    }
+#ifdef ARMV2_THREADED_DISPATCH
+    return run_threaded(cpu, instructions_in_out);
+#endif
+
+    do {
+        if( HASCPUFLAG(cpu, DEBUG) ) {
+            status = run_interpreter(cpu, instructions_in_out, 1);
+        }
+        else {
+            status = run_interpreter(cpu, instructions_in_out, 0);
+        }
+    } while( ARMV2STATUS_OK == status && 0 != *instructions_in_out );
+
+    return status;
+}
+
+//Run whichever engine the cpu is using, but never past the next device event, and keep the virtual clock
+//up to date. Waiting for an interrupt or idling with an event to come takes the clock straight to it, as
+//nothing can happen before then
+static enum armv2_status run_clocked(struct armv2 *cpu, int32_t *instructions_in_out)
+{
+    int32_t instructions = *instructions_in_out;
+    enum armv2_status status;
+
+    while(1) {
+        //Running forever is done in chunks so that it can be counted too
+        int32_t slice = instructions < 0 ? INT32_MAX : instructions;
+        int32_t left;
+        int to_event = 0;
+
+        if( cpu->cycles >= cpu->next_event ) {
+            run_events(cpu);
+        }
+        if( cpu->next_event - cpu->cycles < (uint64_t)slice ) {
+            slice = (int32_t)(cpu->next_event - cpu->cycles);
+            to_event = 1;
+        }
+
+        left = slice;
+        status = run_engine(cpu, &left);
+
+        if( ARMV2STATUS_WAIT_FOR_INTERRUPT == status || ARMV2STATUS_IDLE == status ) {
+            if( to_event ) {
+                cpu->cycles += slice;
+                if( instructions > 0 ) {
+                    instructions -= slice;
                 }
+                continue;
             }
-            switch(GETMODE(cpu)) {
-            case MODE_SUP:
-                for(uint32_t i = 13;i < 15; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[R13_S + (i - 13)];
-                }
-                break;
-            case MODE_IRQ:
-                for(uint32_t i = 13;i < 15; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[R13_I + (i - 13)];
-                }
-                break;
-            case MODE_FIQ:
-                for(uint32_t i = 8;i < 15; i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[R8_F + (i - 8)];
-                }
-                break;
-            case MODE_USR:
-                for(uint32_t i = 13;i < 15;i++) {
-                    cpu->regs.effective[i] = &cpu->regs.actual[i];
-                }
-                break;
-            default:
-                break;
+            if( instructions < 0 ) {
+                //Nothing is coming to wake us, so we'd wait forever rather than for a chunk
+                cpu->cycles += slice - left;
+                cpu->skipped_cycles -= left;
+                *instructions_in_out = instructions;
+                return status;
             }
+            cpu->cycles += slice;
+            *instructions_in_out = left;
+            return status;
         }
 
+        cpu->cycles += slice - left;
+        if( instructions >= 0 ) {
+            instructions -= slice - left;
+        }
+        if( ARMV2STATUS_OK != status || 0 == instructions ) {
+            *instructions_in_out = instructions;
+            return status;
+        }
     }
-    *instructions_in_out = instructions;
-    return ARMV2STATUS_OK;
+}
+
+enum armv2_status run_armv2(struct armv2 *cpu, int32_t *instructions_in_out)
+{
+    enum armv2_status status;
+
+    //Running forever is done in slices, so the engines can't tell it from the instructions they're given
+    if( *instructions_in_out < 0 ) {
+        SETCPUFLAG(cpu, FOREVER);
+    }
+    status = run_clocked(cpu, instructions_in_out);
+    CLEARCPUFLAG(cpu, FOREVER);
+
+    return status;
 }
 
 // We start with no memory paged in. On a page fault, we see if we've got enough RAM to populate it
@@ -305,7 +1021,12 @@ enum armv2_status fault(struct armv2 *cpu, uint32_t addr)
         return ARMV2STATUS_MEMORY_ERROR;
     }
 
-    page_info->memory = mmap(NULL, PAGE_SIZE, PROT_READ | PROT_WRITE, MAP_ANONYMOUS | MAP_SHARED, -1, 0);
+    if( NULL != cpu->physical_ram ) {
+        page_info->memory = cpu->physical_ram + PAGEOF(addr) * WORDS_PER_PAGE;
+    }
+    else {
+        page_info->memory = mmap(NULL, PAGE_SIZE, PROT_READ | PROT_WRITE, MAP_ANONYMOUS | MAP_SHARED, -1, 0);
+    }
     if( MAP_FAILED == page_info->memory ) {
         result = ARMV2STATUS_MEMORY_ERROR;
         LOG("Error mmaping memory\n");
@@ -319,7 +1040,14 @@ enum armv2_status fault(struct armv2 *cpu, uint32_t addr)
     }
 
     cpu->page_tables[PAGEOF(addr)] = page_info;
+    region_index_add(cpu, PAGEOF(addr));
     cpu->free_ram -= PAGE_SIZE;
+    if( NULL != cpu->physical_ram ) {
+        SET_PAGE_BIT(cpu->ram_readable, PAGEOF(addr));
+        if( page_info->flags & PERM_WRITE ) {
+            SET_PAGE_BIT(cpu->ram_writable, PAGEOF(addr));
+        }
+    }
 
 cleanup:
     if( result != ARMV2STATUS_OK ) {
@@ -1,20 +1,26 @@
-from scipy.signal import butter, lfilter
 import zipfile
 import tempfile
 import configparser
-import pygame
-import pygame.image
 import numpy
 import io
 import struct
 import traceback
-import globals
 
 try:
     from . import popcnt  # type: ignore
+    from . import globals
 except ImportError:
     # We also need to import this from create.py as a top-level package
     import popcnt
+    import globals
+
+try:
+    from scipy.signal import butter, lfilter
+    import pygame
+    import pygame.image
+except ImportError:
+    # These are only for the sound, which a tape for a headless machine doesn't have
+    pygame = butter = lfilter = None
 
 
 def pad(data: bytearray, align):
@@ -127,7 +133,10 @@ class Tape(object):
 class ProgramTape(Tape):
     cache_seconds = 1
 
-    def __init__(self, filename):
+    def __init__(self, filename, sound=True):
+        # Without the sound the bytes can be read straight away, and there are no samples to make, which is
+        # most of the work of loading a tape. That's what a headless tape drive wants
+        self.has_sound = sound
 
         # Position in the tape in milliseconds
         self.position = 0
@@ -150,6 +159,10 @@ class ProgramTape(Tape):
             self.data_blocks.append(bytearray(self.data[pos + 4 : pos + 4 + size]))
             pos += size + 4
 
+        if not self.has_sound:
+            self.start_time = []
+            self.block_start = 0
+            return
         self.build_samples()
         self.build_sound()
         self.block_start = self.preamble_len
@@ -159,14 +172,18 @@ class ProgramTape(Tape):
         self.current_block = 0
         self.current_bit = 0
         self.block_pos = 0
+        if not self.has_sound:
+            return
         self.block_start = self.preamble_len
         self.build_sound()
 
     def fast_forward(self):
-        self.position = self.end_time
         self.current_block = len(self.data_blocks) - 1
-        self.current_bit = len(self.bit_times[self.current_block]) - 1
         self.block_pos = len(self.data_blocks[self.current_block]) - 1
+        if not self.has_sound:
+            return
+        self.position = self.end_time
+        self.current_bit = len(self.bit_times[self.current_block]) - 1
         self.block_start = self.end_time
         self.build_sound()
 
@@ -247,7 +264,7 @@ class ProgramTape(Tape):
         self.sound.set_volume(0.2)
 
     def byte_ready(self):
-        if self.current_block >= len(self.data_blocks):
+        if self.current_block >= len(self.data_blocks) or not self.has_sound:
             return True
 
         if self.position < self.start_time[self.current_block]:
@@ -282,6 +299,20 @@ class ProgramTape(Tape):
             c = None
         return c
 
+    def peek_bytes(self, count):
+        # Up to count of the bytes that get_byte would return next, without going past the end of the block
+        try:
+            block = self.data_blocks[self.current_block]
+        except IndexError:
+            return bytearray()
+        return block[self.block_pos : self.block_pos + count]
+
+    def skip_bytes(self, count):
+        # Move on count bytes, which mustn't be more than peek_bytes gave
+        self.block_pos += count
+        if self.block_pos >= len(self.data_blocks[self.current_block]):
+            self.advance_block()
+
     def advance_block(self):
         self.current_block += 1
         self.block_pos = 0
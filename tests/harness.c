@@ -3,7 +3,6 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
-#include <sys/mman.h>
 #include <unistd.h>
 
 #include "harness.h"
@@ -31,6 +30,14 @@ static int fail_count = 0;
 static int check_count = 0;
 static char context[CONTEXT_LEN] = {0};
 
+/* Every test runs with the cpu in this mode, see --blocks and --jit in main() */
+static enum exec_mode test_exec_mode = EXEC_INTERPRETER;
+static const char *exec_mode_names[EXEC_MAX] = {
+    [EXEC_INTERPRETER] = "interpreter",
+    [EXEC_BLOCKS]      = "block mode",
+    [EXEC_JIT]         = "jit",
+};
+
 /* The emulator logs to stdout on init/cleanup, which would drown the results */
 static int saved_stdout = -1;
 
@@ -94,11 +101,26 @@ void t_reset_ram(uint32_t ram_size)
         exit(2);
     }
     unmute();
+    (void)set_exec_mode(cpu, test_exec_mode);
+    /* Tests mostly run their code once, so compile everything straight away */
+    cpu->jit_threshold = 1;
 
     t_map(CODE_ADDR);
     t_map(DATA_ADDR);
 }
 
+void t_use(struct armv2 *which)
+{
+    cpu = (NULL == which) ? &the_cpu : which;
+}
+
+void t_release(struct armv2 *which)
+{
+    mute();
+    (void)cleanup_armv2(which);
+    unmute();
+}
+
 /* Fault a page in the way the machine does when it loads the boot rom, i.e.
  * with the address of the start of the page. fault() only marks page zero read
  * only when it is handed address zero exactly, see page_zero_is_read_only. */
@@ -118,22 +140,14 @@ void t_fault(uint32_t addr)
 
 void t_unmap(uint32_t addr)
 {
-    struct page_info *page = cpu->page_tables[PAGEOF(addr)];
-
-    if( NULL != page ) {
-        if( NULL != page->memory ) {
-            munmap(page->memory, PAGE_SIZE);
-        }
-        free(page);
-        cpu->page_tables[PAGEOF(addr)] = NULL;
-        cpu->free_ram += PAGE_SIZE;
-    }
+    (void)release_page(cpu, addr);
 }
 
 void t_write(uint32_t addr, uint32_t value)
 {
     t_map(addr);
     DEREF(cpu, addr) = value;
+    INVALIDATE_DECODED(cpu->page_tables[PAGEOF(addr)], addr);
 }
 
 uint32_t t_read(uint32_t addr)
@@ -144,21 +158,25 @@ uint32_t t_read(uint32_t addr)
 
 void t_setreg(uint32_t reg, uint32_t value)
 {
+    MATERIALISE_FLAGS(cpu);
     GETREG(cpu, reg) = value;
 }
 
 uint32_t t_getreg(uint32_t reg)
 {
+    MATERIALISE_FLAGS(cpu);
     return GETREG(cpu, reg);
 }
 
 void t_setactual(uint32_t reg, uint32_t value)
 {
+    MATERIALISE_FLAGS(cpu);
     cpu->regs.actual[reg] = value;
 }
 
 uint32_t t_getactual(uint32_t reg)
 {
+    MATERIALISE_FLAGS(cpu);
     return cpu->regs.actual[reg];
 }
 
@@ -177,6 +195,7 @@ static uint32_t flag_bit(char c)
 
 void t_setflags(const char *flags)
 {
+    MATERIALISE_FLAGS(cpu);
     for( const char *p = flags; *p; p++ ) {
         uint32_t bit = flag_bit(*p);
         if( 0 == bit ) {
@@ -207,7 +226,10 @@ void t_setflags_bits(uint32_t nzcv)
 const char *t_flags(void)
 {
     static char buf[5];
-    uint32_t psr = cpu->regs.actual[PC];
+    uint32_t psr;
+
+    MATERIALISE_FLAGS(cpu);
+    psr = cpu->regs.actual[PC];
 
     buf[0] = (psr & FLAG_N) ? 'N' : 'n';
     buf[1] = (psr & FLAG_Z) ? 'Z' : 'z';
@@ -345,11 +367,23 @@ int main(int argc, char *argv[])
 {
     int passed = 0, failed = 0;
     int total_checks = 0;
-    const char *filter = argc > 1 ? argv[1] : NULL;
+    const char *filter = NULL;
+
+    for( int i = 1; i < argc; i++ ) {
+        if( 0 == strcmp(argv[i], "--blocks") ) {
+            test_exec_mode = EXEC_BLOCKS;
+        }
+        else if( 0 == strcmp(argv[i], "--jit") ) {
+            test_exec_mode = EXEC_JIT;
+        }
+        else {
+            filter = argv[i];
+        }
+    }
 
     qsort(tests, num_tests, sizeof(tests[0]), compare_tests);
 
-    printf("Running %zu tests\n\n", num_tests);
+    printf("Running %zu tests (%s)\n\n", num_tests, exec_mode_names[test_exec_mode]);
 
     for( size_t i = 0; i < num_tests; i++ ) {
         if( filter && NULL == strstr(tests[i].name, filter) ) {
@@ -361,6 +395,7 @@ int main(int argc, char *argv[])
         check_count = 0;
         t_clear_context();
 
+        t_use(NULL);
         t_reset();
         tests[i].fn();
         t_clear_context();
@@ -2,7 +2,9 @@
  *
  * Tests are registered automatically by the TEST() macro, so adding a test is
  * just a matter of writing it in one of the tests/test_*.c files. The runner in
- * harness.c resets the CPU before every test.
+ * harness.c resets the CPU before every test. By default the CPU runs in its
+ * interpreter, pass --blocks to run everything again with the block engine or
+ * --jit to have every block compiled the first time it runs.
  */
 #ifndef ARMV2_TESTS_HARNESS_H
 #define ARMV2_TESTS_HARNESS_H
@@ -28,6 +30,12 @@ void t_reset(void);
  * when a page cannot be faulted in. */
 void t_reset_ram(uint32_t ram_size);
 
+/* Point the harness at another cpu, for the tests that need more than one.
+ * Everything from t_reset() down then works on that one until t_use(NULL)
+ * goes back to the cpu under test. t_release() cleans one up afterwards. */
+void t_use(struct armv2 *which);
+void t_release(struct armv2 *which);
+
 void     t_map(uint32_t addr);                 /* make sure addr's page exists */
 void     t_fault(uint32_t addr);               /* fault a page in at this exact address */
 void     t_unmap(uint32_t addr);               /* throw addr's page away again */
@@ -0,0 +1,225 @@
+/* The block engine.
+ *
+ * Every other test is run in block mode as well by "run_tests --blocks", so
+ * these are about the things only blocks have: where they end, the limits on
+ * how far one runs, and when they get thrown away. They switch to block mode
+ * themselves so they mean the same thing whichever way the runner was started.
+ */
+#include "harness.h"
+#include "encode.h"
+
+static struct block *block_at(uint32_t addr)
+{
+    struct page_info *page = cpu->page_tables[PAGEOF(addr)];
+
+    if( NULL == page || NULL == page->blocks ) {
+        return NULL;
+    }
+    return page->blocks[WORDINPAGE(addr)];
+}
+
+/* r0 counts down to zero, r1 counts the trips round */
+static void write_loop(void)
+{
+    t_write(CODE_ADDR,      MOV_IMM(0, 10));
+    t_write(CODE_ADDR + 4,  dp_imm(C_AL, OP_ADD, 0, 1, 1, 0, 1));         /* add r1, r1, #1 */
+    t_write(CODE_ADDR + 8,  dp_imm(C_AL, OP_SUB, 1, 0, 0, 0, 1));         /* subs r0, r0, #1 */
+    t_write(CODE_ADDR + 12, branch(C_NE, 0, CODE_ADDR + 12, CODE_ADDR + 4));
+    t_write(CODE_ADDR + 16, MOV_IMM(2, 99));
+}
+
+TEST(block_loop_runs_to_completion)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+
+    t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    CHECK_REG(0, 0);
+    CHECK_REG(1, 10);
+    CHECK_REG(2, 99);
+    CHECK_PC(CODE_ADDR + 20);
+}
+
+TEST(block_ends_at_the_branch_and_chains_to_its_target)
+{
+    struct block *block;
+
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+
+    t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    block = block_at(CODE_ADDR);
+    CHECK_MSG(NULL != block, "there should be a block at the start of the code");
+    if( NULL == block ) {
+        return;
+    }
+    CHECK_HEX("length", block->length, 4);
+
+    /* The loop body was entered from the first block and then from itself */
+    block = block_at(CODE_ADDR + 4);
+    CHECK_MSG(NULL != block, "there should be a block at the loop head");
+    if( NULL == block ) {
+        return;
+    }
+    CHECK_HEX("loop length", block->length, 3);
+    CHECK_MSG(block->chain[0] == block || block->chain[1] == block, "the loop should be chained to itself");
+}
+
+TEST(block_stops_when_the_instructions_run_out)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_REG(0, 10);
+    CHECK_REG(1, 1);
+    CHECK_PC(CODE_ADDR + 8);
+}
+
+TEST(block_breakpoint_set_after_the_block_was_built)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+    t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+    t_setreg(1, 0);
+
+    set_breakpoint(cpu, CODE_ADDR + 8);
+    enum armv2_status status = t_run(CODE_ADDR, 100);
+
+    CHECK_MSG(ARMV2STATUS_BREAKPOINT == status, "status is %d, expected ARMV2STATUS_BREAKPOINT (%d)",
+              status, ARMV2STATUS_BREAKPOINT);
+    CHECK_PC(CODE_ADDR + 8);
+    CHECK_REG(0, 10);
+    CHECK_REG(1, 1);
+}
+
+/* An interrupt that turns up while a block is running waits for the end of it */
+TEST(block_interrupt_is_taken_at_the_next_block)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    t_setflags("nzcvi");
+    write_loop();
+    t_run(CODE_ADDR, 1);
+
+    interrupt(cpu, 1, 2);
+    t_run(CODE_ADDR + 4, 1);
+
+    CHECK_PC(g_vector_table[EXCEPT_IRQ]);
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+    CHECK_REG(1, 0);
+}
+
+TEST(block_load_to_pc_ends_the_block)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    t_setreg(1, DATA_ADDR);
+    t_write(DATA_ADDR, CODE_ADDR + 0x40);
+    t_write(CODE_ADDR,     sdt(C_AL, 0, 1, 1, 0, 0, 1, 1, R_PC, 0));     /* ldr pc, [r1] */
+    t_write(CODE_ADDR + 4, MOV_IMM(0, 1));
+    t_write(CODE_ADDR + 0x40, MOV_IMM(2, 2));
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_REG(0, 0);
+    CHECK_REG(2, 2);
+    CHECK_HEX("length", block_at(CODE_ADDR) ? block_at(CODE_ADDR)->length : 0, 1);
+}
+
+TEST(block_is_rebuilt_after_its_code_changes)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+    t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    t_write(CODE_ADDR + 16, MOV_IMM(2, 55));
+    t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    CHECK_REG(2, 55);
+}
+
+/* ldr r0, [r1]; cmp r0, #0; beq back to the ldr */
+static void write_poll_loop(void)
+{
+    t_setreg(1, DATA_ADDR);
+    t_write(CODE_ADDR,     sdt(C_AL, 0, 1, 1, 0, 0, 1, 1, 0, 0));          /* ldr r0, [r1] */
+    t_write(CODE_ADDR + 4, dp_imm(C_AL, OP_CMP, 1, 0, 0, 0, 0));          /* cmp r0, #0 */
+    t_write(CODE_ADDR + 8, branch(C_EQ, 0, CODE_ADDR + 8, CODE_ADDR));
+    t_write(CODE_ADDR + 12, MOV_IMM(2, 1));
+}
+
+TEST(block_polling_loop_goes_idle)
+{
+    enum armv2_status status;
+
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_poll_loop();
+
+    status = t_run(CODE_ADDR, 1000);
+
+    CHECK_MSG(ARMV2STATUS_IDLE == status, "status is %d, expected ARMV2STATUS_IDLE (%d)",
+              status, ARMV2STATUS_IDLE);
+    CHECK_PC(CODE_ADDR);
+    /* It takes two trips round to see that nothing changed */
+    CHECK_HEX("skipped", (uint32_t)cpu->skipped_cycles, 1000 - 6);
+
+    t_write(DATA_ADDR, 1);
+    status = t_run(CODE_ADDR, 4);
+
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_REG(2, 1);
+}
+
+/* The interpreters spot the same loop from its branch, so this one runs in whichever mode the tests are in */
+TEST(polling_loop_goes_idle_in_any_mode)
+{
+    enum armv2_status status;
+
+    write_poll_loop();
+
+    status = t_run(CODE_ADDR, 1000);
+
+    CHECK_MSG(ARMV2STATUS_IDLE == status, "status is %d, expected ARMV2STATUS_IDLE (%d)",
+              status, ARMV2STATUS_IDLE);
+    CHECK_PC(CODE_ADDR);
+    CHECK_HEX("skipped", (uint32_t)cpu->skipped_cycles, 1000 - 6);
+}
+
+/* A countdown changes a register every time round, so it doesn't go idle in any mode either */
+TEST(delay_loop_is_not_idle_in_any_mode)
+{
+    write_loop();
+
+    enum armv2_status status = t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_REG(2, 99);
+    CHECK_HEX("skipped", (uint32_t)cpu->skipped_cycles, 0);
+}
+
+/* A countdown changes a register every time round, so it has to run */
+TEST(block_delay_loop_is_not_idle)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    write_loop();
+
+    enum armv2_status status = t_run(CODE_ADDR, 1 + 10 * 3 + 1);
+
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_REG(2, 99);
+    CHECK_HEX("skipped", (uint32_t)cpu->skipped_cycles, 0);
+}
+
+TEST(block_polling_loop_takes_a_pending_interrupt)
+{
+    set_exec_mode(cpu, EXEC_BLOCKS);
+    t_setflags("i");
+    write_poll_loop();
+    interrupt(cpu, 1, 2);
+
+    t_run(CODE_ADDR, 1000);
+
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+}
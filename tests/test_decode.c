@@ -0,0 +1,148 @@
+/* The decoded instruction cache.
+ *
+ * The run loop decodes each word the first time it executes it and keeps the
+ * result with the page, so these tests are about making sure that a store over
+ * code that has already run is noticed, however the store gets there.
+ */
+#include "harness.h"
+#include "encode.h"
+
+#define PATCHED_ADDR (CODE_ADDR + 8)
+
+/* Run the instruction at PATCHED_ADDR once so that its decoded copy exists */
+static void warm(void)
+{
+    t_write(PATCHED_ADDR, MOV_IMM(0, 1));
+    t_run(PATCHED_ADDR, 1);
+    CHECK_REG(0, 1);
+    t_setreg(0, 0);
+}
+
+TEST(str_over_decoded_code_is_seen)
+{
+    warm();
+    t_setreg(1, MOV_IMM(0, 42));
+    t_setreg(2, PATCHED_ADDR);
+    t_write(CODE_ADDR, sdt(C_AL, 0, 1, 1, 0, 0, 0, 2, 1, 0));     /* str r1, [r2] */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(0, 42);
+}
+
+TEST(strb_over_decoded_code_is_seen)
+{
+    warm();
+    t_setreg(1, 99);
+    t_setreg(2, PATCHED_ADDR);                                     /* the imm8 byte */
+    t_write(CODE_ADDR, sdt(C_AL, 0, 1, 1, 1, 0, 0, 2, 1, 0));     /* strb r1, [r2] */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(0, 99);
+}
+
+TEST(stm_over_decoded_code_is_seen)
+{
+    warm();
+    t_setreg(3, MOV_IMM(0, 7));
+    t_setreg(4, MOV_IMM(0, 8));
+    t_setreg(2, PATCHED_ADDR);
+    t_write(CODE_ADDR, mdt(C_AL, 0, 1, 0, 0, 0, 2, (1 << 3) | (1 << 4)));  /* stmia r2, {r3, r4} */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(0, 7);
+    CHECK_MEM(PATCHED_ADDR + 4, MOV_IMM(0, 8));
+}
+
+TEST(swp_over_decoded_code_is_seen)
+{
+    warm();
+    t_setreg(1, MOV_IMM(0, 5));
+    t_setreg(2, PATCHED_ADDR);
+    t_write(CODE_ADDR, swp(C_AL, 0, 2, 3, 1));                     /* swp r3, r1, [r2] */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(0, 5);
+    CHECK_HEX("old instruction", t_getreg(3), MOV_IMM(0, 1));
+}
+
+/* A conditional store that doesn't happen mustn't throw anything away either,
+ * which we can't see directly, but the old instruction must still run */
+TEST(skipped_store_leaves_decoded_code_alone)
+{
+    warm();
+    t_setflags("nzcv");
+    t_setreg(1, MOV_IMM(0, 42));
+    t_setreg(2, PATCHED_ADDR);
+    t_write(CODE_ADDR, sdt(C_EQ, 0, 1, 1, 0, 0, 0, 2, 1, 0));     /* streq r1, [r2] */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(0, 1);
+}
+
+/* The rotated immediate is worked out once by the decoder */
+TEST(decoded_immediate_is_rotated)
+{
+    struct decoded_instruction op;
+
+    decode_instruction(&op, dp_imm(C_AL, OP_MOV, 0, 0, 0, 4, 0xab));   /* ror #8 */
+
+    CHECK_MSG(op.handler == alu_instruction, "should decode as a data processing instruction");
+    CHECK_HEX("imm", op.imm, 0xab000000);
+    CHECK_HEX("rd", op.rd, 0);
+}
+
+TEST(decoded_multiply_fields)
+{
+    struct decoded_instruction op;
+
+    decode_instruction(&op, mul(C_AL, 1, 0, 3, 4, 5, 6));          /* mla r3, r6, r5, r4 */
+
+    CHECK_MSG(op.handler == multiply_instruction, "should decode as a multiply");
+    CHECK_HEX("rd is in the rn slot", op.rn, 3);
+    CHECK_HEX("rn is in the rd slot", op.rd, 4);
+    CHECK_HEX("rs", op.rs, 5);
+    CHECK_HEX("rm", op.rm, 6);
+}
+
+/* Stores to plain RAM skip the page until something in it has been run, after
+ * which they have to see its decoded copy like any other store */
+TEST(str_over_code_run_from_a_data_page_is_seen)
+{
+    t_setreg(1, MOV_IMM(0, 42));
+    t_setreg(2, DATA_ADDR);
+    t_write(CODE_ADDR, sdt(C_AL, 0, 1, 1, 0, 0, 0, 2, 1, 0));     /* str r1, [r2] */
+    t_write(DATA_ADDR + 4, NOP);
+    t_run(CODE_ADDR, 1);
+
+    t_run(DATA_ADDR, 1);
+    CHECK_REG(0, 42);
+
+    t_setreg(1, MOV_IMM(0, 43));
+    t_run(CODE_ADDR, 1);
+    t_run(DATA_ADDR, 1);
+    CHECK_REG(0, 43);
+}
+
+/* A page that's given back and faulted in again starts out empty */
+TEST(released_page_comes_back_zeroed)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    t_unmap(DATA_ADDR);
+    t_setreg(1, DATA_ADDR);
+    t_write(CODE_ADDR, sdt(C_AL, 0, 1, 1, 0, 0, 1, 1, 0, 0));     /* ldr r0, [r1] */
+    t_setreg(0, 1);
+
+    t_run(CODE_ADDR, 1);
+
+    CHECK_REG(0, 0);
+}
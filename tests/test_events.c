@@ -0,0 +1,205 @@
+/* The virtual clock and the events devices schedule against it.
+ *
+ * The clock counts instructions, plus the ones skipped while waiting for an
+ * interrupt, so these check that events go off after exactly the right number
+ * of instructions whatever engine is running them, and that a waiting cpu
+ * jumps straight to the next one.
+ */
+#include "harness.h"
+#include "encode.h"
+#include "hw_manager.h"
+
+#define CP_HW_MANAGER 1
+
+static uint32_t fired;
+static uint64_t fired_at[8];
+static uint32_t r1_when_fired;
+
+static uint64_t record_event(void *extra, uint64_t cycles)
+{
+    if( fired < 8 ) {
+        fired_at[fired] = cycles;
+    }
+    fired++;
+    r1_when_fired = t_getreg(1);
+    return extra ? *(uint64_t*)extra : 0;
+}
+
+static uint64_t interrupt_event(void *extra, uint64_t cycles)
+{
+    (void)extra;
+    (void)cycles;
+    fired++;
+    interrupt(cpu, 1, 2);
+    return 0;
+}
+
+/* r1 goes up by one every instruction */
+static void write_counter(uint32_t n)
+{
+    t_setreg(1, 0);
+    for( uint32_t i = 0; i < n; i++ ) {
+        t_write(CODE_ADDR + i * 4, dp_imm(C_AL, OP_ADD, 0, 1, 1, 0, 1));     /* add r1, r1, #1 */
+    }
+}
+
+static void reset_events(void)
+{
+    fired = 0;
+    r1_when_fired = 0;
+}
+
+TEST(events_clock_counts_instructions)
+{
+    uint64_t start = cpu->cycles;
+
+    write_counter(10);
+    t_run(CODE_ADDR, 10);
+
+    CHECK_HEX("cycles", (uint32_t)(cpu->cycles - start), 10);
+}
+
+TEST(events_fire_after_their_delay)
+{
+    reset_events();
+    write_counter(10);
+    schedule_event(cpu, 4, record_event, NULL);
+
+    t_run(CODE_ADDR, 10);
+
+    CHECK_HEX("fired", fired, 1);
+    CHECK_HEX("r1 when fired", r1_when_fired, 4);
+    CHECK_REG(1, 10);
+    CHECK_MSG(NO_EVENT == cpu->next_event, "nothing should be left to run");
+}
+
+TEST(events_fire_in_deadline_order)
+{
+    uint64_t start = cpu->cycles;
+
+    reset_events();
+    write_counter(10);
+    schedule_event(cpu, 7, record_event, NULL);
+    schedule_event(cpu, 2, record_event, NULL);
+    schedule_event(cpu, 5, record_event, NULL);
+
+    t_run(CODE_ADDR, 10);
+
+    CHECK_HEX("fired", fired, 3);
+    CHECK_HEX("first", (uint32_t)(fired_at[0] - start), 2);
+    CHECK_HEX("second", (uint32_t)(fired_at[1] - start), 5);
+    CHECK_HEX("third", (uint32_t)(fired_at[2] - start), 7);
+}
+
+TEST(events_can_repeat)
+{
+    static uint64_t period = 3;
+    uint64_t start = cpu->cycles;
+
+    reset_events();
+    write_counter(10);
+    schedule_event(cpu, 3, record_event, &period);
+
+    t_run(CODE_ADDR, 10);
+
+    CHECK_HEX("fired", fired, 3);
+    CHECK_HEX("last", (uint32_t)(fired_at[2] - start), 9);
+    CHECK_HEX("next", (uint32_t)(cpu->next_event - start), 12);
+    cancel_events(cpu, record_event, &period);
+}
+
+TEST(events_can_be_cancelled)
+{
+    static uint64_t period = 3;
+    static uint64_t never = 0;
+    static const uint64_t delays[] = {1, 10, 2, 11, 12, 3, 4};
+    uint64_t start;
+
+    reset_events();
+    write_counter(10);
+    schedule_event(cpu, 2, record_event, &period);
+    schedule_event(cpu, 5, record_event, NULL);
+
+    cancel_events(cpu, record_event, &period);
+    t_run(CODE_ADDR, 10);
+
+    CHECK_HEX("fired", fired, 1);
+    CHECK_HEX("r1 when fired", r1_when_fired, 5);
+
+    /* Scheduled in this order the heap is [1,10,2,11,12,3,4], and taking out 11
+     * and 4 has to leave neither of them behind */
+    reset_events();
+    start = cpu->cycles;
+    for( uint32_t i = 0; i < sizeof(delays) / sizeof(delays[0]); i++ ) {
+        schedule_event(cpu, delays[i], record_event, (11 == delays[i] || 4 == delays[i]) ? &never : NULL);
+    }
+    cancel_events(cpu, record_event, &never);
+
+    CHECK_HEX("events left", cpu->num_events, 5);
+    for( uint32_t i = 0; i < cpu->num_events; i++ ) {
+        CHECK_MSG(cpu->events[i].extra != &never, "event %u with deadline %u wasn't cancelled", i,
+                  (uint32_t)(cpu->events[i].deadline - start));
+    }
+    write_counter(20);
+    t_run(CODE_ADDR, 20);
+
+    CHECK_HEX("fired", fired, 5);
+    CHECK_HEX("first", (uint32_t)(fired_at[0] - start), 1);
+    CHECK_HEX("third", (uint32_t)(fired_at[2] - start), 3);
+    CHECK_HEX("last", (uint32_t)(fired_at[4] - start), 12);
+}
+
+/* Nothing happens while the cpu waits, so the clock goes straight to the next
+ * event, whose interrupt wakes it up again */
+TEST(events_wake_a_waiting_cpu)
+{
+    uint64_t start = cpu->cycles;
+    enum armv2_status status;
+
+    reset_events();
+    t_setflags("if");
+    t_write(CODE_ADDR, cdp(C_AL, CP_HW_MANAGER, WAIT_FOR_INTERRUPT, 0, 0, 0, 0));
+    schedule_event(cpu, 1000, interrupt_event, NULL);
+
+    status = t_run(CODE_ADDR, 2000);
+
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_HEX("fired", fired, 1);
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+    CHECK_HEX("cycles", (uint32_t)(cpu->cycles - start), 2000);
+}
+
+/* With no event to come a waiting cpu gives up on the rest of the run, and
+ * the clock still counts it */
+TEST(events_waiting_without_any_skips_the_run)
+{
+    uint64_t start = cpu->cycles;
+    int32_t count = 100;
+    enum armv2_status status;
+
+    t_setflags("if");
+    t_write(CODE_ADDR, cdp(C_AL, CP_HW_MANAGER, WAIT_FOR_INTERRUPT, 0, 0, 0, 0));
+    cpu->pc = CODE_ADDR - 4;
+
+    status = run_armv2(cpu, &count);
+
+    CHECK_MSG(ARMV2STATUS_WAIT_FOR_INTERRUPT == status, "status is %d", status);
+    CHECK_HEX("left", count, 99);
+    CHECK_HEX("cycles", (uint32_t)(cpu->cycles - start), 100);
+}
+
+TEST(events_are_limited)
+{
+    enum armv2_status status = ARMV2STATUS_OK;
+
+    for( uint32_t i = 0; i < MAX_EVENTS; i++ ) {
+        status = schedule_event(cpu, 10 + i, record_event, NULL);
+    }
+    CHECK_MSG(ARMV2STATUS_OK == status, "filling the events should work");
+
+    status = schedule_event(cpu, 5, record_event, NULL);
+
+    CHECK_MSG(ARMV2STATUS_MEMORY_ERROR == status, "status is %d, expected ARMV2STATUS_MEMORY_ERROR", status);
+    cancel_events(cpu, record_event, NULL);
+    CHECK_HEX("events", cpu->num_events, 0);
+}
@@ -0,0 +1,113 @@
+/* Lazily evaluated condition flags.
+ *
+ * A flag setting instruction only records what it did and the flags are
+ * worked out when something looks at them. The other tests only check the
+ * flags from outside once a run has finished, so these are about the readers
+ * in between: the next instruction's condition, anything that needs the carry,
+ * exception entry and writes of the whole psr.
+ */
+#include "harness.h"
+#include "encode.h"
+
+TEST(adc_sees_the_carry_from_adds)
+{
+    t_setreg(1, 0xffffffff);
+    t_setreg(3, 0);
+    t_write(CODE_ADDR,     dp_imm(C_AL, OP_ADD, 1, 1, 0, 0, 1));              /* adds r0, r1, #1 */
+    t_write(CODE_ADDR + 4, dp_imm(C_AL, OP_ADC, 0, 3, 2, 0, 0));              /* adc r2, r3, #0 */
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_REG(0, 0);
+    CHECK_REG(2, 1);
+    CHECK_FLAGS("nZCv");
+}
+
+TEST(conditions_that_need_every_flag_after_cmp)
+{
+    t_setreg(0, 5);
+    t_write(CODE_ADDR,     dp_imm(C_AL, OP_CMP, 1, 0, 0, 0, 3));              /* cmp r0, #3 */
+    t_write(CODE_ADDR + 4, dp_imm(C_HI, OP_MOV, 0, 0, 1, 0, 1));              /* movhi r1, #1 */
+    t_write(CODE_ADDR + 8, dp_imm(C_LE, OP_MOV, 0, 0, 2, 0, 1));              /* movle r2, #1 */
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(1, 1);
+    CHECK_REG(2, 0);
+    CHECK_FLAGS("nzCv");
+}
+
+TEST(zero_and_negative_after_subs)
+{
+    t_setreg(0, 1);
+    t_write(CODE_ADDR,      dp_imm(C_AL, OP_SUB, 1, 0, 0, 0, 1));             /* subs r0, r0, #1 */
+    t_write(CODE_ADDR + 4,  dp_imm(C_EQ, OP_MOV, 0, 0, 1, 0, 1));             /* moveq r1, #1 */
+    t_write(CODE_ADDR + 8,  dp_imm(C_AL, OP_SUB, 1, 0, 0, 0, 1));             /* subs r0, r0, #1 */
+    t_write(CODE_ADDR + 12, dp_imm(C_MI, OP_MOV, 0, 0, 2, 0, 1));             /* movmi r2, #1 */
+    t_write(CODE_ADDR + 16, dp_imm(C_NE, OP_MOV, 0, 0, 3, 0, 1));             /* movne r3, #1 */
+
+    t_run(CODE_ADDR, 5);
+
+    CHECK_REG(1, 1);
+    CHECK_REG(2, 1);
+    CHECK_REG(3, 1);
+    CHECK_FLAGS("Nzcv");
+}
+
+/* A logical op takes C from the shifter but leaves V as it was */
+TEST(logical_op_carry_is_seen_by_the_next_instruction)
+{
+    t_setflags("nzcV");
+    t_setreg(1, 1);
+    t_write(CODE_ADDR,     dp_reg(C_AL, OP_MOV, 1, 0, 0, 1, SH_LSR, 1));      /* movs r0, r1, lsr #1 */
+    t_write(CODE_ADDR + 4, dp_imm(C_CS, OP_MOV, 0, 0, 2, 0, 1));              /* movcs r2, #1 */
+    t_write(CODE_ADDR + 8, dp_imm(C_VS, OP_MOV, 0, 0, 3, 0, 1));              /* movvs r3, #1 */
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(2, 1);
+    CHECK_REG(3, 1);
+    CHECK_FLAGS("nZCV");
+}
+
+TEST(swi_saves_flags_from_the_instruction_before)
+{
+    t_setreg(1, 0x7fffffff);
+    t_write(CODE_ADDR,     dp_imm(C_AL, OP_ADD, 1, 1, 0, 0, 1));              /* adds r0, r1, #1 */
+    t_write(CODE_ADDR + 4, swi(C_AL, 0));
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_HEX("supervisor r14", t_getactual(LR_S),
+              (CODE_ADDR + 12) | FLAG_N | FLAG_V | FLAG_I | MODE_SUP);
+}
+
+TEST(irq_saves_flags_from_the_instruction_before)
+{
+    t_setflags("i");
+    t_setreg(0, 3);
+    t_write(CODE_ADDR,     dp_imm(C_AL, OP_CMP, 1, 0, 0, 0, 3));              /* cmp r0, #3 */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 1);
+    interrupt(cpu, 1, 2);
+    t_run(CODE_ADDR + 4, 1);
+
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+    CHECK_HEX("irq r14", t_getactual(LR_I) & 0xfc000000, FLAG_Z | FLAG_C);
+}
+
+/* Writing the whole psr throws away whatever was pending */
+TEST(movs_pc_replaces_pending_flags)
+{
+    t_setreg(0, 0);
+    t_setreg(1, (CODE_ADDR + 0x40) | FLAG_N | MODE_SUP);
+    t_write(CODE_ADDR,     dp_imm(C_AL, OP_CMP, 1, 0, 0, 0, 0));              /* cmp r0, #0 */
+    t_write(CODE_ADDR + 4, MOVS_PC(1));
+    t_write(CODE_ADDR + 0x40, dp_imm(C_EQ, OP_MOV, 0, 0, 2, 0, 1));           /* moveq r2, #1 */
+
+    t_run(CODE_ADDR, 3);
+
+    CHECK_REG(2, 0);
+    CHECK_FLAGS("Nzcv");
+}
@@ -252,3 +252,115 @@ TEST(mapping_over_an_existing_page_is_refused)
     CHECK_HEX("word writes", (uint32_t)state.word_writes, 0);
     CHECK_MEM(HW_ADDR, 0x12345678);
 }
+
+/* read_block asks the device for each word once and picks the bytes out */
+TEST(device_read_block_reads_each_word_once)
+{
+    uint8_t buf[6];
+
+    attach_device();
+
+    CHECK_MSG(ARMV2STATUS_OK == read_block(cpu, HW_ADDR + 2, sizeof(buf), buf), "read_block failed");
+
+    CHECK_HEX("word reads", (uint32_t)state.word_reads, 2);
+    CHECK_HEX("byte reads", (uint32_t)state.byte_reads, 0);
+    CHECK_HEX("first byte", buf[0], 0x00);
+    CHECK_HEX("byte from the second word", buf[2], 0x04);
+    CHECK_HEX("last byte", buf[5], 0xd0);
+}
+
+/* A partial word is read first so the bytes around it are written back as they were */
+TEST(device_write_block_keeps_the_rest_of_a_partial_word)
+{
+    const uint8_t buf[5] = {0x11, 0x22, 0x33, 0x44, 0x55};
+
+    attach_device();
+
+    CHECK_MSG(ARMV2STATUS_OK == write_block(cpu, HW_ADDR + 4, sizeof(buf), buf), "write_block failed");
+
+    CHECK_HEX("word writes", (uint32_t)state.word_writes, 2);
+    CHECK_HEX("word reads", (uint32_t)state.word_reads, 1);
+    CHECK_HEX("offset", state.last_offset, 8);
+    CHECK_HEX("value", state.last_value, 0xd0000055);
+}
+
+static uint32_t device_memory[HW_PAGES * WORDS_PER_PAGE];
+static uint64_t device_dirty[HW_PAGES];
+
+/* Give the device memory of its own for the first page, the second page stays on the callbacks */
+static void attach_device_with_memory(void)
+{
+    make_device();
+    memset(device_memory, 0, sizeof(device_memory));
+    memset(device_dirty, 0, sizeof(device_dirty));
+    device.memory    = device_memory;
+    device.dirty     = device_dirty;
+    device.ram_pages = 1;
+    CHECK_MSG(ARMV2STATUS_OK == map_memory(cpu, 0, HW_ADDR, HW_END), "could not map the device");
+}
+
+TEST(device_memory_is_used_like_ram)
+{
+    attach_device_with_memory();
+    device_memory[3] = 0xcafef00d;
+    t_setreg(0, 0x12345678);
+    t_setreg(1, HW_ADDR);
+
+    t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 0, 1, 0, 0x100));   /* str r0, [r1, #0x100] */
+    t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 1, 1, 2, 12));      /* ldr r2, [r1, #12] */
+
+    CHECK_HEX("stored", device_memory[0x40], 0x12345678);
+    CHECK_REG(2, 0xcafef00d);
+    CHECK_HEX("word reads", (uint32_t)state.word_reads, 0);
+    CHECK_HEX("word writes", (uint32_t)state.word_writes, 0);
+}
+
+TEST(device_memory_stores_mark_their_lines_dirty)
+{
+    attach_device_with_memory();
+    t_setreg(0, 0x12);
+    t_setreg(1, HW_ADDR);
+
+    t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 0, 1, 0, 0x100));   /* str r0, [r1, #0x100] */
+    t_exec(sdt(C_AL, 0, 1, 1, 1, 0, 0, 1, 0, 0xfff));   /* strb r0, [r1, #0xfff] */
+
+    CHECK_HEX("dirty low", (uint32_t)device_dirty[0], 1u << (0x100 / DIRTY_LINE_SIZE));
+    CHECK_HEX("dirty high", (uint32_t)(device_dirty[0] >> 32), 0x80000000u);
+    CHECK_HEX("byte", device_memory[0x3ff] >> 24, 0x12);
+    CHECK_HEX("other page", (uint32_t)device_dirty[1], 0);
+}
+
+TEST(device_memory_write_block_marks_lines_dirty)
+{
+    const uint8_t buf[0x48] = {0};
+
+    attach_device_with_memory();
+
+    CHECK_MSG(ARMV2STATUS_OK == write_block(cpu, HW_ADDR + 0x3c, sizeof(buf), buf), "write_block failed");
+
+    CHECK_HEX("dirty", (uint32_t)device_dirty[0], 0x7);
+}
+
+TEST(device_pages_without_memory_still_call_the_device)
+{
+    attach_device_with_memory();
+    t_setreg(0, 0x12345678);
+    t_setreg(1, HW_ADDR + PAGE_SIZE);
+
+    t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 0, 1, 0, 8));       /* str r0, [r1, #8] */
+
+    CHECK_HEX("word writes", (uint32_t)state.word_writes, 1);
+    CHECK_HEX("offset", state.last_offset, PAGE_SIZE + 8);
+    CHECK_HEX("dirty", (uint32_t)device_dirty[1], 0);
+}
+
+/* Releasing a page of device memory leaves the memory to the device */
+TEST(device_memory_release_keeps_the_memory)
+{
+    attach_device_with_memory();
+    device_memory[0] = 0x55;
+
+    release_page(cpu, HW_ADDR);
+
+    CHECK_HEX("memory", device_memory[0], 0x55);
+}
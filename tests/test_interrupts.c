@@ -4,6 +4,8 @@
  * these tests arm a pin and then run: the instruction sitting at the pc must
  * not execute, and the cpu must end up at the vector in the right mode.
  */
+#include <pthread.h>
+
 #include "harness.h"
 #include "encode.h"
 
@@ -174,17 +176,108 @@ TEST(interrupt_data_is_readable_from_the_handler)
     CHECK_REG(1, 9);                         /* and its code */
 }
 
-/* A second interrupt while one is being handled is dropped rather than queued */
-TEST(interrupts_are_dropped_while_masked)
+/* A second interrupt while one is being handled waits for the first to finish */
+TEST(interrupts_are_queued_while_masked)
 {
     t_setflags("nzcvi");
     t_write(CODE_ADDR, NOP);
     interrupt(cpu, 7, 9);
     t_run(CODE_ADDR, 1);                     /* now in irq mode with irqs masked */
 
-    interrupt(cpu, 3, 4);                    /* this one goes nowhere */
+    interrupt(cpu, 3, 4);
 
-    CHECK_MSG(!PIN_ON(cpu, I), "a masked interrupt must not leave the pin asserted");
+    CHECK_MSG(PIN_ON(cpu, I), "the queued interrupt should keep the pin asserted");
     CHECK_HEX("last interrupt id", cpu->hardware_manager.last_interrupt_id, 7);
     CHECK_HEX("last interrupt code", cpu->hardware_manager.last_interrupt_code, 9);
 }
+
+/* Returning from the handler takes the next one straight away, in the order
+ * they were posted */
+TEST(queued_interrupts_are_taken_in_order)
+{
+    t_setflags("nzcvi");
+    t_write(CODE_ADDR, NOP);
+    /* subs pc, lr, #4 at the irq vector */
+    t_write(g_vector_table[EXCEPT_IRQ], dp_imm(C_AL, OP_SUB, 1, R_LR, R_PC, 0, 4));
+    interrupt(cpu, 7, 9);
+    interrupt(cpu, 3, 4);
+
+    t_run(CODE_ADDR, 1);
+    CHECK_HEX("first id", cpu->hardware_manager.last_interrupt_id, 7);
+
+    t_run(g_vector_table[EXCEPT_IRQ], 2);    /* return, then straight back in */
+
+    CHECK_PC(g_vector_table[EXCEPT_IRQ]);
+    CHECK_HEX("second id", cpu->hardware_manager.last_interrupt_id, 3);
+    CHECK_HEX("second code", cpu->hardware_manager.last_interrupt_code, 4);
+    CHECK_MSG(!PIN_ON(cpu, I), "the pin should be clear once the queue is empty");
+}
+
+/* The same interrupt twice before the first is taken is only taken once */
+TEST(repeated_interrupts_are_coalesced)
+{
+    t_setflags("nzcvI");
+    interrupt(cpu, 7, 9);
+    interrupt(cpu, 7, 9);
+    interrupt(cpu, 7, 1);
+
+    CHECK_HEX("queued", cpu->interrupts.tail - cpu->interrupts.head, 2);
+}
+
+TEST(interrupt_queue_is_bounded)
+{
+    enum armv2_status status = ARMV2STATUS_OK;
+
+    t_setflags("nzcvI");
+    for( uint32_t i = 0; i < INTERRUPT_QUEUE_SIZE; i++ ) {
+        status = interrupt(cpu, 1, i);
+    }
+    CHECK_MSG(ARMV2STATUS_OK == status, "filling the queue should work");
+
+    status = interrupt(cpu, 2, 0);
+
+    CHECK_MSG(ARMV2STATUS_MEMORY_ERROR == status, "status is %d, expected ARMV2STATUS_MEMORY_ERROR", status);
+}
+
+#define POSTERS 4
+
+static void *post_interrupts(void *arg)
+{
+    uint32_t id = (uint32_t)(uintptr_t)arg;
+
+    for( uint32_t i = 0; i < INTERRUPT_QUEUE_SIZE / POSTERS; i++ ) {
+        interrupt(cpu, id, i);
+    }
+    return NULL;
+}
+
+/* Posting takes no lock, so several threads at once must each get their own
+ * entries */
+TEST(interrupts_can_be_posted_from_other_threads)
+{
+    pthread_t threads[POSTERS];
+    uint32_t seen[POSTERS] = {0};
+
+    t_setflags("nzcvI");
+    for( uint32_t i = 0; i < POSTERS; i++ ) {
+        pthread_create(threads + i, NULL, post_interrupts, (void*)(uintptr_t)i);
+    }
+    for( uint32_t i = 0; i < POSTERS; i++ ) {
+        pthread_join(threads[i], NULL);
+    }
+
+    CHECK_HEX("queued", cpu->interrupts.tail - cpu->interrupts.head, INTERRUPT_QUEUE_SIZE);
+    for( uint32_t i = 0; i < INTERRUPT_QUEUE_SIZE; i++ ) {
+        struct interrupt_entry *entry = cpu->interrupts.entries + i;
+
+        CHECK_HEX("sequence", entry->sequence, i + 1);
+        if( entry->id < POSTERS ) {
+            seen[entry->id] |= 1u << entry->code;
+        }
+    }
+    for( uint32_t i = 0; i < POSTERS; i++ ) {
+        t_context("thread %u", i);
+        CHECK_HEX("codes", seen[i], (1u << (INTERRUPT_QUEUE_SIZE / POSTERS)) - 1);
+    }
+    t_clear_context();
+}
@@ -0,0 +1,121 @@
+/* The x86-64 code generator.
+ *
+ * "run_tests --jit" already puts every other test through it with blocks
+ * compiled the first time they run. These check the parts that are its own:
+ * when a block gets compiled, how much of it, and that stopping part way
+ * through a compiled run still leaves the cpu where the interpreter would.
+ */
+#include "harness.h"
+#include "encode.h"
+
+static struct block *block_at(uint32_t addr)
+{
+    struct page_info *page = cpu->page_tables[PAGEOF(addr)];
+
+    if( NULL == page || NULL == page->blocks ) {
+        return NULL;
+    }
+    return page->blocks[WORDINPAGE(addr)];
+}
+
+/* r0 counts down from 10, r1 counts up by 3 and r2 picks up r1 shifted */
+static void write_loop(void)
+{
+    t_write(CODE_ADDR,      MOV_IMM(0, 10));
+    t_write(CODE_ADDR + 4,  dp_imm(C_AL, OP_ADD, 0, 1, 1, 0, 3));              /* add r1, r1, #3 */
+    t_write(CODE_ADDR + 8,  dp_reg(C_AL, OP_ORR, 0, 2, 2, 1, SH_LSL, 4));     /* orr r2, r2, r1, lsl #4 */
+    t_write(CODE_ADDR + 12, dp_imm(C_AL, OP_SUB, 1, 0, 0, 0, 1));              /* subs r0, r0, #1 */
+    t_write(CODE_ADDR + 16, branch(C_NE, 0, CODE_ADDR + 16, CODE_ADDR + 4));
+}
+
+TEST(jit_compiles_hot_blocks_only)
+{
+    struct block *block;
+
+    set_exec_mode(cpu, EXEC_JIT);
+    cpu->jit_threshold = 5;
+    write_loop();
+    t_setreg(0, 10);
+
+    t_run(CODE_ADDR + 4, 4 * 4);
+    block = block_at(CODE_ADDR + 4);
+    CHECK_MSG(NULL != block && NULL == block->jit, "the loop shouldn't be compiled after 4 trips");
+
+    t_run(CODE_ADDR + 4, 4);
+    block = block_at(CODE_ADDR + 4);
+    CHECK_MSG(NULL != block && NULL != block->jit, "the loop should be compiled after 5 trips");
+    if( NULL != block ) {
+        /* everything up to the branch */
+        CHECK_HEX("jit length", block->jit_length, 3);
+    }
+}
+
+TEST(jit_loop_matches_the_interpreter)
+{
+    uint32_t r1 = 0, r2 = 0;
+
+    for( int i = 0; i < 10; i++ ) {
+        r1 += 3;
+        r2 |= r1 << 4;
+    }
+    set_exec_mode(cpu, EXEC_JIT);
+    cpu->jit_threshold = 2;
+    write_loop();
+
+    t_run(CODE_ADDR, 1 + 10 * 4);
+
+    CHECK_REG(0, 0);
+    CHECK_REG(1, r1);
+    CHECK_REG(2, r2);
+    CHECK_FLAGS("nZCv");
+    CHECK_PC(CODE_ADDR + 20);
+}
+
+/* With fewer instructions left than the compiled run, the block is done by
+ * the interpreter one instruction at a time */
+TEST(jit_respects_the_instruction_count)
+{
+    set_exec_mode(cpu, EXEC_JIT);
+    write_loop();
+    t_run(CODE_ADDR, 1 + 10 * 4);
+    t_setreg(0, 10);
+    t_setreg(1, 0);
+    t_setreg(2, 0);
+
+    t_run(CODE_ADDR + 4, 2);
+
+    CHECK_REG(0, 10);
+    CHECK_REG(1, 3);
+    CHECK_REG(2, 3 << 4);
+    CHECK_PC(CODE_ADDR + 12);
+}
+
+/* A logical op with a shift sets C from the shifter and leaves V alone */
+TEST(jit_logical_shift_carry)
+{
+    set_exec_mode(cpu, EXEC_JIT);
+    t_setflags("nzcV");
+    t_setreg(1, 0x80000001);
+    t_write(CODE_ADDR, dp_reg(C_AL, OP_MOV, 1, 0, 0, 1, SH_LSR, 1));          /* movs r0, r1, lsr #1 */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_MSG(NULL != block_at(CODE_ADDR) && NULL != block_at(CODE_ADDR)->jit, "the block should be compiled");
+    CHECK_REG(0, 0x40000000);
+    CHECK_FLAGS("nzCV");
+}
+
+TEST(jit_banked_registers_follow_the_mode)
+{
+    set_exec_mode(cpu, EXEC_JIT);
+    t_setactual(R13_S, 100);
+    t_setactual(R_SP, 200);
+    t_write(CODE_ADDR, dp_imm(C_AL, OP_ADD, 0, R_SP, R_SP, 0, 1));             /* add sp, sp, #1 */
+    t_write(CODE_ADDR + 4, NOP);
+
+    t_run(CODE_ADDR, 2);
+
+    CHECK_HEX("supervisor r13", t_getactual(R13_S), 101);
+    CHECK_HEX("user r13", t_getactual(R_SP), 200);
+}
@@ -357,3 +357,45 @@ TEST(ldmstm_unaligned_base_aborts)
     CHECK_HEX("exception vector", t_nextpc(), g_vector_table[EXCEPT_DATA_ABORT]);
     CHECK_REG(0, 0xdeadbeef);
 }
+
+/* A transfer that stays inside one page of RAM is copied in one go, so these
+ * check the cases that have to be done a register at a time */
+TEST(ldm_across_a_page_boundary)
+{
+    t_write(DATA_ADDR + PAGE_SIZE - 4, 0x11111111);
+    t_write(DATA_ADDR + PAGE_SIZE, 0x22222222);
+    t_setreg(1, DATA_ADDR + PAGE_SIZE - 4);
+
+    /* ldmia r1, {r2, r3} */
+    t_exec(mdt(C_AL, 0, 1, 0, 0, 1, 1, REG(2) | REG(3)));
+
+    CHECK_REG(2, 0x11111111);
+    CHECK_REG(3, 0x22222222);
+}
+
+TEST(stm_watchpoint_on_a_later_word)
+{
+    t_setreg(1, DATA_ADDR);
+    t_setreg(4, 0x44444444);
+    set_watchpoint(cpu, WRITE_WATCHPOINT, DATA_ADDR + 8);
+
+    /* stmia r1, {r2, r3, r4} */
+    enum armv2_status status = t_exec(mdt(C_AL, 0, 1, 0, 0, 0, 1, REG(2) | REG(3) | REG(4)));
+
+    CHECK_MSG(ARMV2STATUS_BREAKPOINT == status, "status is %d, expected ARMV2STATUS_BREAKPOINT (%d)",
+              status, ARMV2STATUS_BREAKPOINT);
+    CHECK_MEM(DATA_ADDR + 8, 0x44444444);
+}
+
+/* The watchpoint bits for these words are split over two entries in the mask */
+TEST(ldm_watchpoint_past_a_watchpoint_mask_boundary)
+{
+    t_setreg(1, DATA_ADDR + 0xf8);
+    set_watchpoint(cpu, READ_WATCHPOINT, DATA_ADDR + 0x100);
+
+    /* ldmia r1, {r2, r3, r4} */
+    enum armv2_status status = t_exec(mdt(C_AL, 0, 1, 0, 0, 1, 1, REG(2) | REG(3) | REG(4)));
+
+    CHECK_MSG(ARMV2STATUS_BREAKPOINT == status, "status is %d, expected ARMV2STATUS_BREAKPOINT (%d)",
+              status, ARMV2STATUS_BREAKPOINT);
+}
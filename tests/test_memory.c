@@ -0,0 +1,103 @@
+/* Copying blocks of guest memory in and out from outside the cpu.
+ *
+ * This is how the debugger and the tape loader get at memory, so the tests
+ * are about what they need: copies that cross pages, unmapped memory, and
+ * code that gets written over after it has been run.
+ */
+#include <string.h>
+
+#include "harness.h"
+#include "encode.h"
+
+TEST(read_block_across_pages)
+{
+    uint8_t buf[8];
+
+    t_write(DATA_ADDR + PAGE_SIZE - 4, 0x44332211);
+    t_write(DATA_ADDR + PAGE_SIZE,     0x88776655);
+
+    CHECK_MSG(ARMV2STATUS_OK == read_block(cpu, DATA_ADDR + PAGE_SIZE - 4, sizeof(buf), buf), "read_block failed");
+
+    for( uint32_t i = 0; i < sizeof(buf); i++ ) {
+        t_context("byte %u", i);
+        CHECK_HEX("value", buf[i], 0x11 * (i + 1));
+    }
+}
+
+TEST(read_block_unmapped_memory_is_zero)
+{
+    uint8_t buf[4];
+
+    memset(buf, 0xff, sizeof(buf));
+
+    CHECK_MSG(ARMV2STATUS_OK == read_block(cpu, 0x00100000, sizeof(buf), buf), "read_block failed");
+
+    CHECK_HEX("value", buf[0] | (buf[1] << 8) | (buf[2] << 16) | ((uint32_t)buf[3] << 24), 0);
+}
+
+TEST(read_block_past_the_end_is_refused)
+{
+    uint8_t buf[8];
+
+    CHECK_MSG(ARMV2STATUS_INVALID_ARGS == read_block(cpu, MAX_MEMORY - 4, sizeof(buf), buf),
+              "a read off the end of memory should be refused");
+}
+
+TEST(write_block_unaligned)
+{
+    const uint8_t buf[3] = {0xaa, 0xbb, 0xcc};
+
+    t_write(DATA_ADDR, 0x11111111);
+
+    CHECK_MSG(ARMV2STATUS_OK == write_block(cpu, DATA_ADDR + 1, sizeof(buf), buf), "write_block failed");
+
+    CHECK_MEM(DATA_ADDR, 0xccbbaa11);
+}
+
+/* Nothing is written unless every page is there, or can be faulted in */
+TEST(write_block_to_unmapped_memory_writes_nothing)
+{
+    uint8_t buf[8];
+
+    memset(buf, 0x5a, sizeof(buf));
+    t_write(DATA_ADDR + PAGE_SIZE - 4, 0);
+    t_unmap(DATA_ADDR + PAGE_SIZE);
+    cpu->free_ram = 0;
+
+    CHECK_MSG(ARMV2STATUS_INVALID_PAGE == write_block(cpu, DATA_ADDR + PAGE_SIZE - 4, sizeof(buf), buf),
+              "writing to an unmapped page should fail");
+    CHECK_MEM(DATA_ADDR + PAGE_SIZE - 4, 0);
+    CHECK_MSG(NULL == cpu->page_tables[PAGEOF(DATA_ADDR + PAGE_SIZE)], "the page shouldn't have been mapped");
+}
+
+/* RAM nothing has touched yet is faulted in, the same as when the cpu stores to it */
+TEST(write_block_faults_in_untouched_memory)
+{
+    const uint8_t buf[8] = {0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77, 0x88};
+
+    t_write(DATA_ADDR + PAGE_SIZE - 4, 0);
+    t_unmap(DATA_ADDR + PAGE_SIZE);
+
+    CHECK_MSG(ARMV2STATUS_OK == write_block(cpu, DATA_ADDR + PAGE_SIZE - 4, sizeof(buf), buf),
+              "write_block failed");
+    CHECK_MEM(DATA_ADDR + PAGE_SIZE - 4, 0x44332211);
+    CHECK_MEM(DATA_ADDR + PAGE_SIZE, 0x88776655);
+}
+
+/* Code written over from outside has to be decoded again */
+TEST(write_block_over_code_that_has_run)
+{
+    uint32_t mov = MOV_IMM(0, 2);
+    uint8_t buf[4];
+
+    t_write(CODE_ADDR, MOV_IMM(0, 1));
+    t_run(CODE_ADDR, 1);
+    CHECK_REG(0, 1);
+
+    memcpy(buf, &mov, sizeof(buf));
+    /* page 0 is read only to the cpu, but not to us */
+    CHECK_MSG(ARMV2STATUS_OK == write_block(cpu, CODE_ADDR, sizeof(buf), buf), "write_block failed");
+    t_run(CODE_ADDR, 1);
+
+    CHECK_REG(0, 2);
+}
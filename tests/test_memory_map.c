@@ -0,0 +1,107 @@
+/* The list of mapped regions the core keeps up to date for the debugger.
+ *
+ * Pages come and go one at a time, so these fault pages in and release them
+ * in different orders and check the runs are joined up and split again as
+ * they should be, and that every change moves the generation on.
+ */
+#include <string.h>
+
+#include "harness.h"
+#include "encode.h"
+
+#define MAP_ADDR 0x00800000u
+
+/* The region that addr is in, or NULL */
+static struct region *region_at(uint32_t addr)
+{
+    for( uint32_t i = 0; i < cpu->num_mapped_regions; i++ ) {
+        if( cpu->mapped_regions[i].start <= addr && addr < cpu->mapped_regions[i].end ) {
+            return cpu->mapped_regions + i;
+        }
+    }
+    return NULL;
+}
+
+static void check_region(uint32_t addr, uint32_t start, uint32_t end)
+{
+    struct region *region = region_at(addr);
+
+    CHECK_MSG(NULL != region, "0x%08x should be mapped", addr);
+    if( NULL == region ) {
+        return;
+    }
+    CHECK_HEX("start", region->start, start);
+    CHECK_HEX("end", region->end, end);
+}
+
+TEST(memory_map_regions_are_sorted_and_apart)
+{
+    t_fault(MAP_ADDR);
+    t_fault(MAP_ADDR + 4 * PAGE_SIZE);
+
+    for( uint32_t i = 1; i < cpu->num_mapped_regions; i++ ) {
+        t_context("region %u", i);
+        CHECK_MSG(cpu->mapped_regions[i - 1].end < cpu->mapped_regions[i].start,
+                  "regions should be in order with gaps between them");
+    }
+}
+
+TEST(memory_map_page_between_two_regions_joins_them)
+{
+    uint32_t generation;
+
+    t_fault(MAP_ADDR);
+    t_fault(MAP_ADDR + 2 * PAGE_SIZE);
+    check_region(MAP_ADDR, MAP_ADDR, MAP_ADDR + PAGE_SIZE);
+    generation = cpu->map_generation;
+
+    t_fault(MAP_ADDR + PAGE_SIZE);
+
+    check_region(MAP_ADDR, MAP_ADDR, MAP_ADDR + 3 * PAGE_SIZE);
+    CHECK_HEX("generation", cpu->map_generation, generation + 1);
+}
+
+TEST(memory_map_page_before_a_region_grows_it)
+{
+    t_fault(MAP_ADDR + PAGE_SIZE);
+
+    t_fault(MAP_ADDR);
+
+    check_region(MAP_ADDR + PAGE_SIZE, MAP_ADDR, MAP_ADDR + 2 * PAGE_SIZE);
+}
+
+TEST(memory_map_releasing_a_middle_page_splits_the_region)
+{
+    uint32_t generation;
+
+    for( uint32_t i = 0; i < 3; i++ ) {
+        t_fault(MAP_ADDR + i * PAGE_SIZE);
+    }
+    generation = cpu->map_generation;
+
+    release_page(cpu, MAP_ADDR + PAGE_SIZE);
+
+    check_region(MAP_ADDR, MAP_ADDR, MAP_ADDR + PAGE_SIZE);
+    check_region(MAP_ADDR + 2 * PAGE_SIZE, MAP_ADDR + 2 * PAGE_SIZE, MAP_ADDR + 3 * PAGE_SIZE);
+    CHECK_MSG(NULL == region_at(MAP_ADDR + PAGE_SIZE), "the released page should be gone");
+    CHECK_HEX("generation", cpu->map_generation, generation + 1);
+
+    release_page(cpu, MAP_ADDR);
+    release_page(cpu, MAP_ADDR + 2 * PAGE_SIZE);
+
+    CHECK_MSG(NULL == region_at(MAP_ADDR + 2 * PAGE_SIZE), "the last page should be gone");
+}
+
+TEST(memory_map_includes_devices)
+{
+    static struct hardware_device device;
+
+    memset(&device, 0, sizeof(device));
+    add_hardware(cpu, &device);
+    t_fault(MAP_ADDR);
+
+    CHECK_MSG(ARMV2STATUS_OK == map_memory(cpu, 0, MAP_ADDR + PAGE_SIZE, MAP_ADDR + 3 * PAGE_SIZE),
+              "could not map the device");
+
+    check_region(MAP_ADDR, MAP_ADDR, MAP_ADDR + 3 * PAGE_SIZE);
+}
@@ -0,0 +1,135 @@
+/* Running several cpus at once on a pool of threads.
+ *
+ * Each test sets up a few cpus of its own alongside the one under test, gives
+ * them all something different to do and checks that each one ended up where
+ * it would have if it had been run by itself.
+ */
+#include "harness.h"
+#include "encode.h"
+
+#define NUM_CPUS 4
+
+static struct armv2 others[NUM_CPUS - 1];
+
+/* r1 = n + (n - 1) + ... + 1, then r2 = 99 */
+static void write_sum(uint32_t n)
+{
+    t_setreg(0, 0);
+    t_setreg(1, 0);
+    t_write(CODE_ADDR,      MOV_IMM(0, n));
+    t_write(CODE_ADDR + 4,  dp_reg(C_AL, OP_ADD, 0, 1, 1, 0, SH_LSL, 0));     /* add r1, r1, r0 */
+    t_write(CODE_ADDR + 8,  dp_imm(C_AL, OP_SUB, 1, 0, 0, 0, 1));              /* subs r0, r0, #1 */
+    t_write(CODE_ADDR + 12, branch(C_NE, 0, CODE_ADDR + 12, CODE_ADDR + 4));
+    t_write(CODE_ADDR + 16, MOV_IMM(2, 99));
+    cpu->pc = CODE_ADDR - 4;
+}
+
+/* Give every cpu a sum of its own, the cpu under test gets the first */
+static void setup_jobs(struct pool_job *jobs)
+{
+    for( int i = 0; i < NUM_CPUS; i++ ) {
+        struct armv2 *which = i ? &others[i - 1] : NULL;
+
+        t_use(which);
+        if( which ) {
+            t_reset();
+        }
+        write_sum(10 + i * 5);
+        jobs[i].cpu          = cpu;
+        jobs[i].instructions = 1 + (10 + i * 5) * 3 + 1;
+        jobs[i].status       = ARMV2STATUS_MAX_HW;
+    }
+    t_use(NULL);
+}
+
+static void check_sums(struct pool_job *jobs)
+{
+    for( int i = 0; i < NUM_CPUS; i++ ) {
+        uint32_t n = 10 + i * 5;
+
+        t_context("cpu %d", i);
+        t_use(jobs[i].cpu);
+        CHECK_MSG(ARMV2STATUS_OK == jobs[i].status, "status is %d, expected ARMV2STATUS_OK", jobs[i].status);
+        CHECK_HEX("instructions left", jobs[i].instructions, 0);
+        CHECK_REG(1, n * (n + 1) / 2);
+        CHECK_REG(2, 99);
+    }
+    t_clear_context();
+    t_use(NULL);
+}
+
+static void release_others(void)
+{
+    for( int i = 0; i < NUM_CPUS - 1; i++ ) {
+        t_release(&others[i]);
+    }
+}
+
+TEST(pool_runs_every_cpu)
+{
+    struct armv2_pool pool;
+    struct pool_job jobs[NUM_CPUS];
+
+    CHECK_MSG(ARMV2STATUS_OK == pool_init(&pool, 2), "pool_init failed");
+    setup_jobs(jobs);
+
+    CHECK_MSG(ARMV2STATUS_OK == pool_run(&pool, jobs, NUM_CPUS), "pool_run failed");
+
+    check_sums(jobs);
+    pool_cleanup(&pool);
+    release_others();
+}
+
+TEST(pool_can_be_run_again)
+{
+    struct armv2_pool pool;
+    struct pool_job jobs[NUM_CPUS];
+
+    pool_init(&pool, 3);
+    setup_jobs(jobs);
+    pool_run(&pool, jobs, NUM_CPUS);
+    setup_jobs(jobs);
+
+    pool_run(&pool, jobs, NUM_CPUS);
+
+    check_sums(jobs);
+    pool_cleanup(&pool);
+    release_others();
+}
+
+/* One cpu stopping doesn't hold up or stop the others */
+TEST(pool_cpu_stopping_early)
+{
+    struct armv2_pool pool;
+    struct pool_job jobs[NUM_CPUS];
+
+    pool_init(&pool, 2);
+    setup_jobs(jobs);
+    t_use(jobs[1].cpu);
+    set_breakpoint(cpu, CODE_ADDR + 16);
+    t_use(NULL);
+
+    pool_run(&pool, jobs, NUM_CPUS);
+
+    CHECK_MSG(ARMV2STATUS_BREAKPOINT == jobs[1].status, "status is %d, expected ARMV2STATUS_BREAKPOINT",
+              jobs[1].status);
+    t_use(jobs[1].cpu);
+    reset_breakpoints(cpu);
+    CHECK_PC(CODE_ADDR + 16);
+    CHECK_REG(2, 0);
+    t_use(NULL);
+    for( int i = 0; i < NUM_CPUS; i++ ) {
+        if( 1 != i ) {
+            CHECK_MSG(ARMV2STATUS_OK == jobs[i].status, "cpu %d status is %d", i, jobs[i].status);
+        }
+    }
+    pool_cleanup(&pool);
+    release_others();
+}
+
+TEST(pool_needs_a_thread)
+{
+    struct armv2_pool pool;
+
+    CHECK_MSG(ARMV2STATUS_INVALID_ARGS == pool_init(&pool, 0), "a pool with no threads should be refused");
+}
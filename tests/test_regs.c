@@ -0,0 +1,75 @@
+/* Getting and setting every register at once with get_all_regs and set_all_regs.
+ *
+ * The block has the registers the current mode sees followed by all of them,
+ * so these check that the two halves agree about the banked registers, and
+ * that setting them picks the right bank for the mode being set.
+ */
+#include "harness.h"
+#include "encode.h"
+
+static uint32_t regs[ALL_REGS_SIZE];
+
+TEST(get_all_regs_has_the_banked_registers)
+{
+    t_setreg(0, 0x1234);
+    t_setactual(R_SP, 0x11111111);
+    t_setactual(R13_S, 0x22222222);
+    t_setactual(R13_I, 0x33333333);
+    t_setactual(PC, (CODE_ADDR + 0x40) | FLAG_Z | MODE_SUP);
+    bank_registers(cpu);
+
+    CHECK_MSG(ARMV2STATUS_OK == get_all_regs(cpu, regs), "get_all_regs failed");
+
+    CHECK_HEX("r0", regs[ALL_REGS_EFFECTIVE], 0x1234);
+    CHECK_HEX("r13", regs[ALL_REGS_EFFECTIVE + R_SP], 0x22222222);
+    CHECK_HEX("user r13", regs[ALL_REGS_ACTUAL + R_SP], 0x11111111);
+    CHECK_HEX("irq r13", regs[ALL_REGS_ACTUAL + R13_I], 0x33333333);
+    CHECK_HEX("cpsr", regs[ALL_REGS_CPSR], FLAG_Z | MODE_SUP);
+    CHECK_HEX("mode", regs[ALL_REGS_MODE], MODE_SUP);
+}
+
+/* Flags from the last instruction are worked out before they're copied */
+TEST(get_all_regs_sees_pending_flags)
+{
+    t_setreg(0, 3);
+    t_exec(dp_imm(C_AL, OP_CMP, 1, 0, 0, 0, 3));       /* cmp r0, #3 */
+
+    get_all_regs(cpu, regs);
+
+    CHECK_HEX("flags", regs[ALL_REGS_CPSR] & 0xf0000000, FLAG_Z | FLAG_C);
+    CHECK_HEX("pc", regs[ALL_REGS_PC], CODE_ADDR + 4);
+}
+
+TEST(set_all_regs_banks_for_the_new_mode)
+{
+    get_all_regs(cpu, regs);
+    regs[ALL_REGS_ACTUAL + R_SP]  = 0x11111111;
+    regs[ALL_REGS_ACTUAL + R13_I] = 0x33333333;
+    regs[ALL_REGS_EFFECTIVE + 1]  = 0x5555;
+    regs[ALL_REGS_EFFECTIVE + R_SP] = 0x44444444;
+    regs[ALL_REGS_EFFECTIVE + PC] = CODE_ADDR | FLAG_I | MODE_IRQ;
+
+    CHECK_MSG(ARMV2STATUS_OK == set_all_regs(cpu, regs), "set_all_regs failed");
+
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+    CHECK_REG(1, 0x5555);
+    /* the effective r13 goes over the top of the irq one it's banked to */
+    CHECK_REG(13, 0x44444444);
+    CHECK_HEX("irq r13", t_getactual(R13_I), 0x44444444);
+    CHECK_HEX("user r13", t_getactual(R_SP), 0x11111111);
+}
+
+TEST(set_all_regs_carries_on_from_r15)
+{
+    int32_t count = 1;
+
+    t_write(CODE_ADDR + 0x40, MOV_IMM(2, 7));
+    get_all_regs(cpu, regs);
+    regs[ALL_REGS_EFFECTIVE + PC] = (CODE_ADDR + 0x40) | MODE_SUP;
+    set_all_regs(cpu, regs);
+
+    run_armv2(cpu, &count);
+
+    CHECK_REG(2, 7);
+    CHECK_PC(CODE_ADDR + 0x44);
+}
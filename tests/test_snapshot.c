@@ -0,0 +1,279 @@
+/* Snapshots of the cpu and its RAM, and putting them back.
+ *
+ * Restoring maps the snapshot's copy of RAM back in privately, so these check
+ * that writes after a restore don't find their way back into the snapshot,
+ * that pages which came or went since are dealt with, and that code run before
+ * the restore isn't run again from the old decoded copy.
+ */
+#include <string.h>
+
+#include "harness.h"
+#include "encode.h"
+
+static struct armv2_snapshot snapshot;
+
+static void take_snapshot(void)
+{
+    CHECK_MSG(ARMV2STATUS_OK == snapshot_armv2(cpu, &snapshot), "snapshot_armv2 failed");
+}
+
+static void restore(void)
+{
+    CHECK_MSG(ARMV2STATUS_OK == restore_armv2(cpu, &snapshot), "restore_armv2 failed");
+}
+
+TEST(snapshot_restores_memory_and_registers)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    t_setreg(3, 0x33);
+    t_setflags("NzCv");
+    take_snapshot();
+
+    t_write(DATA_ADDR, 0x99999999);
+    t_setreg(3, 0);
+    t_setflags("nZcV");
+    restore();
+
+    CHECK_MEM(DATA_ADDR, 0x12345678);
+    CHECK_REG(3, 0x33);
+    CHECK_FLAGS("NzCv");
+    snapshot_cleanup(&snapshot);
+}
+
+/* Writing after one restore doesn't change what the next one puts back */
+TEST(snapshot_can_be_restored_again)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    take_snapshot();
+
+    restore();
+    t_write(DATA_ADDR, 0x99999999);
+    restore();
+
+    CHECK_MEM(DATA_ADDR, 0x12345678);
+    snapshot_cleanup(&snapshot);
+}
+
+TEST(snapshot_outlives_being_cleaned_up)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    take_snapshot();
+    restore();
+    snapshot_cleanup(&snapshot);
+
+    CHECK_MEM(DATA_ADDR, 0x12345678);
+    t_write(DATA_ADDR, 0x55);
+    CHECK_MEM(DATA_ADDR, 0x55);
+}
+
+TEST(snapshot_drops_pages_mapped_since)
+{
+    uint32_t generation;
+
+    take_snapshot();
+    t_fault(0x00800000);
+    generation = cpu->map_generation;
+
+    restore();
+
+    CHECK_MSG(NULL == cpu->page_tables[PAGEOF(0x00800000)], "the new page should be gone");
+    CHECK_MSG(cpu->map_generation != generation, "the memory map should have changed");
+    snapshot_cleanup(&snapshot);
+}
+
+/* Once the RAM is the snapshot's, a page given back has to come back as zeroes and not as the snapshot had it */
+TEST(snapshot_released_page_comes_back_empty)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    take_snapshot();
+    restore();
+
+    CHECK(ARMV2STATUS_OK == release_page(cpu, DATA_ADDR));
+    t_fault(DATA_ADDR);
+
+    CHECK_MEM(DATA_ADDR, 0);
+    snapshot_cleanup(&snapshot);
+}
+
+TEST(snapshot_keeps_the_zero_page_read_only)
+{
+    take_snapshot();
+
+    restore();
+
+    CHECK_MSG(NULL != cpu->page_tables[0], "page zero should be back");
+    CHECK_MSG(0 == (cpu->page_tables[0]->flags & PERM_WRITE), "page zero should not be writable");
+    snapshot_cleanup(&snapshot);
+}
+
+TEST(snapshot_code_is_decoded_again_after_restore)
+{
+    t_write(CODE_ADDR, MOV_IMM(0, 1));
+    take_snapshot();
+    t_write(CODE_ADDR, MOV_IMM(0, 2));
+    t_run(CODE_ADDR, 1);
+    CHECK_REG(0, 2);
+
+    restore();
+    t_run(CODE_ADDR, 1);
+
+    CHECK_REG(0, 1);
+    snapshot_cleanup(&snapshot);
+}
+
+TEST(snapshot_restores_the_hardware_manager_and_pins)
+{
+    cpu->hardware_manager.regs[1] = 0x77;
+    cpu->pins = PIN_F;
+    take_snapshot();
+    cpu->hardware_manager.regs[1] = 0;
+    cpu->pins = 0;
+
+    restore();
+
+    CHECK_HEX("cr1", cpu->hardware_manager.regs[1], 0x77);
+    CHECK_HEX("pins", cpu->pins, PIN_F);
+    snapshot_cleanup(&snapshot);
+}
+
+/* The irq pin says whether the queue has anything in it, so the queue comes
+ * back with it: what was waiting is taken again, and nothing posted since is */
+TEST(snapshot_restores_the_interrupt_queue)
+{
+    t_setflags("nzcvi");
+    t_write(CODE_ADDR, NOP);
+    interrupt(cpu, 1, 2);
+    take_snapshot();
+    t_run(CODE_ADDR, 1);
+    interrupt(cpu, 3, 4);
+    interrupt(cpu, 5, 6);
+
+    restore();
+
+    CHECK_MSG(PIN_ON(cpu, I), "the irq pin should be set for the interrupt that was waiting");
+    t_run(CODE_ADDR, 1);
+    CHECK_HEX("mode", t_getmode(), MODE_IRQ);
+    CHECK_HEX("id", cpu->hardware_manager.last_interrupt_id, 1);
+    CHECK_HEX("code", cpu->hardware_manager.last_interrupt_code, 2);
+    CHECK_MSG(!PIN_ON(cpu, I), "nothing posted after the snapshot should be left");
+    snapshot_cleanup(&snapshot);
+}
+
+TEST(snapshot_with_nothing_queued_clears_the_irq_pin)
+{
+    take_snapshot();
+    interrupt(cpu, 3, 4);
+
+    restore();
+
+    CHECK_MSG(!PIN_ON(cpu, I), "the irq pin should be clear as nothing was waiting");
+    CHECK_MSG(ARMV2STATUS_OK == interrupt(cpu, 3, 4), "the interrupt can be posted again");
+    CHECK_MSG(PIN_ON(cpu, I), "and sets the pin");
+    snapshot_cleanup(&snapshot);
+}
+
+static uint64_t count_event(void *extra, uint64_t cycles)
+{
+    (void)cycles;
+    (*(uint32_t*)extra)++;
+    return 0;
+}
+
+/* The clock goes back to the snapshot's time, and an event still to come is
+ * as far off as it was */
+TEST(snapshot_restores_the_clock)
+{
+    static uint32_t fired;
+    uint64_t then;
+
+    fired = 0;
+    t_write(CODE_ADDR, NOP);
+    t_run(CODE_ADDR, 1);
+    then = cpu->cycles;
+    take_snapshot();
+    t_run(CODE_ADDR, 1);
+    t_run(CODE_ADDR, 1);
+    schedule_event(cpu, 5, count_event, &fired);
+
+    restore();
+
+    CHECK_HEX("cycles", (uint32_t)cpu->cycles, (uint32_t)then);
+    CHECK_HEX("next event", (uint32_t)(cpu->next_event - cpu->cycles), 5);
+    snapshot_cleanup(&snapshot);
+    cancel_events(cpu, count_event, &fired);
+}
+
+static struct armv2 other;
+
+/* A fresh cpu to clone into, which the test then works on */
+static void use_other(void)
+{
+    t_use(&other);
+    t_reset();
+    t_use(NULL);
+}
+
+TEST(snapshot_clones_are_independent)
+{
+    t_write(DATA_ADDR, 0x12345678);
+    t_write(CODE_ADDR, MOV_IMM(0, 7));
+    t_setreg(3, 0x33);
+    cpu->cycles = 1234;
+    take_snapshot();
+    use_other();
+
+    CHECK_MSG(ARMV2STATUS_OK == clone_armv2(&other, cpu, &snapshot), "clone_armv2 failed");
+    t_write(DATA_ADDR, 0x99999999);
+
+    t_use(&other);
+    CHECK_MEM(DATA_ADDR, 0x12345678);
+    CHECK_REG(3, 0x33);
+    CHECK_HEX("cycles", (uint32_t)cpu->cycles, 1234);
+    t_run(CODE_ADDR, 1);
+    CHECK_REG(0, 7);
+    t_write(DATA_ADDR, 0x55);
+    t_use(NULL);
+
+    CHECK_MEM(DATA_ADDR, 0x99999999);
+    snapshot_cleanup(&snapshot);
+    t_release(&other);
+}
+
+TEST(snapshot_clone_maps_devices_where_they_were)
+{
+    static struct hardware_device device, copy;
+    uint32_t addr = 0x00800000;
+
+    memset(&device, 0, sizeof(device));
+    memset(&copy, 0, sizeof(copy));
+    add_hardware(cpu, &device);
+    CHECK_MSG(ARMV2STATUS_OK == map_memory(cpu, 0, addr, addr + PAGE_SIZE), "could not map the device");
+    take_snapshot();
+    use_other();
+    add_hardware(&other, &copy);
+
+    enum armv2_status status = clone_armv2(&other, cpu, &snapshot);
+    CHECK_MSG(ARMV2STATUS_OK == status, "clone_armv2 failed with %d", status);
+
+    CHECK_MSG(NULL != other.page_tables[PAGEOF(addr)], "the device should be mapped");
+    if( NULL != other.page_tables[PAGEOF(addr)] ) {
+        CHECK_MSG(&copy == other.page_tables[PAGEOF(addr)]->mapped_device, "the clone's own device should be mapped");
+    }
+    snapshot_cleanup(&snapshot);
+    t_release(&other);
+}
+
+TEST(snapshot_clone_needs_the_same_devices)
+{
+    static struct hardware_device device;
+
+    memset(&device, 0, sizeof(device));
+    add_hardware(cpu, &device);
+    take_snapshot();
+    use_other();
+
+    CHECK_MSG(ARMV2STATUS_NO_SUCH_DEVICE == clone_armv2(&other, cpu, &snapshot),
+              "a clone without the devices should be refused");
+    snapshot_cleanup(&snapshot);
+    t_release(&other);
+}
@@ -1,6 +1,9 @@
 /* Software interrupts, exception entry, breakpoints and watchpoints */
 #include "harness.h"
 #include "encode.h"
+#include "hw_manager.h"
+
+#define CP_HW_MANAGER 1
 
 TEST(swi_enters_supervisor_mode_at_the_vector)
 {
@@ -60,6 +63,29 @@ TEST(magic_swi_stops_the_emulator)
     CHECK_HEX("mode", t_getmode(), MODE_SUP);
 }
 
+/* Running forever there's nothing to stop for, so the magic swi is an
+ * ordinary one. The handler goes back to user mode and waits, which is the
+ * only thing that ends the run */
+TEST(magic_swi_is_an_swi_when_running_forever)
+{
+    int32_t count = -1;
+    enum armv2_status status;
+
+    t_setreg(0, (CODE_ADDR + 8) | MODE_USR);
+    t_write(CODE_ADDR, swi(C_AL, SWI_BREAKPOINT));
+    t_write(CODE_ADDR + 8, cdp(C_AL, CP_HW_MANAGER, WAIT_FOR_INTERRUPT, 0, 0, 0, 0));
+    t_write(g_vector_table[EXCEPT_SOFTWARE_INTERRUPT], MOVS_PC(0));
+    cpu->pc = CODE_ADDR - 4;
+
+    status = run_armv2(cpu, &count);
+
+    CHECK_MSG(ARMV2STATUS_WAIT_FOR_INTERRUPT == status,
+              "status is %d, expected ARMV2STATUS_WAIT_FOR_INTERRUPT (%d)", status, ARMV2STATUS_WAIT_FOR_INTERRUPT);
+    CHECK_HEX("supervisor r14", t_getactual(LR_S) & 0x03fffffc, CODE_ADDR + 8);
+    CHECK_PC(CODE_ADDR + 12);
+    CHECK_MSG(!HASCPUFLAG(cpu, FOREVER), "the forever flag should be cleared by the end of the run");
+}
+
 TEST(breakpoint_stops_before_the_instruction)
 {
     t_write(CODE_ADDR, MOV_IMM(0, 42));
@@ -85,6 +111,38 @@ TEST(breakpoint_can_be_removed)
     CHECK_REG(0, 42);
 }
 
+/* Breakpoints are counted so that the run loop can skip looking for them when
+ * there are none, so setting one twice mustn't leave it counted twice */
+TEST(breakpoint_set_twice_is_removed_once)
+{
+    t_write(CODE_ADDR, MOV_IMM(0, 42));
+    set_breakpoint(cpu, CODE_ADDR);
+    set_breakpoint(cpu, CODE_ADDR);
+    unset_breakpoint(cpu, CODE_ADDR);
+
+    CHECK_MSG(!HASCPUFLAG(cpu, DEBUG), "no breakpoints are set");
+    enum armv2_status status = t_run(CODE_ADDR, 1);
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_REG(0, 42);
+}
+
+TEST(reset_breakpoints_removes_them_all)
+{
+    t_write(CODE_ADDR, MOV_IMM(0, 42));
+    set_breakpoint(cpu, CODE_ADDR);
+    set_watchpoint(cpu, READ_WATCHPOINT, DATA_ADDR);
+    reset_breakpoints(cpu);
+
+    CHECK_MSG(HASCPUFLAG(cpu, DEBUG), "the watchpoint is still set");
+    reset_watchpoints(cpu);
+    CHECK_MSG(!HASCPUFLAG(cpu, DEBUG), "nothing is set");
+
+    enum armv2_status status = t_run(CODE_ADDR, 1);
+
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+    CHECK_REG(0, 42);
+}
+
 /* Watchpoints are checked after the instruction has run, so the store has
  * already happened and the instruction will be executed again when the
  * emulator is resumed */
@@ -139,6 +197,21 @@ TEST(watchpoints_can_be_removed)
     CHECK_PC(CODE_ADDR + 4);
 }
 
+/* Removing the read half of an access watchpoint leaves the write half */
+TEST(access_watchpoint_read_half_removed)
+{
+    t_setreg(1, DATA_ADDR);
+    set_watchpoint(cpu, ACCESS_WATCHPOINT, DATA_ADDR);
+    unset_watchpoint(cpu, READ_WATCHPOINT, DATA_ADDR);
+
+    enum armv2_status status = t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 1, 1, 0, 0));   /* ldr r0, [r1] */
+    CHECK_MSG(ARMV2STATUS_OK == status, "status is %d, expected ARMV2STATUS_OK", status);
+
+    status = t_exec(sdt(C_AL, 0, 1, 1, 0, 0, 0, 1, 0, 0));                      /* str r0, [r1] */
+    CHECK_MSG(ARMV2STATUS_BREAKPOINT == status, "status is %d, expected ARMV2STATUS_BREAKPOINT (%d)",
+              status, ARMV2STATUS_BREAKPOINT);
+}
+
 /* Code pages are faulted in on demand, the same as data pages. A freshly
  * faulted page is zeroed, and an all zero word is "andeq r0, r0, r0", which
  * with Z clear does nothing at all -- so all this checks is that we carried on